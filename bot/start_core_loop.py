@@ -1,6 +1,7 @@
 import asyncio
 from taxi_stats.core import QueryCore
-import logging, sys, json
+from taxi_stats.db_interface import DataBase
+import logging, multiprocessing, os, queue, sys, json, time
 
 
 def load_from_file(core: QueryCore):
@@ -22,20 +23,160 @@ def load_from_file(core: QueryCore):
         core.db.routes_table.insert_data(route, 0)
 
 
-async def start():
+def setup_logging(prefix: str = ""):
+    logging.basicConfig(
+        format=f"%(asctime)s - %(levelname)s - {prefix}%(message)s",
+        level=logging.DEBUG,
+        stream=sys.stdout,
+    )
+
+
+def load_config() -> dict:
     config_file = "configs/yandex_taxi_api.json"
     with open(config_file, "r", encoding="utf-8") as file:
-        config = json.load(file)
+        return json.load(file)
+
+
+def make_core(config: dict, partition=None) -> QueryCore:
+    spool_dir = config.get("spool_dir")
+    if spool_dir is not None and partition is not None:
+        # Спул - журнал одного процесса, у каждого воркера свой каталог
+        spool_dir = os.path.join(spool_dir, f"worker-{partition[0]}")
+    return QueryCore(
+        CLID=config.get("CLID"),
+        APIKEY=config.get("APIKEY"),
+        max_concurrency=config.get("max_concurrency", 50),
+        requests_per_second=config.get("requests_per_second"),
+        requests_burst=config.get("requests_burst"),
+        responses_per_commit=config.get("responses_per_commit", 1),
+        response_cache_ttl=config.get("response_cache_ttl"),
+        response_cache_size=config.get("response_cache_size", 10000),
+        partition=partition,
+        job_queue=config.get("job_queue", False),
+        job_lease=config.get("job_lease", 120),
+        job_batch=config.get("job_batch", 100),
+        schedule_in_db=config.get("schedule_in_db", False),
+        compact_schedule=config.get("compact_schedule", False),
+        ingest_queue_size=config.get("ingest_queue_size", 1000),
+        ingest_batch_size=config.get("ingest_batch_size", 100),
+        spool_dir=spool_dir,
+        retention_months=config.get("retention_months"),
+    )
+
 
-    core = QueryCore(CLID=config.get("CLID"), APIKEY=config.get("APIKEY"))
+async def start():
+    config = load_config()
+    core = make_core(config)
     # load_from_file(core)
     await core.run_event_loop()
 
 
+# Режим нескольких процессов: супервизор и воркеры
+
+
+async def report_health(core: QueryCore, health_queue, interval: float):
+    while True:
+        health_queue.put(core.health())
+        await asyncio.sleep(interval)
+
+
+async def run_worker(config: dict, partition, health_queue, interval: float):
+    core = make_core(config, partition)
+    reporter = asyncio.create_task(report_health(core, health_queue, interval))
+    try:
+        await core.run_event_loop()
+    finally:
+        reporter.cancel()
+
+
+def worker_main(config: dict, partition, health_queue, interval: float):
+    setup_logging(prefix=f"[worker {partition[0]}/{partition[1]}] ")
+    asyncio.run(run_worker(config, partition, health_queue, interval))
+
+
+def supervise(config: dict, workers: int, interval: float = 30):
+    """
+    Запуск workers процессов QueryCore, каждый со своим разделом
+    маршрутов (route_id % workers). Собирает от воркеров состояние,
+    логирует пропускную способность и перезапускает упавшие процессы.
+    """
+    # Таблицы создаются один раз до запуска воркеров, чтобы они не гонялись за DDL
+    DataBase().close()
+
+    context = multiprocessing.get_context("spawn")
+    health_queue = context.Queue()
+    processes: dict[int, multiprocessing.Process] = {}
+    health: dict[int, dict] = {}
+    reported: dict[int, dict] = {}
+
+    def spawn(index: int):
+        process = context.Process(
+            target=worker_main,
+            args=(config, (index, workers), health_queue, interval),
+            name=f"query-core-{index}",
+            daemon=True,
+        )
+        process.start()
+        processes[index] = process
+        logging.info(f"[Supervisor] Запущен воркер {index}: pid={process.pid}")
+
+    for index in range(workers):
+        spawn(index)
+
+    last_summary = time.monotonic()
+    while True:
+        try:
+            report = health_queue.get(timeout=interval)
+            health[report["partition"][0]] = report
+        except queue.Empty:
+            pass
+
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                logging.error(
+                    f"[Supervisor] Воркер {index} завершился "
+                    f"(код {process.exitcode}), перезапуск"
+                )
+                health.pop(index, None)
+                reported.pop(index, None)
+                spawn(index)
+
+        if time.monotonic() - last_summary < interval:
+            continue
+
+        elapsed = time.monotonic() - last_summary
+        last_summary = time.monotonic()
+        total = 0.0
+        for index in range(workers):
+            report = health.get(index)
+            if report is None:
+                logging.warning(f"[Supervisor] Воркер {index}: нет данных")
+                continue
+
+            previous = reported.get(index, report)
+            rate = (report["requests"] - previous["requests"]) / elapsed
+            total += rate
+            age = time.time() - report["time"]
+            level = logging.WARNING if age > 3 * interval else logging.INFO
+            logging.log(
+                level,
+                f"[Supervisor] Воркер {index} (pid={report['pid']}): "
+                f"{rate:.2f} запр/с, запросов {report['requests']}, "
+                f"ошибок {report['failed']}, опоздание {report['last_lateness']:.3f}s, "
+                f"очередь записи {report['ingest_depth']} ({report['ingest_flush']:.3f}s), "
+                f"отчет {age:.0f}s назад",
+            )
+            reported[index] = report
+
+        logging.info(f"[Supervisor] Всего: {total:.2f} запр/с")
+
+
 if __name__ == "__main__":
-    logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        level=logging.DEBUG,
-        stream=sys.stdout,
-    )
-    asyncio.run(start())
+    config = load_config()
+    workers = config.get("workers", 1)
+    if workers > 1:
+        setup_logging()
+        supervise(config, workers, config.get("health_interval", 30))
+    else:
+        setup_logging()
+        asyncio.run(start())
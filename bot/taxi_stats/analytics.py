@@ -0,0 +1,218 @@
+from .db_interface import DataBase
+from datetime import datetime
+from typing import Iterable, Optional
+import numpy as np
+
+DAYS_PER_WEEK = 7
+HOURS_PER_DAY = 24
+# 1970-01-01 - четверг (dow 4, воскресенье - 0 как в PostgreSQL)
+_EPOCH_DOW = 4
+
+
+class RouteSamples:
+    """
+    Замеры маршрута в непрерывных массивах NumPy, по возрастанию времени:
+    timestamps - время замера, секунды от 1970-01-01 (int64),
+    trip_class - номер класса поездки в classes (int16),
+    available - доступна ли поездка (bool),
+    price, wait_time, travel_time - цена, время ожидания и поездки, сек
+        (float64, NaN для недоступных поездок)
+
+    Создается из пачек строк DataBase.iter_route_samples (from_batches, load):
+    пачки сразу переводятся в массивы, списки строк целиком не хранятся.
+    """
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        trip_class: np.ndarray,
+        classes: list[str],
+        available: np.ndarray,
+        price: np.ndarray,
+        wait_time: np.ndarray,
+        travel_time: np.ndarray,
+    ) -> None:
+        self.timestamps = timestamps
+        self.trip_class = trip_class
+        self.classes = classes
+        self.available = available
+        self.price = price
+        self.wait_time = wait_time
+        self.travel_time = travel_time
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def from_batches(batches: Iterable[list[tuple]]) -> "RouteSamples":
+        """
+        batches - пачки строк со столбцами DataBase.sample_columns
+        """
+        classes: dict[str, int] = {}
+        timestamps, trip_class, available, values = [], [], [], []
+        for rows in batches:
+            columns = list(zip(*rows))
+            timestamps.append(np.array(columns[0], dtype="datetime64[s]").astype(np.int64))
+            trip_class.append(
+                np.fromiter(
+                    (classes.setdefault(name, len(classes)) for name in columns[2]),
+                    dtype=np.int16,
+                    count=len(rows),
+                )
+            )
+            available.append(np.array(columns[3], dtype=bool))
+            # None (недоступная поездка) -> NaN
+            values.append(np.array(columns[4:7], dtype=np.float64))
+
+        def concatenate(parts, dtype, axis=0):
+            if len(parts) == 0:
+                return np.empty((3, 0) if axis else 0, dtype=dtype)
+            return np.concatenate(parts, axis=axis)
+
+        values = concatenate(values, np.float64, axis=1)
+        return RouteSamples(
+            timestamps=concatenate(timestamps, np.int64),
+            trip_class=concatenate(trip_class, np.int16),
+            classes=list(classes),
+            available=concatenate(available, bool),
+            price=values[0],
+            wait_time=values[1],
+            travel_time=values[2],
+        )
+
+    def load(
+        db: DataBase,
+        route_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        batch_size: int = 10000,
+    ) -> "RouteSamples":
+        """
+        Загрузка замеров маршрута за [start, end)
+        """
+        return RouteSamples.from_batches(
+            db.iter_route_samples(route_id, start, end, batch_size=batch_size)
+        )
+
+    def select(self, mask: np.ndarray) -> "RouteSamples":
+        """
+        Подмножество замеров по булевой маске
+        """
+        return RouteSamples(
+            timestamps=self.timestamps[mask],
+            trip_class=self.trip_class[mask],
+            classes=self.classes,
+            available=self.available[mask],
+            price=self.price[mask],
+            wait_time=self.wait_time[mask],
+            travel_time=self.travel_time[mask],
+        )
+
+    def of_class(self, trip_class: str) -> "RouteSamples":
+        if trip_class not in self.classes:
+            return self.select(np.zeros(len(self), dtype=bool))
+        return self.select(self.trip_class == self.classes.index(trip_class))
+
+    def day_of_week(self) -> np.ndarray:
+        """
+        День недели каждого замера: воскресенье - 0
+        """
+        return ((self.timestamps // 86400 + _EPOCH_DOW) % DAYS_PER_WEEK).astype(np.int8)
+
+    def hour(self) -> np.ndarray:
+        return ((self.timestamps // 3600) % HOURS_PER_DAY).astype(np.int8)
+
+
+def percentiles(values: np.ndarray, q=(50, 90, 95, 99)) -> np.ndarray:
+    """
+    Перцентили q без учета NaN (недоступных поездок)
+    return массив той же длины, что q (NaN, если значений нет)
+    """
+    q = np.asarray(q, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.full(q.shape, np.nan)
+    return np.percentile(values, q)
+
+
+def rolling_median(values: np.ndarray, window: int, chunk_size: int = 65536) -> np.ndarray:
+    """
+    Скользящая медиана по window последним значениям (без учета NaN).
+    Первые window - 1 элементов - NaN.
+    Окна обрабатываются блоками по chunk_size, чтобы копия окон
+    занимала не больше chunk_size * window значений
+    """
+    if window <= 0:
+        raise ValueError(f"window must be positive: {window}")
+
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    for start in range(0, len(windows), chunk_size):
+        block = windows[start : start + chunk_size]
+        # Окна из одних NaN дают NaN (с предупреждением numpy, оно не нужно)
+        with np.errstate(all="ignore"):
+            valid = ~np.isnan(block).all(axis=1)
+            medians = np.full(len(block), np.nan)
+            if valid.any():
+                medians[valid] = np.nanmedian(block[valid], axis=1)
+        result[window - 1 + start : window - 1 + start + len(block)] = medians
+    return result
+
+
+def dow_hour_matrix(
+    samples: RouteSamples, values: Optional[np.ndarray] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Матрица день недели (7, воскресенье - 0) x час (24):
+    среднее values (по умолчанию - цена) по замерам без NaN и их число.
+    return (средние, количества); в пустых ячейках среднее - NaN
+    """
+    values = samples.price if values is None else values
+    valid = ~np.isnan(values)
+    cells = (samples.day_of_week().astype(np.int64) * HOURS_PER_DAY + samples.hour())[valid]
+    size = DAYS_PER_WEEK * HOURS_PER_DAY
+
+    counts = np.bincount(cells, minlength=size)
+    sums = np.bincount(cells, weights=values[valid], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return (
+        means.reshape(DAYS_PER_WEEK, HOURS_PER_DAY),
+        counts.reshape(DAYS_PER_WEEK, HOURS_PER_DAY),
+    )
+
+
+def availability_matrix(samples: RouteSamples) -> np.ndarray:
+    """
+    Доля замеров с доступной поездкой в ячейках день недели x час (NaN - нет замеров)
+    """
+    cells = samples.day_of_week().astype(np.int64) * HOURS_PER_DAY + samples.hour()
+    size = DAYS_PER_WEEK * HOURS_PER_DAY
+    counts = np.bincount(cells, minlength=size)
+    available = np.bincount(cells, weights=samples.available, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (available / counts).reshape(DAYS_PER_WEEK, HOURS_PER_DAY)
+
+
+def surge_ratio(samples: RouteSamples) -> np.ndarray:
+    """
+    Коэффициент повышения цены каждого замера: цена / медиана цены
+    того же класса поездки за весь период (NaN для недоступных поездок)
+    """
+    baselines = np.full(len(samples.classes), np.nan)
+    for index in range(len(samples.classes)):
+        baselines[index] = percentiles(samples.price[samples.trip_class == index], [50])[0]
+
+    if len(samples) == 0:
+        return np.empty(0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return samples.price / baselines[samples.trip_class]
+
+
+def surge_matrix(samples: RouteSamples) -> np.ndarray:
+    """
+    Средний коэффициент повышения цены (surge_ratio) в ячейках день недели x час
+    """
+    return dow_hour_matrix(samples, surge_ratio(samples))[0]
@@ -1,13 +1,42 @@
 import asyncio
 from .db_interface import DataBase
-from .taxi_route_info_api import TaxiRouteInfoApi
+from .db_schedule import DbSchedule
+from .db_tables import RoutesTable, RequestScheduleTable, FetchJobsTable, RawJson
+from .fan_out_executor import FanOutExecutor
+from .ingest_queue import IngestQueue
+from .route import Route
+from .route_cache import RouteCache
+from .spool import Spool
+from .taxi_route_info_api import (
+    AsyncTaxiRouteInfoApi,
+    CachedTaxiRouteInfoApi,
+    ApiResponse,
+)
 from .time_schedule import Week, Day
-from .trip_info import parse_response
+from .trip_info import TripInfo, parse_response
 from datetime import datetime, time, timedelta
+from typing import Optional
+import itertools
+import json
 import logging
+import os
+import psycopg2
+import socket
+import uuid
 
 
 def benchmark(func):
+    if asyncio.iscoroutinefunction(func):
+
+        async def async_wrapper(*args, **kwargs):
+            start = datetime.now()
+            ret = await func(*args, **kwargs)
+            finish = datetime.now()
+            logging.debug(f"Elapsed of {func.__name__}: {finish - start}")
+            return ret
+
+        return async_wrapper
+
     def wrapper(*args, **kwargs):
         start = datetime.now()
         ret = func(*args, **kwargs)
@@ -18,89 +47,770 @@ def benchmark(func):
     return wrapper
 
 
+class FetchResult:
+    """
+    Ответ API, ожидающий записи в БД.
+    Один ответ записывается для всех одинаковых маршрутов route_ids.
+    trips - разобранная из ответа статистика,
+    job_ids - задания очереди fetch_jobs, завершаемые вместе с записью ответа,
+    uid - уникальный ключ замера (для идемпотентной повторной записи)
+    """
+
+    def __init__(
+        self,
+        datetime: datetime,
+        route_ids: list[int],
+        response: ApiResponse,
+        trips: Optional[list[TripInfo]] = None,
+        job_ids: Optional[list[int]] = None,
+    ):
+        self.datetime = datetime
+        self.route_ids = route_ids
+        self.response = response
+        self.trips = trips
+        self.job_ids = job_ids
+        self.uid = uuid.uuid4().hex
+
+
 class QueryCore:
     """
     Запускает основной event_loop модуля выполнения запросов
+
+    max_concurrency - сколько запросов к API выполняется одновременно
+    requests_per_second - ограничение частоты запросов к API (None - без ограничения)
+    requests_burst - допустимый всплеск запросов сверх requests_per_second
+    responses_per_commit - сколько ответов API записывается одной транзакцией
+    response_cache_ttl - время жизни ответов API в кеше, сек (None - без кеша)
+    response_cache_size - максимальное число ответов в кеше
+    partition - (index, count): обрабатывать только маршруты route_id % count = index,
+        для запуска нескольких процессов на непересекающихся частях расписания
+    job_queue - режим очереди заданий: наступившие точки расписания записываются
+        в fetch_jobs, а запросы выполняются по заданиям, взятым в аренду.
+        Так несколько QueryCore на разных машинах делят работу без повторов
+        и подхватывают задания упавших воркеров
+    job_lease - время аренды задания, сек (пока ответ ждет записи в очереди
+        IngestQueue, аренда продлевается)
+    job_batch - сколько заданий берется за раз
+    schedule_in_db - не держать расписание в памяти, а искать ближайшую
+        точку запросом к индексу слотов расписания в БД (DbSchedule)
+    compact_schedule - держать расписание в памяти в компактном виде (CompactWeek)
+    ingest_queue_size - размер очереди отложенной записи ответов в БД (IngestQueue):
+        запросы к API не ждут записи, пока очередь не заполнена.
+        0 - писать в БД сразу после каждой точки расписания
+    ingest_batch_size - сколько ответов писатель забирает из очереди за раз
+    spool_dir - каталог локального спула: ответы, которые не удалось записать
+        из-за недоступности БД (или не поместившиеся в очередь записи),
+        сохраняются на диск и дописываются в БД после ее восстановления.
+        Ответы по заданиям очереди в спул не попадают: незавершенное задание
+        выполнится повторно
+    retention_months - сколько месяцев хранить сырые ответы и статистику
+        (месячные секции старше удаляются), None - хранить все
+    db_config_file - конфиг подключения к БД
     """
 
-    def __init__(self, CLID: str, APIKEY: str) -> None:
-        self.db = DataBase()
-        self.taxi_api = TaxiRouteInfoApi(CLID=CLID, APIKEY=APIKEY)
+    # Журнал изменений расписания чистится раз в changes_trim_interval
+    # от записей старше changes_retention
+    # Вместе с ним обслуживаются месячные секции (создание на partitions_ahead
+    # месяцев вперед и удаление старше retention_months)
+    changes_trim_interval = timedelta(hours=1)
+    changes_retention = timedelta(days=1)
+    partitions_ahead = 2
+    # Синхронизация расписания без уведомления (на случай потери уведомлений)
+    resync_interval = timedelta(minutes=10)
+    # Точки расписания, опоздавшие сильнее, пропускаются
+    max_dispatch_lateness = timedelta(minutes=5)
+    # Проверка заданий с истекшей арендой без уведомления
+    jobs_poll_interval = timedelta(seconds=10)
+    # Как часто проверять спул и дописывать его в БД
+    spool_replay_interval = timedelta(seconds=30)
+
+    def __init__(
+        self,
+        CLID: str,
+        APIKEY: str,
+        max_concurrency: int = 50,
+        requests_per_second: Optional[float] = None,
+        requests_burst: Optional[float] = None,
+        responses_per_commit: int = 1,
+        response_cache_ttl: Optional[float] = None,
+        response_cache_size: int = 10000,
+        partition: Optional[tuple[int, int]] = None,
+        job_queue: bool = False,
+        job_lease: float = 120,
+        job_batch: int = 100,
+        schedule_in_db: bool = False,
+        compact_schedule: bool = False,
+        ingest_queue_size: int = 1000,
+        ingest_batch_size: int = 100,
+        spool_dir: Optional[str] = None,
+        retention_months: Optional[int] = None,
+        db_config_file: str = "configs/database.yml",
+    ) -> None:
+        self.db = DataBase(db_config_file)
+        self.retention_months = retention_months
+        self.partition = partition
+        self.job_queue = job_queue
+        self.job_lease = timedelta(seconds=job_lease)
+        self.job_batch = job_batch
+        # Задания, ответы по которым ждут записи в IngestQueue (их аренда продлевается)
+        self._queued_jobs: set[int] = set()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.schedule_in_db = schedule_in_db
+        self.compact_schedule = compact_schedule
+        self.spool = None if spool_dir is None else Spool(spool_dir)
+        self.ingest: Optional[IngestQueue] = None
+        if ingest_queue_size > 0:
+            self.ingest = IngestQueue(
+                self._write_results,
+                max_size=ingest_queue_size,
+                batch_size=ingest_batch_size,
+            )
+        self.responses_per_commit = max(1, responses_per_commit)
+        if response_cache_ttl:
+            self.taxi_api = CachedTaxiRouteInfoApi(
+                CLID=CLID,
+                APIKEY=APIKEY,
+                cache_ttl=response_cache_ttl,
+                cache_size=response_cache_size,
+                connections_limit=max_concurrency,
+            )
+        else:
+            self.taxi_api = AsyncTaxiRouteInfoApi(
+                CLID=CLID, APIKEY=APIKEY, connections_limit=max_concurrency
+            )
+        self.executor = FanOutExecutor(
+            max_concurrency=max_concurrency,
+            rate_limit=requests_per_second,
+            burst=requests_burst,
+        )
+
+        # Подписка до первой загрузки, чтобы не пропустить изменения между ними
+        channels = [RoutesTable.changes_channel, RequestScheduleTable.changes_channel]
+        if job_queue:
+            channels.append(FetchJobsTable.jobs_channel)
+        self._listener = self.db.create_listener(channels)
+        self._watched_connection = None
+        self._schedule_changed = asyncio.Event()
+        self._jobs_ready = asyncio.Event()
+        # Кеш маршрутов загружается в run_event_loop и перезагружается
+        # по уведомлениям в пуле потоков БД (_reload_routes)
+        self.route_cache = RouteCache(self.db.routes_table)
+        self._routes_changed = True
+        self._routes_reload: Optional[asyncio.Task] = None
 
         self._load_schedule_from_db()
+        # Последняя запущенная точка расписания, поиск следующей ведется от нее
+        self._last_dispatch = datetime.now()
+        self.last_dispatch_lateness = timedelta(0)
+        # Счетчики для health()
+        self.ticks = 0
+        self.requests_done = 0
+        self.requests_failed = 0
+
+    def health(self) -> dict:
+        """
+        Состояние и счетчики работы (для супервизора процессов)
+        """
+        return {
+            "pid": os.getpid(),
+            "worker": self.worker_id,
+            "partition": self.partition,
+            "time": datetime.now().timestamp(),
+            "ticks": self.ticks,
+            "requests": self.requests_done,
+            "failed": self.requests_failed,
+            "last_lateness": self.last_dispatch_lateness.total_seconds(),
+            "routes": len(self.route_cache),
+            "ingest_depth": 0 if self.ingest is None else self.ingest.depth,
+            "ingest_flush": 0.0 if self.ingest is None else self.ingest.stats.last_flush,
+            "spooled": 0 if self.spool is None else self.spool.appended,
+        }
+
+    def _process_notifications(self):
+        """
+        Обработка уведомлений об изменениях в БД
+        """
+        changed = self._listener.poll()
+        if RoutesTable.changes_channel in changed:
+            self._request_routes_reload()
+        if RequestScheduleTable.changes_channel in changed:
+            self._schedule_changed.set()
+        if FetchJobsTable.jobs_channel in changed:
+            self._jobs_ready.set()
+        self._watch_listener()
+
+    def _request_routes_reload(self) -> asyncio.Task:
+        """
+        Запуск перезагрузки кеша маршрутов, если она еще не идет.
+        return задача перезагрузки
+        """
+        self._routes_changed = True
+        if self._routes_reload is None or self._routes_reload.done():
+            self._routes_reload = asyncio.create_task(self._reload_routes())
+        return self._routes_reload
+
+    async def _reload_routes(self):
+        """
+        Перезагрузка кеша маршрутов в пуле потоков БД, не блокируя event loop.
+        Изменения, пришедшие во время загрузки, загружаются еще раз
+        """
+        while self._routes_changed:
+            self._routes_changed = False
+            try:
+                await self.db.run_blocking(self.route_cache.reload)
+            except psycopg2.Error as e:
+                self._routes_changed = True
+                logging.error(f"[QueryCore] Ошибка загрузки маршрутов: {e!r}")
+                return
+
+    def _watch_listener(self):
+        """
+        Уведомления обрабатываются сразу по готовности сокета слушателя.
+        После переподключения слушателя сокет регистрируется заново.
+        """
+        connection = self._listener.connection
+        if connection is self._watched_connection:
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._watched_connection is not None:
+            loop.remove_reader(self._watched_fd)
+        self._watched_connection = connection
+        if connection is not None:
+            self._watched_fd = connection.fileno()
+            loop.add_reader(self._watched_fd, self._process_notifications)
 
     @benchmark
     def _load_schedule_from_db(self):
         """
-        Загрузка расписания из БД
+        Полная загрузка расписания из БД
         """
-        logging.info(f"[QueryCore] Обновление расписания из БД")
-        self._request_schedule = self.db.request_schedule_table.get_all_schedule()
+        if self.schedule_in_db:
+            logging.info(f"[QueryCore] Расписание читается из БД по запросу")
+            self._request_schedule = DbSchedule(
+                self.db.request_schedule_table, self.partition
+            )
+            self._changes_trimmed = datetime.now()
+            return
+
+        logging.info(f"[QueryCore] Загрузка расписания из БД")
+        (
+            self._schedule_snapshot,
+            self._request_schedule,
+        ) = self.db.request_schedule_table.get_schedule_snapshot(
+            partition=self.partition, compact=self.compact_schedule
+        )
+        self._changes_trimmed = datetime.now()
 
     @benchmark
-    def _parse_response(self, route_id, request_id, response):
+    def _sync_schedule_from_db(self):
         """
-        Парсинг данных от API taxi и распределение по соотв. таблицам
+        Применение к расписанию только изменений с прошлой синхронизации
+        (журнал изменений request_schedule)
+        """
+        if self.schedule_in_db:
+            # DbSchedule всегда читает актуальное расписание
+            self._maintain_db()
+            return
+
+        (
+            self._schedule_snapshot,
+            changes,
+        ) = self.db.request_schedule_table.get_changes(
+            self._schedule_snapshot, partition=self.partition
+        )
+        # Подряд идущие изменения одного вида применяются пакетом,
+        # порядок между добавлениями и удалениями сохраняется
+        for operation, group in itertools.groupby(changes, key=lambda change: change[0]):
+            items = [(route_id, mapping) for _, _, route_id, mapping in group]
+            if operation == "I":
+                self._request_schedule.add_mappings(items)
+            else:
+                self._request_schedule.remove_mappings(items)
+
+        if len(changes) > 0:
+            logging.info(f"[QueryCore] Применено изменений расписания: {len(changes)}")
+
+        self._maintain_db()
+
+    def _maintain_db(self):
+        """
+        Периодическая чистка журнала изменений расписания и обслуживание секций
+        """
+        if datetime.now() - self._changes_trimmed > self.changes_trim_interval:
+            self.db.request_schedule_table.trim_changes(self.changes_retention)
+            try:
+                self.db.maintain_partitions(
+                    months_ahead=self.partitions_ahead,
+                    retention_months=self.retention_months,
+                )
+            except psycopg2.Error as e:
+                # Секции могут одновременно обслуживать другие процессы
+                logging.warning(f"[QueryCore] Ошибка обслуживания секций: {e!r}")
+            self._changes_trimmed = datetime.now()
+
+    @benchmark
+    def _parse_response(self, response: ApiResponse) -> list[TripInfo]:
+        """
+        Парсинг данных от API taxi
         """
         if response.status_code == 200:
-            info_list = parse_response(response)
-            for obj in info_list:
-                if obj.is_available():
-                    self.db.available_trips_statistics_table.insert_data(
-                        request_id, route_id, obj
-                    )
-                else:
-                    self.db.unavailable_trips_statistics_table.insert_data(
-                        request_id, route_id, obj
-                    )
+            return parse_response(response.json())
+        return []
+
+    def _group_identical_routes(
+        self, ids: tuple[int, ...]
+    ) -> tuple[list[list[int]], list[int]]:
+        """
+        Группировка маршрутов с одинаковыми координатами (равные Route):
+        по каждой группе выполняется один запрос
+        return (группы route_id, route_id маршрутов, которых нет в кеше)
+        """
+        groups: dict[Route, list[int]] = {}
+        missing = []
+        for route_id in dict.fromkeys(ids):
+            try:
+                route = self.route_cache.get(route_id)
+            except KeyError as e:
+                logging.error(f"[QueryCore] Маршрут не найден: {e}")
+                missing.append(route_id)
+                continue
+
+            groups.setdefault(route, []).append(route_id)
+
+        return list(groups.values()), missing
 
     @benchmark
-    def _execute_request_from_api(self, route_id):
+    async def _execute_request_from_api(self, route_ids: list[int]) -> FetchResult:
         """
-        Выполнение запроса данных по маршруту
-        с сохранением всех данных в БД.
+        Выполнение одного запроса данных для группы одинаковых маршрутов
         """
-        route = self.db.routes_table.get_route(route_id)
+        logging.info(f"[QueryCore] Выполнение запроса для route_id={route_ids}")
+        route = self.route_cache.get(route_ids[0])
 
         current_datetime = datetime.now()
-        response = self.taxi_api.request(route)
-        request = self.taxi_api.params
-
-        request_id = self.db.requests_table.insert_data(
-            current_datetime.strftime("%Y-%m-%d %H:%M:%S"),
-            route_id,
-            request,
-            response.status_code,
-            response.json(),
+        response = await self.taxi_api.request(route)
+        return FetchResult(
+            current_datetime, route_ids, response, self._parse_response(response)
         )
-        self._parse_response(route_id, request_id, response)
+
+    def _request_params(self, response: ApiResponse) -> dict:
+        """
+        Параметры запроса для api_requests.
+        Ответ из кеша помечается, чтобы статистика не выдавала его за новый замер.
+        """
+        if not response.from_cache:
+            return response.request_params
+        return {
+            **response.request_params,
+            "from_cache": True,
+            "fetched_at": response.fetched_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def _response_body(response: ApiResponse) -> RawJson:
+        """
+        Тело ответа для api_requests - исходные байты, без повторного json.dumps.
+        Тело успешного ответа уже разобрано при парсинге (ApiResponse.json
+        запоминает результат), поэтому повторного разбора нет.
+        Тело, не являющееся JSON, сохраняется строкой в поле body
+        """
+        try:
+            response.json()
+        except ValueError:
+            return RawJson(
+                json.dumps({"body": response.content.decode("utf-8", errors="replace")})
+            )
+        return RawJson(response.content)
+
+    def _trips(self, result: FetchResult) -> list[TripInfo]:
+        if result.trips is None:
+            return self._parse_response(result.response)
+        return result.trips
+
+    def _record(self, result: FetchResult) -> dict:
+        """
+        Ответ API в виде записи для спула (сериализуемой в JSON)
+        """
+        return {
+            "uid": result.uid,
+            "datetime": result.datetime.strftime("%Y-%m-%d %H:%M:%S"),
+            "route_ids": list(result.route_ids),
+            "request": self._request_params(result.response),
+            "response_code": result.response.status_code,
+            "response_raw": QueryCore._response_body(result.response).text(),
+            "trips": [trip.to_json() for trip in self._trips(result)],
+        }
+
+    def _add_result(self, uow, result: FetchResult):
+        """
+        Запись результата запроса: тело ответа передается в БД как есть,
+        поездки - уже разобранными объектами
+        """
+        request = self._request_params(result.response)
+        response = QueryCore._response_body(result.response)
+        trips = self._trips(result)
+        datetime_text = result.datetime.strftime("%Y-%m-%d %H:%M:%S")
+        for route_id in result.route_ids:
+            uow.add_response(
+                datetime_text,
+                route_id,
+                request,
+                result.response.status_code,
+                response,
+                trips,
+                sample_uid=f"{result.uid}:{route_id}",
+            )
+
+    def _add_record(self, uow, record: dict):
+        """
+        Запись из спула. В записях старого формата тело ответа
+        хранится разобранным (response), а не исходным текстом (response_raw)
+        """
+        trips = [TripInfo.from_json(trip) for trip in record["trips"]]
+        if "response_raw" in record:
+            response = RawJson(record["response_raw"])
+        else:
+            response = record["response"]
+        for route_id in record["route_ids"]:
+            uow.add_response(
+                record["datetime"],
+                route_id,
+                record["request"],
+                record["response_code"],
+                response,
+                trips,
+                sample_uid=f"{record['uid']}:{route_id}",
+            )
+
+    def _is_connection_error(e: Exception) -> bool:
+        """
+        Ошибка связи с БД (стоит повторить позже), а не ошибка самих данных
+        """
+        return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
 
     @benchmark
-    async def _wait_next_task(self) -> list[int]:
+    def _store_results(self, results: list[FetchResult]):
         """
-        Ожидание времени следующего запроса в расписании.
-        Асинхронно ожидаем по минуте времени наступления события,
-        Периодически обновляем расписание из БД.
-        Возвращаем list[route_id] когда текущее время
-        с погрешностью в 1 мин удовлетворяет искомое.
+        Сохранение ответов и статистики в БД.
+        Каждые responses_per_commit ответов пишутся одной транзакцией:
+        ответ попадает в БД целиком вместе со статистикой или не попадает вовсе.
+        Задания очереди завершаются в той же транзакции; если аренду
+        уже перехватил другой воркер, транзакция откатывается.
+        Если БД недоступна, ответы сохраняются в спул (при наличии).
+        """
+        for start in range(0, len(results), self.responses_per_commit):
+            group = results[start : start + self.responses_per_commit]
+            try:
+                with self.db.unit_of_work() as uow:
+                    for result in group:
+                        if result.job_ids:
+                            completed = self.db.fetch_jobs_table.complete(
+                                result.job_ids, self.worker_id, connection=uow.connection
+                            )
+                            if completed != len(result.job_ids):
+                                raise RuntimeError(
+                                    f"lease lost for job_ids={result.job_ids}"
+                                )
+                        self._add_result(uow, result)
+            except Exception as e:
+                logging.error(
+                    f"[QueryCore] Ошибка записи в БД для route_id="
+                    f"{[result.route_ids for result in group]}: {e!r}"
+                )
+                if self.spool is not None and QueryCore._is_connection_error(e):
+                    for result in group:
+                        # Задания очереди не спулятся: их аренда истечет,
+                        # и маршрут будет запрошен заново
+                        if not result.job_ids:
+                            self.spool.append(self._record(result))
+
+    def _store_records(self, records: list[dict]):
+        """
+        Запись пачки записей спула одной транзакцией.
+        Повторно записанные замеры пропускаются (sample_uid), поэтому
+        воспроизведение можно повторять. Ошибка связи с БД прерывает
+        воспроизведение, запись с ошибкой в данных пропускается.
+        """
+        try:
+            with self.db.unit_of_work() as uow:
+                for record in records:
+                    self._add_record(uow, record)
+            return
+        except Exception as e:
+            if QueryCore._is_connection_error(e) or len(records) == 1:
+                raise
+
+        for record in records:
+            try:
+                with self.db.unit_of_work() as uow:
+                    self._add_record(uow, record)
+            except Exception as e:
+                if QueryCore._is_connection_error(e):
+                    raise
+                logging.error(
+                    f"[QueryCore] Запись спула {record['uid']} пропущена: {e!r}"
+                )
+
+    async def _run_spool_replayer(self):
         """
+        Периодический fsync спула (каждые fsync_interval) и воспроизведение
+        спула в БД (каждые spool_replay_interval), пока очередь записи
+        не перегружена. Ошибки логируются, обслуживание спула продолжается
+        """
+        last_replay = datetime.now()
         while True:
-            next_task_timepoint, ids = self._request_schedule.next_time_point()
-            if next_task_timepoint is not None:
-                delta = abs(next_task_timepoint - datetime.now())
-                logging.info(
-                    f"[QueryCore] Следующий запрос: {next_task_timepoint.isoformat()}"
+            await asyncio.sleep(self.spool.fsync_interval)
+            try:
+                await asyncio.to_thread(self.spool.sync)
+                if datetime.now() - last_replay < self.spool_replay_interval:
+                    continue
+                last_replay = datetime.now()
+                if self.ingest is not None and self.ingest.depth > self.ingest.batch_size:
+                    continue
+                if not self.spool.pending():
+                    continue
+
+                replayed = await self.db.run_blocking(
+                    self.spool.replay, self._store_records
                 )
-                if delta <= timedelta(minutes=1):
-                    await asyncio.sleep(delta.seconds + 1)
-                    return ids
+                logging.info(f"[QueryCore] Воспроизведение спула: {replayed}, {self.spool}")
+            except Exception as e:
+                logging.error(f"[QueryCore] Ошибка обслуживания спула: {e!r}")
 
+    def _search_start(
+        last_dispatch: datetime, now: datetime, max_lateness: timedelta
+    ) -> datetime:
+        """
+        Начало следующего поиска, если от last_dispatch точка не найдена.
+        Поиск идет не дальше 7 дней от начала дня, поэтому после последней
+        точки недели он сдвигается к now (с запасом max_lateness на точки,
+        которые еще можно выполнить), иначе планировщик останавливается
+        """
+        return max(last_dispatch, now - max_lateness)
+
+    async def _wait_next_task(self) -> tuple[datetime, tuple[int, ...]]:
+        """
+        Ожидание времени следующего запроса в расписании.
+        Спим ровно до ближайшей точки расписания; уведомление об изменении
+        расписания будит раньше - применяем изменения и пересчитываем срок.
+        Returns:
+            datetime: точка расписания, которую пора выполнить
+            tuple: route_id этой точки
+        """
+        last_sync = datetime.now()
+        while True:
+            if self.schedule_in_db:
+                # DbSchedule ищет точку запросом к БД
+                next_point, ids = await self.db.run_blocking(
+                    self._request_schedule.next_time_point, self._last_dispatch
+                )
             else:
+                next_point, ids = self._request_schedule.next_time_point(
+                    self._last_dispatch
+                )
+            now = datetime.now()
+            if next_point is not None and next_point <= now:
+                self._last_dispatch = next_point
+                if now - next_point > self.max_dispatch_lateness:
+                    logging.warning(
+                        f"[QueryCore] Пропуск точки {next_point.isoformat()}: "
+                        f"опоздание {now - next_point}"
+                    )
+                    continue
+                return next_point, ids
+
+            if next_point is None:
                 logging.info(f"[QueryCore] Следующий запрос не найден")
+                self._last_dispatch = QueryCore._search_start(
+                    self._last_dispatch, now, self.max_dispatch_lateness
+                )
+                timeout = self.resync_interval
+            else:
+                logging.info(f"[QueryCore] Следующий запрос: {next_point.isoformat()}")
+                timeout = min(next_point - now, self.resync_interval)
+
+            try:
+                await asyncio.wait_for(
+                    self._schedule_changed.wait(), timeout.total_seconds()
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            if datetime.now() - last_sync >= self.resync_interval:
+                # Запасной путь: проверяем слушатель и журнал без уведомления
+                self._process_notifications()
+                self._schedule_changed.set()
 
-            await asyncio.sleep(60)
+            if self._schedule_changed.is_set():
+                self._schedule_changed.clear()
+                await self.db.run_blocking(self._sync_schedule_from_db)
+                last_sync = datetime.now()
 
-            self._load_schedule_from_db()
+    @benchmark
+    async def _execute_requests(
+        self,
+        ids: tuple[int, ...],
+        target: datetime,
+        jobs: Optional[dict[int, int]] = None,
+    ):
+        """
+        Конкурентное выполнение запросов по всем маршрутам,
+        попавшим в одну точку расписания target, с ограничениями FanOutExecutor.
+        Ошибка одного маршрута не прерывает остальные.
+        jobs - {route_id: job_id} для заданий очереди: успешные завершаются
+        вместе с записью ответа, неудачные возвращаются в очередь
+        """
+        self.last_dispatch_lateness = datetime.now() - target
+        logging.info(
+            f"[QueryCore] Запуск точки {target.isoformat()}: "
+            f"маршрутов {len(ids)}, опоздание {self.last_dispatch_lateness}"
+        )
+        self._process_notifications()
+        if self._routes_changed or any(id not in self.route_cache for id in ids):
+            # Маршрутов точки нет в кеше - уведомление еще не обработано
+            await self._request_routes_reload()
+        groups, missing = self._group_identical_routes(ids)
+        if len(groups) < len(ids):
+            logging.info(
+                f"[QueryCore] Одинаковые маршруты объединены: "
+                f"{len(ids)} маршрутов -> {len(groups)} запросов"
+            )
+
+        results, stats = await self.executor.run(
+            self._execute_request_from_api, groups
+        )
+        logging.info(f"[QueryCore] Выполнено запросов: {stats}")
+        self.ticks += 1
+        self.requests_done += stats.tasks - stats.failed
+        self.requests_failed += stats.failed
+        if isinstance(self.taxi_api, CachedTaxiRouteInfoApi):
+            logging.info(
+                f"[QueryCore] Кеш ответов API: {self.taxi_api.cache}, "
+                f"общих ответов: {self.taxi_api.shared}"
+            )
+        fetched = []
+        # Задания маршрутов, которых нет, возвращаются в очередь
+        # (после max_attempts помечаются failed), а не ждут истечения аренды
+        failed_jobs = [] if jobs is None else [jobs[id] for id in missing]
+        for route_ids, result in zip(groups, results):
+            job_ids = None if jobs is None else [jobs[id] for id in route_ids]
+            if isinstance(result, Exception):
+                logging.error(
+                    f"[QueryCore] Ошибка запроса для route_id={route_ids}: {result!r}"
+                )
+                failed_jobs.extend(job_ids or [])
+            else:
+                result.job_ids = job_ids
+                fetched.append(result)
+
+        if self.ingest is None:
+            await self.db.run_blocking(self._store_results, fetched)
+        else:
+            for result in fetched:
+                if self.spool is not None and self.ingest.full() and not result.job_ids:
+                    # БД не успевает - не ждем места в очереди, а пишем на диск.
+                    # Задания очереди завершаются только при записи в БД,
+                    # поэтому их ответы ждут места в очереди
+                    self.spool.append(self._record(result))
+                else:
+                    self._queued_jobs.update(result.job_ids or ())
+                    await self.ingest.put(result)
+            logging.info(
+                f"[QueryCore] Очередь записи: {self.ingest.depth}, {self.ingest.stats}"
+            )
+        if len(failed_jobs) > 0:
+            await self.db.run(
+                self.db.fetch_jobs_table.release, failed_jobs, self.worker_id
+            )
+
+    async def _write_results(self, results: list[FetchResult]):
+        """
+        Запись пачки из очереди IngestQueue в пуле потоков БД
+        """
+        try:
+            await self.db.run_blocking(self._store_results, results)
+        finally:
+            for result in results:
+                self._queued_jobs.difference_update(result.job_ids or ())
+
+    async def _run_lease_keeper(self):
+        """
+        Режим очереди: продление аренды заданий, ответы по которым ждут
+        записи в IngestQueue. Задания завершаются только при записи ответа,
+        и без продления под нагрузкой аренда истекла бы в очереди:
+        задание забрал бы другой воркер, а записанный ответ был бы отброшен
+        """
+        while True:
+            await asyncio.sleep(self.job_lease.total_seconds() / 3)
+            if len(self._queued_jobs) == 0:
+                continue
+
+            job_ids = list(self._queued_jobs)
+            try:
+                extended = await self.db.run(
+                    self.db.fetch_jobs_table.extend,
+                    job_ids,
+                    self.worker_id,
+                    self.job_lease,
+                )
+            except psycopg2.Error as e:
+                logging.warning(f"[QueryCore] Ошибка продления аренды заданий: {e!r}")
+                continue
+            logging.info(
+                f"[QueryCore] Продлена аренда заданий: {extended} из {len(job_ids)}"
+            )
+
+    async def _run_scheduler(self):
+        """
+        Режим очереди: наступившие точки расписания записываются заданиями
+        в fetch_jobs. Планировщик работает в каждом QueryCore, повторы
+        одной точки от разных машин отбрасываются уникальным ключом.
+        """
+        while True:
+            target, ids = await self._wait_next_task()
+            added = await self.db.run(
+                self.db.fetch_jobs_table.enqueue, [(id, target) for id in ids]
+            )
+            logging.info(
+                f"[QueryCore] Точка {target.isoformat()}: "
+                f"добавлено заданий {added} из {len(ids)}"
+            )
+
+    async def _run_job_worker(self):
+        """
+        Режим очереди: выполнение заданий, взятых в аренду.
+        Задания одной точки расписания выполняются вместе (как в _execute_requests),
+        новых заданий ждем по уведомлению или jobs_poll_interval
+        (за это время могут истечь аренды упавших воркеров).
+        """
+        jobs_trimmed = datetime.now()
+        while True:
+            claimed = await self.db.run(
+                self.db.fetch_jobs_table.claim,
+                self.worker_id,
+                self.job_batch,
+                self.job_lease,
+            )
+            if len(claimed) == 0:
+                try:
+                    await asyncio.wait_for(
+                        self._jobs_ready.wait(),
+                        self.jobs_poll_interval.total_seconds(),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._jobs_ready.clear()
+                continue
+
+            by_target: dict[datetime, dict[int, int]] = {}
+            for job_id, route_id, due_at in claimed:
+                by_target.setdefault(due_at, {})[route_id] = job_id
+            for target, jobs in by_target.items():
+                await self._execute_requests(tuple(jobs), target, jobs)
+
+            if datetime.now() - jobs_trimmed > self.changes_trim_interval:
+                await self.db.run(self.db.fetch_jobs_table.trim, self.changes_retention)
+                jobs_trimmed = datetime.now()
 
     async def run_event_loop(self):
         """
@@ -108,8 +818,32 @@ class QueryCore:
             ждем наступления нужного события,
             выполняем запросы
         """
-        while True:
-            ids = await self._wait_next_task()
-            for route_id in ids:
-                logging.info(f"[QueryCore] Выполнение запроса для route_id={route_id}")
-                self._execute_request_from_api(route_id)
+        replayer = None
+        try:
+            await self._request_routes_reload()
+            self._watch_listener()
+            if self.ingest is not None:
+                self.ingest.start()
+            if self.spool is not None:
+                replayer = asyncio.create_task(self._run_spool_replayer())
+            if self.job_queue:
+                tasks = [self._run_scheduler(), self._run_job_worker()]
+                if self.ingest is not None:
+                    tasks.append(self._run_lease_keeper())
+                await asyncio.gather(*tasks)
+            else:
+                while True:
+                    target, ids = await self._wait_next_task()
+                    await self._execute_requests(ids, target)
+        finally:
+            if self._watched_connection is not None:
+                asyncio.get_running_loop().remove_reader(self._watched_fd)
+                self._watched_connection = None
+            if replayer is not None:
+                replayer.cancel()
+            if self.ingest is not None:
+                await self.ingest.close(timeout=30)
+            if self.spool is not None:
+                self.spool.close()
+            await self.taxi_api.close()
+            self._listener.close()
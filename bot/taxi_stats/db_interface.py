@@ -1,7 +1,148 @@
 import psycopg2
 from psycopg2 import pool
 import yaml
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterator, Optional
 from .db_tables import *
+from .migrations import SchemaMigrations
+
+
+class DbListener:
+    """
+    Подписка на уведомления PostgreSQL (LISTEN/NOTIFY) на выделенном соединении.
+    poll() не делает запросов к серверу, а только вычитывает
+    уже пришедшие в сокет уведомления, поэтому его можно звать часто.
+    При потере соединения переподключается и сообщает обо всех каналах,
+    т.к. уведомления за время разрыва потеряны.
+    """
+
+    def __init__(self, connect_params: dict, channels: list[str]) -> None:
+        self._connect_params = connect_params
+        self.channels = list(channels)
+        self.connection = None
+        self._connect()
+
+    def _connect(self):
+        self.connection = psycopg2.connect(**self._connect_params)
+        self.connection.autocommit = True
+        cursor = self.connection.cursor()
+        for channel in self.channels:
+            cursor.execute(f"LISTEN {channel};")
+        cursor.close()
+
+    def _reconnect(self) -> bool:
+        self.close()
+        try:
+            self._connect()
+            return True
+        except psycopg2.Error as e:
+            logging.error(f"[DbListener] Не удалось переподключиться: {e!r}")
+            self.connection = None
+            return False
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    def poll(self) -> set[str]:
+        """
+        return set каналов, по которым пришли уведомления с прошлого вызова
+        """
+        if self.connection is None:
+            return set(self.channels) if self._reconnect() else set()
+
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logging.error(f"[DbListener] Соединение потеряно: {e!r}")
+            return set(self.channels) if self._reconnect() else set()
+
+        channels = {notify.channel for notify in self.connection.notifies}
+        self.connection.notifies.clear()
+        return channels
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
+
+
+class UnitOfWork:
+    """
+    Набор записей, выполняемых в одной транзакции на одном соединении.
+    Создается через DataBase.unit_of_work().
+
+    Строки статистики копятся и пишутся пачкой (insert_many) вместе
+    с обновлением агрегатов (statistics_rollup) при flush() или при фиксации транзакции,
+    поэтому несколько ответов API можно сгруппировать в один commit.
+    """
+
+    def __init__(self, db: "DataBase", connection) -> None:
+        self.db = db
+        self.connection = connection
+        self.responses = 0
+        self._available: list[tuple[int, int, str, TripInfo]] = []
+        self._unavailable: list[tuple[int, int, str, TripInfo]] = []
+
+    def add_response(
+        self,
+        datetime: str,
+        route_id: int,
+        request,
+        response_code: int,
+        response,
+        trips: list[TripInfo],
+        sample_uid: Optional[str] = None,
+    ) -> Optional[int]:
+        """
+        Запись ответа API и полученной из него статистики
+        return id записи в api_requests или None, если замер sample_uid
+        уже записан (тогда и статистика не пишется повторно)
+        """
+        request_id = self.db.requests_table.insert_data(
+            datetime,
+            route_id,
+            request,
+            response_code,
+            response,
+            sample_uid=sample_uid,
+            connection=self.connection,
+        )
+        if request_id is None:
+            return None
+
+        for trip in trips:
+            if trip.is_available():
+                self._available.append((request_id, route_id, datetime, trip))
+            else:
+                self._unavailable.append((request_id, route_id, datetime, trip))
+
+        self.responses += 1
+        return request_id
+
+    def flush(self):
+        """
+        Запись накопленной статистики (без фиксации транзакции)
+        """
+        self.db.available_trips_statistics_table.insert_many(
+            self._available, connection=self.connection
+        )
+        self.db.unavailable_trips_statistics_table.insert_many(
+            self._unavailable, connection=self.connection
+        )
+        self.db.statistics_rollup_table.upsert_many(
+            [
+                (route_id, datetime, trip)
+                for _, route_id, datetime, trip in self._available + self._unavailable
+            ],
+            connection=self.connection,
+        )
+        self._available = []
+        self._unavailable = []
 
 
 class DataBase:
@@ -46,7 +187,11 @@ class DataBase:
         cursor.close()
         conn.close()
 
-    def __init__(self, config_file="configs/database.yml") -> None:
+    def __init__(self, config_file="configs/database.yml", async_workers=8) -> None:
+        """
+        async_workers - размер пула потоков для DataBase.run
+        (сколько запросов к БД выполняется параллельно из асинхронного кода)
+        """
         print(f"Создание бд из конфига: {config_file}")
         with open(config_file, "r") as file:
             config = yaml.safe_load(file)
@@ -59,22 +204,231 @@ class DataBase:
             port=config["postgres"]["port"],
         )
 
-        self._connection_pool = pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
+        # Потокобезопасный пул: соединения берутся и из потоков DataBase.run.
+        # 7 соединений постоянно заняты таблицами
+        self._connect_params = dict(
             dbname=config["postgres"]["dbname"],
             user=config["postgres"]["user"],
             password=config["postgres"]["password"],
             host=config["postgres"]["host"],
             port=config["postgres"]["port"],
         )
+        self._connection_pool = pool.ThreadedConnectionPool(
+            minconn=1, maxconn=11 + async_workers, **self._connect_params
+        )
 
-        self.routes_table = RoutesTable(self._connection_pool)
-        self.requests_table = ApiRequestsTable(self._connection_pool)
-        self.request_schedule_table = RequestScheduleTable(self._connection_pool)
-        self.unavailable_trips_statistics_table = UnavailableTripsStatisticsTable(
-            self._connection_pool
+        # Таблицы создаются под блокировкой изменений схемы: процессы, стартующие
+        # одновременно (воркеры супервизора), не выполняют DDL параллельно,
+        # а функции и триггеры таблиц создаются только вместе с таблицами
+        with self.connection() as connection:
+            migrations = SchemaMigrations(connection)
+            with migrations.locked():
+                self.routes_table = RoutesTable(self._connection_pool)
+                self.requests_table = ApiRequestsTable(self._connection_pool)
+                self.request_schedule_table = RequestScheduleTable(self._connection_pool)
+                self.fetch_jobs_table = FetchJobsTable(self._connection_pool)
+                self.unavailable_trips_statistics_table = UnavailableTripsStatisticsTable(
+                    self._connection_pool
+                )
+                self.available_trips_statistics_table = AvailableTripsStatisticsTable(
+                    self._connection_pool
+                )
+                self.statistics_rollup_table = StatisticsRollupTable(self._connection_pool)
+
+                self.maintain_partitions()
+                migrations.apply()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=async_workers, thread_name_prefix="db"
         )
-        self.available_trips_statistics_table = AvailableTripsStatisticsTable(
-            self._connection_pool
+
+    def partitioned_tables(self) -> list[PartitionedTable]:
+        return [
+            self.unavailable_trips_statistics_table,
+            self.available_trips_statistics_table,
+            self.requests_table,
+        ]
+
+    def maintain_partitions(
+        self,
+        months_ahead: int = 2,
+        retention_months: Optional[int] = None,
+        detach: bool = False,
+        connection=None,
+    ) -> list[str]:
+        """
+        Обслуживание месячных секций: создание секций с текущего месяца
+        на months_ahead месяцев вперед и, если задан retention_months,
+        удаление (при detach - отсоединение) секций старше retention_months
+        месяцев (текущий месяц не считается).
+        Статистика обрабатывается раньше api_requests.
+        return имена удаленных (отсоединенных) секций
+        """
+        current = PartitionedTable.month_start(date.today())
+        processed = []
+        for table in self.partitioned_tables():
+            table.create_partitions(
+                current,
+                PartitionedTable.add_months(current, months_ahead),
+                connection=connection,
+            )
+            if retention_months is not None:
+                processed += table.drop_partitions(
+                    PartitionedTable.add_months(current, -retention_months),
+                    detach=detach,
+                    connection=connection,
+                )
+
+        if processed:
+            logging.info(f"[DataBase] Удалены секции: {', '.join(processed)}")
+        return processed
+
+    def close(self):
+        """
+        Закрытие всех соединений пула и пула потоков
+        """
+        self._executor.shutdown(wait=True)
+        self._connection_pool.closeall()
+
+    def create_listener(self, channels: list[str]) -> DbListener:
+        """
+        Подписка на уведомления об изменениях (см. changes_channel таблиц)
+        """
+        return DbListener(self._connect_params, channels)
+
+    @contextmanager
+    def connection(self):
+        """
+        Отдельное соединение из пула (autocommit) на время блока with
+        """
+        connection = self._connection_pool.getconn()
+        connection.autocommit = True
+        try:
+            yield connection
+        finally:
+            self._connection_pool.putconn(connection, close=bool(connection.closed))
+
+    def _run_with_connection(self, func, args, kwargs):
+        with self.connection() as connection:
+            return func(*args, connection=connection, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Выполнение метода таблицы в пуле потоков на отдельном соединении,
+        не блокируя event loop. Метод должен принимать аргумент connection.
+
+        routes = await db.run(db.routes_table.get_all_routes, client_id=client_id)
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._run_with_connection, func, args, kwargs),
+        )
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        Выполнение блокирующей функции, работающей с БД (например,
+        с транзакциями unit_of_work), в пуле потоков, не блокируя event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
         )
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[UnitOfWork]:
+        """
+        Транзакция на отдельном соединении из пула:
+        фиксируется при успешном выходе из блока with,
+        при исключении откатывается целиком.
+
+        with db.unit_of_work() as uow:
+            uow.add_response(...)
+        """
+        connection = self._connection_pool.getconn()
+        connection.autocommit = False
+        try:
+            uow = UnitOfWork(self, connection)
+            yield uow
+            uow.flush()
+            connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+            raise
+        finally:
+            if not connection.closed:
+                connection.autocommit = True
+            self._connection_pool.putconn(connection, close=bool(connection.closed))
+
+    # Столбцы выгрузки замеров (iter_route_samples)
+    sample_columns = [
+        "datetime",
+        "route_id",
+        "trip_class",
+        "available",
+        "price",
+        "wait_time",
+        "travel_time",
+    ]
+
+    def iter_route_samples(
+        self,
+        route_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[list[tuple]]:
+        """
+        Сырые замеры маршрута (доступные и недоступные поездки) за [start, end)
+        по возрастанию времени, пачками по batch_size строк (столбцы sample_columns,
+        время ожидания и поездки в секундах).
+        Строки читаются именованным (серверным) курсором, поэтому в памяти
+        не больше одной пачки при любом размере выборки.
+        Выгрузка идет на отдельном соединении вне пула (открыто, пока генератор
+        не исчерпан или не закрыт close()): долгие выгрузки не занимают
+        соединения пула, нужные остальным запросам.
+        """
+        conditions = "route_id = %(route_id)s"
+        if start is not None:
+            conditions += " AND datetime >= %(start)s"
+        if end is not None:
+            conditions += " AND datetime < %(end)s"
+
+        connection = psycopg2.connect(**self._connect_params)
+        cursor = None
+        try:
+            # Выгрузка только читает: курсор живет в транзакции только для чтения
+            connection.set_session(readonly=True)
+            cursor = connection.cursor(name=f"route_samples_{route_id}")
+            cursor.itersize = batch_size
+            # Обе части идут по индексу (route_id, datetime) и сливаются без сортировки
+            cursor.execute(
+                f"""
+                SELECT datetime, route_id, trip_class, TRUE, price::float,
+                    EXTRACT(epoch FROM wait_time)::float,
+                    EXTRACT(epoch FROM travel_time)::float
+                FROM {AvailableTripsStatisticsTable.table_name}
+                WHERE {conditions}
+                UNION ALL
+                SELECT datetime, route_id, trip_class, FALSE, NULL, NULL, NULL
+                FROM {UnavailableTripsStatisticsTable.table_name}
+                WHERE {conditions}
+                ORDER BY 1;
+            """,
+                {"route_id": route_id, "start": start, "end": end},
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            try:
+                if cursor is not None:
+                    cursor.close()
+            except psycopg2.Error:
+                pass
+            connection.close()
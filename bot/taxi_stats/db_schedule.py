@@ -0,0 +1,33 @@
+from .db_tables import RequestScheduleTable
+from datetime import datetime
+from typing import Optional
+
+
+class DbSchedule:
+    """
+    Расписание, которое не хранится в памяти: ближайшая точка
+    на каждый вызов ищется в БД по индексу слотов
+    (RequestScheduleTable.get_next_time_point).
+    Повторяет используемую QueryCore часть интерфейса Week,
+    изменения расписания видны сразу, без синхронизации.
+    """
+
+    def __init__(
+        self,
+        schedule_table: RequestScheduleTable,
+        partition: Optional[tuple[int, int]] = None,
+    ) -> None:
+        self._schedule_table = schedule_table
+        self.partition = partition
+        self.queries = 0
+
+    def next_time_point(
+        self, from_datetime: Optional[datetime] = None
+    ) -> tuple[Optional[datetime], tuple[int, ...]]:
+        if from_datetime is None:
+            from_datetime = datetime.now()
+
+        self.queries += 1
+        return self._schedule_table.get_next_time_point(
+            from_datetime, partition=self.partition
+        )
@@ -1,9 +1,46 @@
 from .route import Route, GeographicCoordinate
-from .time_schedule import Week, Day
+from .time_schedule import Week, Day, CompactWeek, MINUTES_PER_DAY, MINUTES_PER_WEEK, day_of_week
 from .trip_info import TripInfo
+from psycopg2.extensions import ISQLQuote, QuotedString
+from psycopg2.extras import Json, execute_values
+import itertools
 import json
 from typing import Optional
-from datetime import time
+from datetime import date, datetime, time, timedelta
+
+
+class RawJson:
+    """
+    Уже закодированный JSON (bytes или str, например тело ответа API)
+    в качестве параметра запроса: подставляется в запрос как есть,
+    без разбора и повторного json.dumps, как это делает psycopg2.extras.Json
+    """
+
+    __slots__ = ("content", "_connection")
+
+    def __init__(self, content) -> None:
+        self.content = content
+        self._connection = None
+
+    def __conform__(self, protocol):
+        if protocol is ISQLQuote:
+            return self
+
+    def prepare(self, connection):
+        self._connection = connection
+
+    def getquoted(self) -> bytes:
+        quoted = QuotedString(self.content)
+        if self._connection is not None:
+            quoted.prepare(self._connection)
+        return quoted.getquoted()
+
+    def text(self) -> str:
+        return (
+            self.content.decode("utf-8")
+            if isinstance(self.content, bytes)
+            else self.content
+        )
 
 
 class DbTable:
@@ -14,7 +51,8 @@ class DbTable:
         self.db_connection = connection
 
     def __del__(self):
-        self.connection_pool.putconn(self.db_connection)
+        if not self.connection_pool.closed:
+            self.connection_pool.putconn(self.db_connection)
 
     def _table_exists(cursor, table_name):
         cursor.execute(
@@ -29,24 +67,251 @@ class DbTable:
         )
         return cursor.fetchone()[0]
 
+    def _partition_condition(column: str, partition: Optional[tuple[int, int]]) -> str:
+        """
+        SQL условие принадлежности строки разделу partition = (index, count):
+        column % count = index. Без раздела - все строки.
+        Записано через mod(), чтобы не путать с параметрами запроса (%s)
+        """
+        if partition is None:
+            return "TRUE"
+        index, count = partition
+        return f"mod({column}, {int(count)}) = {int(index)}"
+
     def _create_if_noexist(self, cursor, table_name: str, table_def: str):
         if not DbTable._table_exists(cursor, table_name=table_name):
             self.execute(table_def)
 
-    def execute(self, sql_request):
-        cursor = self.db_connection.cursor()
-        cursor.execute(sql_request)
+    def _create_notify_trigger(self, cursor, channel: str):
+        """
+        После любого изменения таблицы отправляется NOTIFY channel
+        (см. DbListener), уведомление доставляется при фиксации транзакции.
+        Функция и триггер создаются один раз (если триггера еще нет)
+        """
+        trigger_name = f"{self.table_name}_notify"
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s", (trigger_name,))
+        if cursor.fetchone() is None:
+            self.execute(
+                f"""
+                CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER {trigger_name}
+                AFTER INSERT OR UPDATE OR DELETE ON {self.table_name}
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('{channel}');
+            """
+            )
+
+    def _connection(self, connection=None):
+        """
+        Соединение для запроса: переданное явно (например, из транзакции
+        DataBase.unit_of_work) или собственное соединение таблицы
+        """
+        return self.db_connection if connection is None else connection
+
+    def execute(self, sql_request, params=None, connection=None):
+        cursor = self._connection(connection).cursor()
+        cursor.execute(sql_request, params)
         cursor.close()
 
-    def insert(self, sql_request) -> int:
+    def insert(self, sql_request, params=None, connection=None) -> Optional[int]:
         """
-        return id записи
+        return id записи (None, если запрос ничего не вернул, например ON CONFLICT DO NOTHING)
         """
-        cursor = self.db_connection.cursor()
-        cursor.execute(sql_request)
-        id = cursor.fetchone()[0]
+        cursor = self._connection(connection).cursor()
+        cursor.execute(sql_request, params)
+        row = cursor.fetchone()
         cursor.close()
-        return id
+        return None if row is None else row[0]
+
+    def insert_values(
+        self, sql_request, values: list[tuple], template=None, connection=None
+    ):
+        """
+        Вставка множества строк одним запросом.
+        sql_request должен содержать "VALUES %s"
+        """
+        if len(values) == 0:
+            return
+        cursor = self._connection(connection).cursor()
+        execute_values(
+            cursor, sql_request, values, template=template, page_size=len(values)
+        )
+        cursor.close()
+
+
+class PartitionedTable(DbTable):
+    """
+    Таблица, секционированная по месяцам (PARTITION BY RANGE) по столбцу
+    partition_column. Секции {table_name}_pYYYYMM создаются заранее
+    (create_partitions), строки вне созданных секций попадают в {table_name}_default.
+    Старые месяцы удаляются или отсоединяются целиком (drop_partitions),
+    без DELETE и последующего VACUUM.
+
+    Таблица, созданная до секционирования, при запуске переносится
+    в секционированную (_create_partitioned).
+    """
+
+    partition_column = "datetime"
+
+    def month_start(value: date) -> date:
+        return date(value.year, value.month, 1)
+
+    def add_months(month: date, count: int) -> date:
+        index = month.year * 12 + month.month - 1 + count
+        return date(index // 12, index % 12 + 1, 1)
+
+    def _is_partitioned(cursor, table_name: str) -> bool:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);",
+            (table_name,),
+        )
+        row = cursor.fetchone()
+        return row is not None and row[0]
+
+    def _create_partitioned(
+        self,
+        cursor,
+        table_def: str,
+        columns: list[str],
+        legacy_select: str,
+        legacy_prepare: str = "",
+    ):
+        """
+        Создание секционированной таблицы table_def (с секцией по умолчанию).
+        Если существует обычная таблица с тем же именем, она переименовывается,
+        ее строки переносятся запросом legacy_select (столбцы columns,
+        {legacy} - имя старой таблицы), после чего старая таблица удаляется.
+        Строки без времени переносятся с датой 1970-01-01 в секцию по умолчанию.
+        legacy_prepare выполняется над старой таблицей перед переносом.
+        """
+        legacy = f"{self.table_name}_legacy"
+        migrate = DbTable._table_exists(
+            cursor, self.table_name
+        ) and not PartitionedTable._is_partitioned(cursor, self.table_name)
+        if not migrate:
+            if not DbTable._table_exists(cursor, self.table_name):
+                self.execute(table_def)
+                self.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.table_name}_default
+                    PARTITION OF {self.table_name} DEFAULT;
+                """
+                )
+            return
+
+        # Перенос целиком в одной транзакции: при ошибке остается старая таблица
+        self.db_connection.autocommit = False
+        try:
+            self.execute(
+                f"""
+                ALTER TABLE {self.table_name} RENAME TO {legacy};
+                ALTER INDEX IF EXISTS {self.table_name}_pkey RENAME TO {legacy}_pkey;
+                ALTER SEQUENCE IF EXISTS {self.table_name}_id_seq RENAME TO {legacy}_id_seq;
+                {legacy_prepare.format(legacy=legacy)}
+            """
+            )
+            self.execute(table_def)
+            self.execute(
+                f"CREATE TABLE {self.table_name}_default PARTITION OF {self.table_name} DEFAULT;"
+            )
+
+            select = legacy_select.format(legacy=legacy)
+            cursor.execute(
+                f"""
+                SELECT min({self.partition_column}), max({self.partition_column})
+                FROM ({select}) q WHERE {self.partition_column} > '1970-01-01';
+            """
+            )
+            first, last = cursor.fetchone()
+            if first is not None:
+                self.create_partitions(first, last)
+            self.execute(
+                f"""
+                INSERT INTO {self.table_name} ({", ".join(columns)}) {select};
+                SELECT setval(
+                    pg_get_serial_sequence('{self.table_name}', 'id'),
+                    (SELECT COALESCE(max(id), 0) + 1 FROM {self.table_name}), false
+                );
+                DROP TABLE {legacy} CASCADE;
+            """
+            )
+            self.db_connection.commit()
+        except BaseException:
+            self.db_connection.rollback()
+            raise
+        finally:
+            self.db_connection.autocommit = True
+        print(f"Таблица {self.table_name} перенесена в секционированную")
+
+    def partition_name(self, month: date) -> str:
+        return f"{self.table_name}_p{month.year:04}{month.month:02}"
+
+    def create_partitions(self, first: date, last: date, connection=None):
+        """
+        Создание недостающих месячных секций с месяца first по месяц last включительно
+        """
+        month = PartitionedTable.month_start(first)
+        last = PartitionedTable.month_start(last)
+        while month <= last:
+            next_month = PartitionedTable.add_months(month, 1)
+            self.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.partition_name(month)}
+                PARTITION OF {self.table_name}
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}');
+            """,
+                connection=connection,
+            )
+            month = next_month
+
+    def partitions(self, connection=None) -> list[tuple[str, date]]:
+        """
+        return [(имя секции, месяц)] по возрастанию месяца (без секции по умолчанию)
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s);
+        """,
+            (self.table_name,),
+        )
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+        prefix = f"{self.table_name}_p"
+        result = []
+        for name in names:
+            suffix = name[len(prefix) :]
+            if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+                result.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+        return sorted(result, key=lambda partition: partition[1])
+
+    def drop_partitions(self, before: date, detach: bool = False, connection=None) -> list[str]:
+        """
+        Удаление (или отсоединение при detach, таблица секции остается)
+        секций месяцев, целиком предшествующих before
+        return имена обработанных секций
+        """
+        processed = []
+        for name, month in self.partitions(connection=connection):
+            if PartitionedTable.add_months(month, 1) > before:
+                break
+            if detach:
+                self.execute(
+                    f"ALTER TABLE {self.table_name} DETACH PARTITION {name};",
+                    connection=connection,
+                )
+            else:
+                self.execute(f"DROP TABLE {name};", connection=connection)
+            processed.append(name)
+        return processed
 
 
 class RoutesTable(DbTable):
@@ -54,15 +319,17 @@ class RoutesTable(DbTable):
     Таблица содержащая маршруты поездок.
     Маршруты для каждого клиента свои.
     Маршрут: откуда, куда, пользовательский комментарий
+    Изменения таблицы публикуются в канал changes_channel (LISTEN/NOTIFY)
 
     functions:
-        insert_data(self, route: Route, client_id: int) -> int
-        def delete_data(self, client_id: int, route_id: int)
-        get_route(self, route_id: int) -> Route
-        get_all_routes(self, client_id: Optional[int] = None) -> dict[int, Route]
+        insert_data(self, route: Route, client_id: int, connection=None) -> int
+        def delete_data(self, client_id: int, route_id: int, connection=None)
+        get_route(self, route_id: int, connection=None) -> Route
+        get_all_routes(self, client_id: Optional[int] = None, connection=None) -> dict[int, Route]
     """
 
     table_name = "routes"
+    changes_channel = "routes_changed"
 
     def __init__(self, db_connection_pool):
         DbTable.__init__(self, db_connection_pool)
@@ -82,9 +349,10 @@ class RoutesTable(DbTable):
         );
         """,
         )
+        self._create_notify_trigger(cursor, self.changes_channel)
         cursor.close()
 
-    def insert_data(self, route: Route, client_id: int) -> int:
+    def insert_data(self, route: Route, client_id: int, connection=None) -> int:
         return self.insert(
             f"""
             INSERT INTO {self.table_name} (
@@ -92,17 +360,21 @@ class RoutesTable(DbTable):
                 from_latitude, from_longitude, 
                 dest_latitude, dest_longitude, 
                 client_comment
-            ) VALUES (
-                {client_id}, 
-                {route.from_coords.latitude}, {route.from_coords.longitude}, 
-                {route.dest_coords.latitude}, {route.dest_coords.longitude}, 
-                '{route.comment}'
-            ) RETURNING route_id;
-        """
+            ) VALUES (%s, %s, %s, %s, %s, %s) RETURNING route_id;
+        """,
+            (
+                client_id,
+                route.from_coords.latitude,
+                route.from_coords.longitude,
+                route.dest_coords.latitude,
+                route.dest_coords.longitude,
+                route.comment,
+            ),
+            connection=connection,
         )
 
-    def get_route(self, route_id: int) -> Route:
-        cursor = self.db_connection.cursor()
+    def get_route(self, route_id: int, connection=None) -> Route:
+        cursor = self._connection(connection).cursor()
         cursor.execute(f"SELECT * FROM {self.table_name} WHERE route_id = {route_id};")
         row = cursor.fetchone()
         cursor.close()
@@ -112,16 +384,19 @@ class RoutesTable(DbTable):
             comment=row[6],
         )
 
-    def delete_data(self, client_id: int, route_id: int):
+    def delete_data(self, client_id: int, route_id: int, connection=None):
         return self.execute(
             f"""
             DELETE FROM {self.table_name}
             WHERE route_id = {route_id} AND client_id = {client_id};
-        """
+        """,
+            connection=connection,
         )
 
-    def get_all_routes(self, client_id: Optional[int] = None) -> dict[int, Route]:
-        cursor = self.db_connection.cursor()
+    def get_all_routes(
+        self, client_id: Optional[int] = None, connection=None
+    ) -> dict[int, Route]:
+        cursor = self._connection(connection).cursor()
         if client_id is None:
             cursor.execute(f"SELECT * FROM {self.table_name};")
         else:
@@ -141,39 +416,72 @@ class RoutesTable(DbTable):
         return routes
 
 
-class ApiRequestsTable(DbTable):
+class ApiRequestsTable(PartitionedTable):
     """
     Таблица содержащая отладочные данные:
     время запроса, сам запрос, ответ
 
     functions:
-        insert_data(self, datetime: str, route_id: int, request, response_code: int, response) -> int
+        insert_data(self, datetime: str, route_id: int, request, response_code: int, response, sample_uid=None, connection=None) -> Optional[int]
     """
 
     table_name = "api_requests"
+    columns = [
+        "id",
+        "datetime",
+        "route_id",
+        "request_params",
+        "response_code",
+        "response_json",
+        "sample_uid",
+    ]
 
     def __init__(self, db_connection_pool):
         DbTable.__init__(self, db_connection_pool)
         cursor = self.db_connection.cursor()
-        self._create_if_noexist(
+        self._create_partitioned(
             cursor,
-            self.table_name,
             f"""
             CREATE TABLE {self.table_name} (
-                id SERIAL PRIMARY KEY,                      -- ID запроса к api
-                datetime TIMESTAMP,                         -- когда запрос
+                id SERIAL,                                  -- ID запроса к api
+                datetime TIMESTAMP NOT NULL,                -- когда запрос
                 route_id INT REFERENCES routes(route_id),
                 request_params JSONB,                       -- параметры запроса
                 response_code INT,                          -- код ответа
-                response_json JSONB                         -- ответ
-            );
+                response_json JSONB,                        -- ответ
+                sample_uid TEXT,                            -- уникальный ключ замера
+                PRIMARY KEY (id, datetime),
+                UNIQUE (sample_uid, datetime)
+            ) PARTITION BY RANGE (datetime);
         """,
+            self.columns,
+            f"""
+            SELECT id, COALESCE(datetime, '1970-01-01') AS datetime, route_id, request_params,
+                response_code, response_json, sample_uid
+            FROM {{legacy}}
+        """,
+            legacy_prepare="ALTER TABLE {legacy} ADD COLUMN IF NOT EXISTS sample_uid TEXT;",
         )
         cursor.close()
 
     def insert_data(
-        self, datetime: str, route_id: int, request, response_code: int, response
-    ) -> int:
+        self,
+        datetime: str,
+        route_id: int,
+        request,
+        response_code: int,
+        response,
+        sample_uid: Optional[str] = None,
+        connection=None,
+    ) -> Optional[int]:
+        """
+        sample_uid - уникальный ключ замера: повторная запись с тем же ключом
+        и временем (например, при воспроизведении спула) пропускается
+        response - объект для JSON или RawJson (исходное тело ответа без повторного кодирования)
+        return id записи или None, если замер с sample_uid уже записан
+        """
+        if not isinstance(response, RawJson):
+            response = Json(response)
         return self.insert(
             f"""
             INSERT INTO {self.table_name} (
@@ -181,15 +489,13 @@ class ApiRequestsTable(DbTable):
                 route_id, 
                 request_params, 
                 response_code, 
-                response_json
-                ) VALUES (
-                    '{datetime}', 
-                    {route_id},
-                    '{json.dumps(request)}',
-                    {response_code},
-                    '{json.dumps(response)}'
-                ) RETURNING id;
-        """
+                response_json,
+                sample_uid
+                ) VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (sample_uid, datetime) DO NOTHING RETURNING id;
+        """,
+            (datetime, route_id, Json(request), response_code, response, sample_uid),
+            connection=connection,
         )
 
 
@@ -198,14 +504,33 @@ class RequestScheduleTable(DbTable):
     Таблица содержащая расписание запросов.
     Расписание - мапинг вида {'день недели': ['время1', 'время2']}
 
+    Все вставки и удаления журналируются триггером в changes_table_name
+    вместе с номером транзакции, что позволяет получать только изменения
+    с момента прошлого чтения (снимок txid_current_snapshot).
+    О самом факте изменений сообщается в канал changes_channel (LISTEN/NOTIFY).
+
+    JSONB расписание дублируется триггером в нормализованную таблицу
+    slots_table_name (schedule_id, route_id, day_of_week, minute_of_day)
+    с индексом по времени, по которой ближайшие точки и точки в окне
+    времени ищутся запросом, без загрузки всего расписания.
+    day_of_week как в Week.days_names (воскресенье - 0), точность - минута.
+
     functions:
-        insert_data(self, route_id: int, schedule: Week) -> int
-        delete_data(self, route_id: int)
-        get_route_schedule(self, route_id) -> list
-        get_all_schedule(self) -> list
+        insert_data(self, route_id: int, schedule: Week, connection=None) -> int
+        delete_data(self, route_id: int, connection=None)
+        get_route_schedule(self, route_id, connection=None) -> Week
+        get_all_schedule(self, connection=None) -> Week
+        get_schedule_snapshot(self, partition=None, compact=False, connection=None) -> tuple[str, Week]
+        get_changes(self, snapshot: str, partition=None, connection=None) -> tuple[str, list]
+        trim_changes(self, older_than: timedelta, connection=None)
+        get_due_routes(self, start: datetime, end: datetime, partition=None, connection=None) -> list[tuple[datetime, int]]
+        get_next_time_point(self, from_datetime: datetime, partition=None, connection=None) -> tuple[Optional[datetime], tuple[int, ...]]
     """
 
     table_name = "request_schedule"
+    changes_table_name = "request_schedule_changes"
+    slots_table_name = "request_schedule_slots"
+    changes_channel = "request_schedule_changed"
 
     def __init__(self, db_connection_pool):
         DbTable.__init__(self, db_connection_pool)
@@ -221,9 +546,94 @@ class RequestScheduleTable(DbTable):
             );
         """,
         )
+        self._create_if_noexist(
+            cursor,
+            self.changes_table_name,
+            f"""
+            CREATE TABLE {self.changes_table_name} (
+                revision BIGSERIAL PRIMARY KEY,
+                txid BIGINT DEFAULT txid_current(),         -- транзакция, внесшая изменение
+                created_at TIMESTAMP DEFAULT now(),
+                operation CHAR(1),                          -- I - добавлено, D - удалено
+                schedule_id INT,
+                route_id INT,
+                day_time_mapping JSONB
+            );
+            CREATE INDEX idx_{self.changes_table_name}_txid ON {self.changes_table_name} (txid);
+
+            CREATE OR REPLACE FUNCTION log_{self.table_name}_change() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    INSERT INTO {self.changes_table_name} (operation, schedule_id, route_id, day_time_mapping)
+                    VALUES ('D', OLD.id, OLD.route_id, OLD.day_time_mapping);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {self.changes_table_name} (operation, schedule_id, route_id, day_time_mapping)
+                    VALUES ('I', NEW.id, NEW.route_id, NEW.day_time_mapping);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER {self.table_name}_log
+            AFTER INSERT OR UPDATE OR DELETE ON {self.table_name}
+            FOR EACH ROW EXECUTE FUNCTION log_{self.table_name}_change();
+        """,
+        )
+        # Создание таблицы слотов переносит в нее уже существующие расписания
+        self._create_if_noexist(
+            cursor,
+            self.slots_table_name,
+            f"""
+            CREATE TABLE {self.slots_table_name} (
+                schedule_id INT REFERENCES {self.table_name}(id) ON DELETE CASCADE,
+                route_id INT,
+                day_of_week SMALLINT,                       -- 0 - воскресенье
+                minute_of_day SMALLINT,                     -- минута от начала дня
+                PRIMARY KEY (schedule_id, day_of_week, minute_of_day)
+            );
+            CREATE INDEX idx_{self.slots_table_name}_time
+                ON {self.slots_table_name} (day_of_week, minute_of_day, route_id);
+
+            CREATE OR REPLACE FUNCTION sync_{self.slots_table_name}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'UPDATE' THEN
+                    DELETE FROM {self.slots_table_name} WHERE schedule_id = OLD.id;
+                END IF;
+                INSERT INTO {self.slots_table_name} (schedule_id, route_id, day_of_week, minute_of_day)
+                {self._slots_select("NEW")}
+                ON CONFLICT DO NOTHING;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER {self.table_name}_slots
+            AFTER INSERT OR UPDATE ON {self.table_name}
+            FOR EACH ROW EXECUTE FUNCTION sync_{self.slots_table_name}();
+
+            INSERT INTO {self.slots_table_name} (schedule_id, route_id, day_of_week, minute_of_day)
+            {self._slots_select("r", f"{self.table_name} r, ")}
+            ON CONFLICT DO NOTHING;
+        """,
+        )
+        self._create_notify_trigger(cursor, self.changes_channel)
         cursor.close()
 
-    def insert_data(self, route_id: int, schedule: Week) -> int:
+    def _slots_select(self, row: str, from_tables: str = "") -> str:
+        """
+        SELECT строк таблицы слотов (schedule_id, route_id, day_of_week, minute_of_day)
+        из строки расписания row. from_tables - откуда берется row, если это не NEW
+        """
+        days = ", ".join(f"'{name}'" for name in Week.days_names)
+        return f"""
+                SELECT {row}.id, {row}.route_id,
+                    array_position(ARRAY[{days}], d.key) - 1,
+                    EXTRACT(hour FROM t.value::time) * 60 + EXTRACT(minute FROM t.value::time)
+                FROM {from_tables}jsonb_each({row}.day_time_mapping) d,
+                    jsonb_array_elements_text(d.value) t
+                WHERE array_position(ARRAY[{days}], d.key) IS NOT NULL"""
+
+    def insert_data(self, route_id: int, schedule: Week, connection=None) -> int:
         return self.insert(
             f"""
             INSERT INTO {self.table_name} (
@@ -233,145 +643,595 @@ class RequestScheduleTable(DbTable):
                     {route_id}, 
                     '{json.dumps(schedule.get_mapping())}'
                 ) RETURNING id;
-        """
+        """,
+            connection=connection,
         )
 
-    def delete_data(self, route_id: int):
+    def delete_data(self, route_id: int, connection=None):
         return self.execute(
             f"""
             DELETE FROM {self.table_name}
             WHERE route_id = {route_id};
-        """
+        """,
+            connection=connection,
         )
 
     def parse_get_response(self, rows) -> Week:
-        week = Week()
-        for row in rows:
-            id = row[0]
-            route_id = row[1]
-            schedule = row[2]
-            for day_name, time_list in schedule.items():
-                if len(time_list) > 0:
-                    day = Day(day_name)
-                    for time_str in time_list:
-                        key = time.fromisoformat(time_str)
-                        day.add_time(key)
-                        day.time_schedule[key].append(route_id)
-
-                    week.add(day=day)
+        """
+        Неделя из строк (id, route_id, day_time_mapping) за один проход,
+        rows может быть курсором
+        """
+        return Week.from_rows((row[1], row[2]) for row in rows)
 
+    def get_route_schedule(self, route_id: int, connection=None) -> Week:
+        cursor = self._connection(connection).cursor()
+        cursor.execute(f"SELECT * FROM {self.table_name} WHERE route_id = {route_id};")
+        week = self.parse_get_response(cursor)
+        cursor.close()
         return week
 
-    def get_route_schedule(self, route_id: int) -> Week:
-        cursor = self.db_connection.cursor()
-        cursor.execute(f"SELECT * FROM {self.table_name} WHERE route_id = {route_id};")
+    def get_all_schedule(self, connection=None) -> Week:
+        cursor = self._connection(connection).cursor()
+        cursor.execute(f"SELECT * FROM {self.table_name};")
+        week = self.parse_get_response(cursor)
+        cursor.close()
+        return week
+
+    def get_schedule_snapshot(
+        self,
+        partition: Optional[tuple[int, int]] = None,
+        compact: bool = False,
+        connection=None,
+    ) -> tuple[str, Week]:
+        """
+        Полное расписание и снимок транзакций, в котором оно прочитано
+        (один запрос - один снимок). Снимок передается в get_changes.
+        partition = (index, count) - только маршруты route_id % count = index
+        compact - вернуть расписание в виде CompactWeek
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            SELECT s.snapshot, r.id, r.route_id, r.day_time_mapping
+            FROM (SELECT txid_current_snapshot()::text AS snapshot) s
+            LEFT JOIN {self.table_name} r
+                ON {DbTable._partition_condition("r.route_id", partition)};
+        """
+        )
+        first = cursor.fetchone()
+        snapshot = first[0]
+        rows = (
+            row[1:] for row in itertools.chain([first], cursor) if row[1] is not None
+        )
+        if compact:
+            week = CompactWeek.from_mappings((row[1], row[2]) for row in rows)
+        else:
+            week = self.parse_get_response(rows)
+        cursor.close()
+        return snapshot, week
+
+    def get_changes(
+        self,
+        snapshot: str,
+        partition: Optional[tuple[int, int]] = None,
+        connection=None,
+    ) -> tuple[str, list]:
+        """
+        Изменения расписания, зафиксированные после снимка snapshot.
+        partition = (index, count) - только маршруты route_id % count = index
+        Returns:
+            str: новый снимок для следующего вызова
+            list: [(operation, schedule_id, route_id, day_time_mapping)] в порядке внесения
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            SELECT s.snapshot, c.operation, c.schedule_id, c.route_id, c.day_time_mapping
+            FROM (SELECT txid_current_snapshot()::text AS snapshot) s
+            LEFT JOIN {self.changes_table_name} c
+                ON c.txid >= txid_snapshot_xmin(%(prev)s::txid_snapshot)
+                AND NOT txid_visible_in_snapshot(c.txid, %(prev)s::txid_snapshot)
+                AND {DbTable._partition_condition("c.route_id", partition)}
+            ORDER BY c.revision;
+        """,
+            {"prev": snapshot},
+        )
         rows = cursor.fetchall()
         cursor.close()
-        return self.parse_get_response(rows)
+        return rows[0][0], [row[1:] for row in rows if row[1] is not None]
+
+    def trim_changes(self, older_than: timedelta, connection=None):
+        """
+        Удаление журнала изменений старше older_than
+        """
+        return self.execute(
+            f"DELETE FROM {self.changes_table_name} WHERE created_at < now() - %s;",
+            (older_than,),
+            connection=connection,
+        )
 
-    def get_all_schedule(self) -> Week:
+    def get_due_routes(
+        self,
+        start: datetime,
+        end: datetime,
+        partition: Optional[tuple[int, int]] = None,
+        connection=None,
+    ) -> list[tuple[datetime, int]]:
+        """
+        Точки расписания в окне [start, end) (не длиннее недели) по индексу слотов.
+        partition = (index, count) - только маршруты route_id % count = index
+        return [(datetime, route_id)] по возрастанию времени
+        """
+        first = start.replace(second=0, microsecond=0)
+        if first < start:
+            first += timedelta(minutes=1)
+        length = min(
+            MINUTES_PER_WEEK, -(-(end - first) // timedelta(minutes=1))
+        )
+        if length <= 0:
+            return []
+
+        from_minute = day_of_week(first) * MINUTES_PER_DAY + first.hour * 60 + first.minute
+        to_minute = from_minute + length
+        # Окно через конец недели - два диапазона индекса
+        ranges = [(from_minute, min(to_minute, MINUTES_PER_WEEK))]
+        if to_minute > MINUTES_PER_WEEK:
+            ranges.append((0, to_minute - MINUTES_PER_WEEK))
+
+        conditions = []
+        params = []
+        for low, high in ranges:
+            conditions.append(
+                "((day_of_week, minute_of_day) >= (%s, %s) AND (day_of_week, minute_of_day) < (%s, %s))"
+            )
+            params.extend(divmod(low, MINUTES_PER_DAY))
+            params.extend(divmod(high, MINUTES_PER_DAY))
+
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            SELECT day_of_week, minute_of_day, route_id FROM {self.slots_table_name}
+            WHERE ({" OR ".join(conditions)})
+                AND {DbTable._partition_condition("route_id", partition)}
+            ORDER BY day_of_week, minute_of_day, schedule_id;
+        """,
+            params,
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+
+        due = []
+        for dow, minute, route_id in rows:
+            offset = (dow * MINUTES_PER_DAY + minute - from_minute) % MINUTES_PER_WEEK
+            due.append((first + timedelta(minutes=offset), route_id))
+        due.sort(key=lambda point: point[0])
+        return due
+
+    def get_next_time_point(
+        self,
+        from_datetime: datetime,
+        partition: Optional[tuple[int, int]] = None,
+        connection=None,
+    ) -> tuple[Optional[datetime], tuple[int, ...]]:
+        """
+        Ближайшая точка расписания после from_datetime по индексу слотов,
+        с той же семантикой, что и Week.next_time_point
+        partition = (index, count) - только маршруты route_id % count = index
+        Returns:
+            datetime: следующая точка времени расписания. Если не найдено - None
+            tuple: route_id этой точки
+        """
+        condition = DbTable._partition_condition("route_id", partition)
+        day = day_of_week(from_datetime)
+        minute = from_datetime.hour * 60 + from_datetime.minute
+
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            WITH next AS (
+                (SELECT day_of_week, minute_of_day, FALSE AS wrapped
+                FROM {self.slots_table_name}
+                WHERE (day_of_week, minute_of_day) > (%s, %s) AND {condition}
+                ORDER BY day_of_week, minute_of_day LIMIT 1)
+                UNION ALL
+                (SELECT day_of_week, minute_of_day, TRUE AS wrapped
+                FROM {self.slots_table_name}
+                WHERE {condition}
+                ORDER BY day_of_week, minute_of_day LIMIT 1)
+                ORDER BY wrapped LIMIT 1
+            )
+            SELECT n.day_of_week, n.minute_of_day, n.wrapped, s.route_id
+            FROM next n
+            JOIN {self.slots_table_name} s
+                ON s.day_of_week = n.day_of_week AND s.minute_of_day = n.minute_of_day
+            WHERE {DbTable._partition_condition("s.route_id", partition)}
+            ORDER BY s.schedule_id;
+        """,
+            (day, minute),
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        if len(rows) == 0:
+            return None, ()
+
+        next_day, next_minute, wrapped, _ = rows[0]
+        offset = next_day * MINUTES_PER_DAY + next_minute - day * MINUTES_PER_DAY
+        if wrapped:
+            # Не дальше 7 дней от начала текущего дня
+            offset += MINUTES_PER_WEEK
+            if offset >= MINUTES_PER_WEEK:
+                return None, ()
+
+        next_point = datetime(
+            year=from_datetime.year, month=from_datetime.month, day=from_datetime.day
+        ) + timedelta(minutes=offset)
+        return next_point, tuple(row[3] for row in rows)
+
+
+class FetchJobsTable(DbTable):
+    """
+    Очередь заданий на запрос к API для работы нескольких QueryCore
+    (в том числе на разных машинах) с одной БД.
+    Задание - маршрут и точка расписания (route_id, due_at), повтор
+    одной и той же точки от разных планировщиков игнорируется.
+
+    Воркер забирает задания в аренду (claim, FOR UPDATE SKIP LOCKED) до lease_until:
+    одновременные claim не блокируют друг друга и не получают одно задание дважды.
+    Задания с истекшей арендой (воркер упал) забираются повторно,
+    но не более max_attempts раз, после чего помечаются failed.
+    О новых заданиях сообщается в канал jobs_channel (LISTEN/NOTIFY).
+
+    functions:
+        enqueue(self, jobs: list[tuple[int, datetime]], connection=None) -> int
+        claim(self, worker: str, limit: int, lease: timedelta, connection=None) -> list[tuple[int, int, datetime]]
+        complete(self, job_ids: list[int], worker: str, connection=None) -> int
+        release(self, job_ids: list[int], worker: str, connection=None) -> int
+        extend(self, job_ids: list[int], worker: str, lease: timedelta, connection=None) -> int
+        trim(self, older_than: timedelta, connection=None)
+    """
+
+    table_name = "fetch_jobs"
+    jobs_channel = "fetch_jobs_ready"
+    max_attempts = 3
+
+    def __init__(self, db_connection_pool):
+        DbTable.__init__(self, db_connection_pool)
         cursor = self.db_connection.cursor()
-        cursor.execute(f"SELECT * FROM {self.table_name};")
+        self._create_if_noexist(
+            cursor,
+            self.table_name,
+            f"""
+            CREATE TABLE {self.table_name} (
+                id BIGSERIAL PRIMARY KEY,
+                route_id INT REFERENCES {RoutesTable.table_name}(route_id),
+                due_at TIMESTAMP NOT NULL,                  -- точка расписания
+                status VARCHAR(10) DEFAULT 'pending',       -- pending, leased, done, failed
+                attempts INT DEFAULT 0,                     -- сколько раз задание забирали
+                worker TEXT,                                -- кто держит аренду
+                lease_until TIMESTAMP,
+                finished_at TIMESTAMP,
+                UNIQUE (route_id, due_at)
+            );
+            CREATE INDEX idx_{self.table_name}_ready ON {self.table_name} (due_at)
+                WHERE status IN ('pending', 'leased');
+        """,
+        )
+        cursor.close()
+
+    def enqueue(self, jobs: list[tuple[int, datetime]], connection=None) -> int:
+        """
+        Добавление заданий [(route_id, due_at)], уже существующие пропускаются
+        return сколько заданий добавлено
+        """
+        if len(jobs) == 0:
+            return 0
+        cursor = self._connection(connection).cursor()
+        inserted = execute_values(
+            cursor,
+            f"""
+            INSERT INTO {self.table_name} (route_id, due_at) VALUES %s
+            ON CONFLICT (route_id, due_at) DO NOTHING RETURNING id;
+        """,
+            jobs,
+            page_size=len(jobs),
+            fetch=True,
+        )
+        if len(inserted) > 0:
+            cursor.execute("SELECT pg_notify(%s, '');", (self.jobs_channel,))
+        cursor.close()
+        return len(inserted)
+
+    def claim(
+        self, worker: str, limit: int, lease: timedelta, connection=None
+    ) -> list[tuple[int, int, datetime]]:
+        """
+        Аренда до limit готовых заданий (новых или с истекшей арендой) на время lease.
+        Задания, заблокированные другими воркерами, пропускаются.
+        return [(job_id, route_id, due_at)] по возрастанию due_at
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            WITH ready AS (
+                SELECT id FROM {self.table_name}
+                WHERE status = 'pending'
+                    OR (status = 'leased' AND lease_until < now() AND attempts < %(max_attempts)s)
+                ORDER BY due_at
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {self.table_name} j
+            SET status = 'leased', worker = %(worker)s,
+                lease_until = now() + %(lease)s, attempts = j.attempts + 1
+            FROM ready WHERE j.id = ready.id
+            RETURNING j.id, j.route_id, j.due_at;
+        """,
+            {
+                "max_attempts": self.max_attempts,
+                "limit": limit,
+                "worker": worker,
+                "lease": lease,
+            },
+        )
         rows = cursor.fetchall()
         cursor.close()
-        return self.parse_get_response(rows)
+        return sorted(rows, key=lambda row: row[2])
 
+    def complete(self, job_ids: list[int], worker: str, connection=None) -> int:
+        """
+        Завершение заданий, аренду которых держит worker.
+        Если аренда истекла и задание забрал другой воркер, оно не завершается.
+        return сколько заданий завершено
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            UPDATE {self.table_name}
+            SET status = 'done', finished_at = now()
+            WHERE id = ANY(%s) AND worker = %s AND status = 'leased';
+        """,
+            (list(job_ids), worker),
+        )
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def release(self, job_ids: list[int], worker: str, connection=None) -> int:
+        """
+        Возврат заданий в очередь после неудачного запроса
+        (или failed, если попытки исчерпаны)
+        return сколько заданий возвращено
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            UPDATE {self.table_name}
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                worker = NULL, lease_until = NULL,
+                finished_at = CASE WHEN attempts >= %s THEN now() END
+            WHERE id = ANY(%s) AND worker = %s AND status = 'leased';
+        """,
+            (self.max_attempts, self.max_attempts, list(job_ids), worker),
+        )
+        count = cursor.rowcount
+        cursor.close()
+        return count
 
-class UnavailableTripsStatisticsTable(DbTable):
+    def extend(
+        self, job_ids: list[int], worker: str, lease: timedelta, connection=None
+    ) -> int:
+        """
+        Продление аренды заданий, которые держит worker, на lease от текущего момента
+        (ответы по заданиям еще ждут записи в БД)
+        return сколько аренд продлено
+        """
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            UPDATE {self.table_name}
+            SET lease_until = now() + %s
+            WHERE id = ANY(%s) AND worker = %s AND status = 'leased';
+        """,
+            (lease, list(job_ids), worker),
+        )
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def trim(self, older_than: timedelta, connection=None):
+        """
+        Задания с истекшей арендой и исчерпанными попытками помечаются failed,
+        завершенные задания старше older_than удаляются
+        """
+        self.execute(
+            f"""
+            UPDATE {self.table_name} SET status = 'failed', finished_at = now()
+            WHERE status = 'leased' AND lease_until < now() AND attempts >= %s;
+            DELETE FROM {self.table_name}
+            WHERE status IN ('done', 'failed') AND finished_at < now() - %s;
+        """,
+            (self.max_attempts, older_than),
+            connection=connection,
+        )
+
+
+class UnavailableTripsStatisticsTable(PartitionedTable):
     """
     Таблица с недоступными поездками.
     Информация: когда, какой класс, по какому маршруту
+    Секционирована по месяцам по datetime (время запроса из api_requests),
+    запрос к api - (request_id, datetime)
 
     functions:
-        insert_data(self, request_id : int, route_id : int, info: TripInfo)
-        ??? get_route_statistics(self, route_id, day_name: str) -> list
+        insert_data(self, request_id : int, route_id : int, info: TripInfo, datetime=None)
+        insert_many(self, rows: list[tuple[int, int, str, TripInfo]], connection=None)
+        get_route_statistics(self, route_id, day_name: str) -> list
     """
 
     table_name = "statistics_unavailable"
+    columns = ["id", "request_id", "route_id", "datetime", "trip_class"]
 
     def __init__(self, db_connection_pool):
         DbTable.__init__(self, db_connection_pool)
         cursor = self.db_connection.cursor()
-        self._create_if_noexist(
+        self._create_partitioned(
             cursor,
-            self.table_name,
             f"""
             CREATE TABLE {self.table_name} (
-                id SERIAL PRIMARY KEY,
-                request_id INT REFERENCES {ApiRequestsTable.table_name}(id),
+                id SERIAL,
+                request_id INT,                             -- ID запроса в api_requests
                 route_id INT REFERENCES {RoutesTable.table_name}(route_id),
-                trip_class VARCHAR(50)                      -- Класс поездки
-            );
+                datetime TIMESTAMP NOT NULL,                -- когда запрос
+                trip_class VARCHAR(50),                     -- Класс поездки
+                PRIMARY KEY (id, datetime)
+            ) PARTITION BY RANGE (datetime);
+        """,
+            self.columns,
+            f"""
+            SELECT l.id, l.request_id, l.route_id,
+                COALESCE(r.datetime, '1970-01-01') AS datetime, l.trip_class
+            FROM {{legacy}} l
+            LEFT JOIN {ApiRequestsTable.table_name} r ON r.id = l.request_id
         """,
         )
         cursor.close()
 
-    def insert_data(self, request_id: int, route_id: int, info: TripInfo):
+    def insert_data(
+        self, request_id: int, route_id: int, info: TripInfo, datetime=None
+    ):
+        """
+        datetime - время запроса (по умолчанию берется из api_requests)
+        """
         if info.is_available():
             raise Exception(f"TripInfo is available")
 
         return self.execute(
             f"""
             INSERT INTO {self.table_name} (
-                request_id
+                request_id,
                 route_id,
+                datetime,
                 trip_class
             ) VALUES (
-                {request_id},
-                {route_id},
-                '{info.class_text()}'
+                %(request_id)s,
+                %(route_id)s,
+                COALESCE(
+                    %(datetime)s,
+                    (SELECT datetime FROM {ApiRequestsTable.table_name} WHERE id = %(request_id)s)
+                ),
+                %(trip_class)s
             );
+        """,
+            {
+                "request_id": request_id,
+                "route_id": route_id,
+                "datetime": datetime,
+                "trip_class": info.class_text(),
+            },
+        )
+
+    def insert_many(self, rows: list[tuple[int, int, str, TripInfo]], connection=None):
+        """
+        Вставка пачки строк (request_id, route_id, datetime, TripInfo) одним запросом
         """
+        values = []
+        for request_id, route_id, datetime, info in rows:
+            if info.is_available():
+                raise Exception(f"TripInfo is available")
+            values.append((request_id, route_id, datetime, info.class_text()))
+
+        self.insert_values(
+            f"""
+            INSERT INTO {self.table_name} (
+                request_id,
+                route_id,
+                datetime,
+                trip_class
+            ) VALUES %s;
+        """,
+            values,
+            connection=connection,
         )
 
-    def get_route_statistics(self, route_id, day_name: str) -> list:
-        cursor = self.db_connection.cursor()
+    def get_route_statistics(self, route_id, day_name: str, connection=None) -> list:
+        """
+        Сырые замеры маршрута за день недели (агрегаты - StatisticsRollupTable)
+        """
+        cursor = self._connection(connection).cursor()
         cursor.execute(
             f"""
             SELECT * FROM {self.table_name} 
             JOIN {RoutesTable.table_name} ON {self.table_name}.route_id = {RoutesTable.table_name}.route_id 
-            WHERE {self.table_name}.route_id = {route_id} 
-            AND EXTRACT(dow FROM {self.table_name}.datetime) = {Week.days_names.index(day_name)};
-        """
+            WHERE {self.table_name}.route_id = %s 
+            AND EXTRACT(dow FROM {self.table_name}.datetime) = %s;
+        """,
+            (route_id, Week.days_names.index(day_name)),
         )
         rows = cursor.fetchall()
         cursor.close()
         return rows
 
 
-class AvailableTripsStatisticsTable(DbTable):
+class AvailableTripsStatisticsTable(PartitionedTable):
     """
     Таблица с доступными поездками.
     Цена, время поездки, класс поездки, время ожидания
+    Секционирована по месяцам по datetime (время запроса из api_requests),
+    запрос к api - (request_id, datetime)
 
     functions:
-        insert_data(self, datetime, route_id, info: TripInfo) -> int
-        ??? get_route_statistics(self, route_id, day_name: str) -> list
+        insert_data(self, request_id, route_id, info: TripInfo, datetime=None)
+        insert_many(self, rows: list[tuple[int, int, str, TripInfo]], connection=None)
+        get_route_statistics(self, route_id, day_name: str) -> list
     """
 
     table_name = "statistics_available"
+    columns = [
+        "id",
+        "request_id",
+        "route_id",
+        "datetime",
+        "trip_class",
+        "travel_time",
+        "wait_time",
+        "price",
+    ]
 
     def __init__(self, db_connection_pool):
         DbTable.__init__(self, db_connection_pool)
         cursor = self.db_connection.cursor()
-        self._create_if_noexist(
+        self._create_partitioned(
             cursor,
-            self.table_name,
             f"""
             CREATE TABLE {self.table_name} (
-                id SERIAL PRIMARY KEY,
-                request_id INT REFERENCES {ApiRequestsTable.table_name}(id),
+                id SERIAL,
+                request_id INT,                             -- ID запроса в api_requests
                 route_id INT REFERENCES {RoutesTable.table_name}(route_id),
+                datetime TIMESTAMP NOT NULL,                -- когда запрос
                 trip_class VARCHAR(50),                     -- Класс поездки
                 travel_time INTERVAL,                       -- Время поездки
                 wait_time INTERVAL,                         -- Время ожидания
-                price NUMERIC(10, 2)                        -- Цена поездки
-            );
+                price NUMERIC(10, 2),                       -- Цена поездки
+                PRIMARY KEY (id, datetime)
+            ) PARTITION BY RANGE (datetime);
+        """,
+            self.columns,
+            f"""
+            SELECT l.id, l.request_id, l.route_id,
+                COALESCE(r.datetime, '1970-01-01') AS datetime, l.trip_class,
+                l.travel_time, l.wait_time, l.price
+            FROM {{legacy}} l
+            LEFT JOIN {ApiRequestsTable.table_name} r ON r.id = l.request_id
         """,
         )
         cursor.close()
 
-    def insert_data(self, request_id: int, route_id: int, info: TripInfo):
+    def insert_data(
+        self, request_id: int, route_id: int, info: TripInfo, datetime=None
+    ):
+        """
+        datetime - время запроса (по умолчанию берется из api_requests)
+        """
         if not info.is_available():
             raise Exception(f"TripInfo is unavailable")
 
@@ -380,38 +1240,270 @@ class AvailableTripsStatisticsTable(DbTable):
             INSERT INTO {self.table_name} (
                 request_id,
                 route_id,
+                datetime,
                 travel_time, 
                 wait_time, 
                 trip_class, 
                 price
             ) VALUES (
-                {request_id},
-                {route_id},
-                INTERVAL '{info.travel_time()} seconds', 
-                INTERVAL '{info.waiting_time()} seconds', 
-                '{info.class_text()}',
-                {info.price()}
+                %(request_id)s,
+                %(route_id)s,
+                COALESCE(
+                    %(datetime)s,
+                    (SELECT datetime FROM {ApiRequestsTable.table_name} WHERE id = %(request_id)s)
+                ),
+                %(travel_time)s,
+                %(wait_time)s,
+                %(trip_class)s,
+                %(price)s
             );
+        """,
+            {
+                "request_id": request_id,
+                "route_id": route_id,
+                "datetime": datetime,
+                "travel_time": timedelta(seconds=info.travel_time()),
+                "wait_time": timedelta(seconds=info.waiting_time()),
+                "trip_class": info.class_text(),
+                "price": info.price(),
+            },
+        )
+
+    def insert_many(self, rows: list[tuple[int, int, str, TripInfo]], connection=None):
+        """
+        Вставка пачки строк (request_id, route_id, datetime, TripInfo) одним запросом
         """
+        values = []
+        for request_id, route_id, datetime, info in rows:
+            if not info.is_available():
+                raise Exception(f"TripInfo is unavailable")
+            values.append(
+                (
+                    request_id,
+                    route_id,
+                    datetime,
+                    timedelta(seconds=info.travel_time()),
+                    timedelta(seconds=info.waiting_time()),
+                    info.class_text(),
+                    info.price(),
+                )
+            )
+
+        self.insert_values(
+            f"""
+            INSERT INTO {self.table_name} (
+                request_id,
+                route_id,
+                datetime,
+                travel_time,
+                wait_time,
+                trip_class,
+                price
+            ) VALUES %s;
+        """,
+            values,
+            connection=connection,
         )
 
-    def get_route_statistics(self, route_id, day_name: str) -> list:
-        cursor = self.db_connection.cursor()
+    def get_route_statistics(self, route_id, day_name: str, connection=None) -> list:
+        """
+        Сырые замеры маршрута за день недели (агрегаты - StatisticsRollupTable)
+        """
+        cursor = self._connection(connection).cursor()
         cursor.execute(
             f"""
             SELECT * FROM {self.table_name} 
             JOIN {RoutesTable.table_name} ON {self.table_name}.route_id = {RoutesTable.table_name}.route_id 
-            WHERE {self.table_name}.route_id = {route_id} 
-            AND EXTRACT(dow FROM {self.table_name}.datetime) = {Week.days_names.index(day_name)};
-        """
+            WHERE {self.table_name}.route_id = %s 
+            AND EXTRACT(dow FROM {self.table_name}.datetime) = %s;
+        """,
+            (route_id, Week.days_names.index(day_name)),
         )
         rows = cursor.fetchall()
         cursor.close()
         return rows
 
 
-# CREATE INDEX idx_routes_client_id ON routes (client_id);
-# CREATE INDEX idx_request_schedule_event_day ON request_schedule (event_day);
-# CREATE INDEX idx_api_debug_datetime ON api_debug (datetime);
-# CREATE INDEX idx_api_debug_route_id ON api_debug (route_id);
-# CREATE INDEX idx_statistics_route_id ON statistics (route_id);
+class StatisticsRollupTable(DbTable):
+    """
+    Предагрегированная статистика поездок по корзинам
+    (маршрут, класс поездки, день недели, час).
+    Хранит только аддитивные величины (количество, min, max, сумма, сумма квадратов
+    цены и времени ожидания), поэтому обновляется при записи пачки статистики
+    в той же транзакции (upsert_many), а чтение стоит O(корзин), а не O(замеров).
+    День недели как в PostgreSQL dow: воскресенье - 0
+
+    functions:
+        upsert_many(self, rows: list[tuple[int, str, TripInfo]], connection=None)
+        get_route_statistics(self, route_id, day_name=None, trip_class=None, group_by=None, connection=None) -> list[dict]
+    """
+
+    table_name = "statistics_rollup"
+    bucket_columns = ["trip_class", "day_of_week", "hour"]
+
+    def __init__(self, db_connection_pool):
+        DbTable.__init__(self, db_connection_pool)
+        cursor = self.db_connection.cursor()
+        # Создание таблицы переносит в нее уже накопленную статистику
+        self._create_if_noexist(
+            cursor,
+            self.table_name,
+            f"""
+            CREATE TABLE {self.table_name} (
+                route_id INT REFERENCES {RoutesTable.table_name}(route_id) ON DELETE CASCADE,
+                trip_class VARCHAR(50),                     -- Класс поездки
+                day_of_week SMALLINT,                       -- 0 - воскресенье
+                hour SMALLINT,
+                samples BIGINT,                             -- всего замеров
+                available BIGINT,                           -- замеров с доступной поездкой
+                price_min NUMERIC(10, 2),
+                price_max NUMERIC(10, 2),
+                price_sum NUMERIC,
+                price_sum_sq NUMERIC,
+                wait_min DOUBLE PRECISION,                  -- время ожидания, сек
+                wait_max DOUBLE PRECISION,
+                wait_sum DOUBLE PRECISION,
+                wait_sum_sq DOUBLE PRECISION,
+                PRIMARY KEY (route_id, trip_class, day_of_week, hour)
+            );
+
+            {self._upsert_sql(f'''
+                SELECT route_id, datetime, trip_class, price,
+                    EXTRACT(epoch FROM wait_time) AS wait
+                FROM {AvailableTripsStatisticsTable.table_name}
+                UNION ALL
+                SELECT route_id, datetime, trip_class, NULL, NULL
+                FROM {UnavailableTripsStatisticsTable.table_name}
+            ''')}
+        """,
+        )
+        cursor.close()
+
+    def _upsert_sql(self, samples: str) -> str:
+        """
+        Добавление к корзинам замеров из запроса samples
+        со столбцами (route_id, datetime, trip_class, price, wait).
+        Строки вставляются в порядке ключа, чтобы параллельные
+        транзакции не блокировали друг друга крест-накрест
+        """
+        return f"""
+            INSERT INTO {self.table_name} AS r (
+                route_id, trip_class, day_of_week, hour, samples, available,
+                price_min, price_max, price_sum, price_sum_sq,
+                wait_min, wait_max, wait_sum, wait_sum_sq
+            )
+            SELECT
+                route_id, trip_class,
+                EXTRACT(dow FROM datetime), EXTRACT(hour FROM datetime),
+                count(*), count(price),
+                min(price), max(price),
+                COALESCE(sum(price), 0), COALESCE(sum(price * price), 0),
+                min(wait), max(wait),
+                COALESCE(sum(wait), 0), COALESCE(sum(wait * wait), 0)
+            FROM ({samples}) AS s
+            GROUP BY 1, 2, 3, 4
+            ORDER BY 1, 2, 3, 4
+            ON CONFLICT (route_id, trip_class, day_of_week, hour) DO UPDATE SET
+                samples = r.samples + EXCLUDED.samples,
+                available = r.available + EXCLUDED.available,
+                price_min = LEAST(r.price_min, EXCLUDED.price_min),
+                price_max = GREATEST(r.price_max, EXCLUDED.price_max),
+                price_sum = r.price_sum + EXCLUDED.price_sum,
+                price_sum_sq = r.price_sum_sq + EXCLUDED.price_sum_sq,
+                wait_min = LEAST(r.wait_min, EXCLUDED.wait_min),
+                wait_max = GREATEST(r.wait_max, EXCLUDED.wait_max),
+                wait_sum = r.wait_sum + EXCLUDED.wait_sum,
+                wait_sum_sq = r.wait_sum_sq + EXCLUDED.wait_sum_sq;
+        """
+
+    def upsert_many(self, rows: list[tuple[int, str, TripInfo]], connection=None):
+        """
+        Учет пачки замеров (route_id, datetime, TripInfo) в корзинах одним запросом
+        """
+        values = []
+        for route_id, datetime, info in rows:
+            if info.is_available():
+                values.append(
+                    (route_id, datetime, info.class_text(), info.price(), info.waiting_time())
+                )
+            else:
+                values.append((route_id, datetime, info.class_text(), None, None))
+
+        self.insert_values(
+            self._upsert_sql(
+                "SELECT * FROM (VALUES %s) AS v (route_id, datetime, trip_class, price, wait)"
+            ),
+            values,
+            template="(%s, %s::timestamp, %s, %s::numeric, %s::double precision)",
+            connection=connection,
+        )
+
+    def get_route_statistics(
+        self,
+        route_id: int,
+        day_name: Optional[str] = None,
+        trip_class: Optional[str] = None,
+        group_by: Optional[list[str]] = None,
+        connection=None,
+    ) -> list[dict]:
+        """
+        Статистика маршрута, сгруппированная по столбцам group_by
+        (подмножество bucket_columns, по умолчанию - по корзинам),
+        с отбором по дню недели и классу поездки.
+        return [{столбцы group_by, samples, available, availability,
+                 price_min, price_max, price_mean, price_std,
+                 wait_min, wait_max, wait_mean, wait_std}]
+        """
+        group_by = self.bucket_columns if group_by is None else group_by
+        for column in group_by:
+            if column not in self.bucket_columns:
+                raise ValueError(f"Unknown rollup column: {column}")
+
+        conditions = ["route_id = %(route_id)s"]
+        if day_name is not None:
+            conditions.append("day_of_week = %(day_of_week)s")
+        if trip_class is not None:
+            conditions.append("trip_class = %(trip_class)s")
+        keys = ", ".join(group_by)
+
+        cursor = self._connection(connection).cursor()
+        cursor.execute(
+            f"""
+            SELECT {keys + "," if keys else ""}
+                samples, available, available::float / samples AS availability,
+                price_min, price_max,
+                price_sum / NULLIF(available, 0) AS price_mean,
+                CASE WHEN available > 0 THEN sqrt(GREATEST(
+                    price_sum_sq / available - (price_sum / available) ^ 2, 0
+                )) END AS price_std,
+                wait_min, wait_max,
+                wait_sum / NULLIF(available, 0) AS wait_mean,
+                CASE WHEN available > 0 THEN sqrt(GREATEST(
+                    wait_sum_sq / available - (wait_sum / available) ^ 2, 0
+                )) END AS wait_std
+            FROM (
+                SELECT {keys + "," if keys else ""}
+                    sum(samples)::bigint AS samples, sum(available)::bigint AS available,
+                    min(price_min) AS price_min, max(price_max) AS price_max,
+                    sum(price_sum) AS price_sum, sum(price_sum_sq) AS price_sum_sq,
+                    min(wait_min) AS wait_min, max(wait_max) AS wait_max,
+                    sum(wait_sum) AS wait_sum, sum(wait_sum_sq) AS wait_sum_sq
+                FROM {self.table_name}
+                WHERE {" AND ".join(conditions)}
+                {"GROUP BY " + keys if keys else ""}
+            ) AS g
+            WHERE samples > 0
+            {"ORDER BY " + keys if keys else ""};
+        """,
+            {
+                "route_id": route_id,
+                "day_of_week": (
+                    None if day_name is None else Week.days_names.index(day_name)
+                ),
+                "trip_class": trip_class,
+            },
+        )
+        names = [column.name for column in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        cursor.close()
+        return rows
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class TokenBucket:
+    """
+    Ограничение частоты операций алгоритмом token bucket.
+    rate - пополнение токенов в секунду,
+    capacity - размер ведра (допустимый всплеск), по умолчанию rate
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # Ожидающие получают токены в порядке очереди
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Дождаться и забрать один токен
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class FanOutStats:
+    """
+    Статистика одного запуска FanOutExecutor.run
+    """
+
+    def __init__(self, tasks: int) -> None:
+        self.tasks = tasks
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.admission_waits: list[float] = []
+        self.elapsed = 0.0
+
+    def mean_admission_wait(self) -> float:
+        if len(self.admission_waits) == 0:
+            return 0.0
+        return sum(self.admission_waits) / len(self.admission_waits)
+
+    def max_admission_wait(self) -> float:
+        return max(self.admission_waits, default=0.0)
+
+    def __str__(self):
+        return (
+            f"задач: {self.tasks}, ошибок: {self.failed}, "
+            f"макс. очередь: {self.max_queue_depth}, "
+            f"ожидание допуска: ср. {self.mean_admission_wait():.3f}s / "
+            f"макс. {self.max_admission_wait():.3f}s, "
+            f"время: {self.elapsed:.3f}s"
+        )
+
+
+class FanOutExecutor:
+    """
+    Конкурентное выполнение пачки задач с ограничениями:
+        max_concurrency - не больше стольких задач одновременно,
+        rate_limit - не больше стольких запусков в секунду (None - без ограничения),
+        burst - допустимый всплеск запусков сверх rate_limit.
+    Задача допускается к выполнению, получив слот и затем токен,
+    поэтому токены не копятся у задач, ждущих свободный слот.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 50,
+        rate_limit: Optional[float] = None,
+        burst: Optional[float] = None,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be positive: {max_concurrency}")
+
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        # Задачи, ожидающие допуска к выполнению
+        self.queue_depth = 0
+        # Задачи, выполняющиеся в данный момент
+        self.in_flight = 0
+
+    async def _run_one(
+        self,
+        func: Callable[[Any], Awaitable[Any]],
+        item: Any,
+        stats: FanOutStats,
+    ):
+        enqueued = time.monotonic()
+        admitted = False
+        self.queue_depth += 1
+        stats.max_queue_depth = max(stats.max_queue_depth, self.queue_depth)
+        try:
+            async with self._semaphore:
+                if self._bucket is not None:
+                    await self._bucket.acquire()
+
+                wait = time.monotonic() - enqueued
+                admitted = True
+                self.queue_depth -= 1
+                stats.admission_waits.append(wait)
+                logging.debug(
+                    f"[FanOutExecutor] {item}: ожидание допуска {wait:.3f}s, "
+                    f"в очереди {self.queue_depth}"
+                )
+
+                self.in_flight += 1
+                try:
+                    return await func(item)
+                finally:
+                    self.in_flight -= 1
+
+        finally:
+            if not admitted:
+                self.queue_depth -= 1
+
+    async def run(
+        self, func: Callable[[Any], Awaitable[Any]], items: list
+    ) -> tuple[list, FanOutStats]:
+        """
+        Выполнить func(item) для всех items.
+        Returns:
+            list: результаты в порядке items (исключения возвращаются как значения)
+            FanOutStats: статистика выполнения
+        """
+        stats = FanOutStats(len(items))
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *[self._run_one(func, item, stats) for item in items],
+            return_exceptions=True,
+        )
+        stats.elapsed = time.monotonic() - start
+        stats.failed = sum(1 for result in results if isinstance(result, Exception))
+        return results, stats
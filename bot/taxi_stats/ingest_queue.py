@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class IngestStats:
+    """
+    Счетчики очереди записи:
+    enqueued / written - сколько элементов принято и записано,
+    batches - сколько пачек записано,
+    max_depth - наибольшая длина очереди,
+    put_waits - сколько раз поставщик ждал места в очереди (очередь полна),
+    put_wait - суммарное время этих ожиданий, сек,
+    last_flush / max_flush - длительность записи последней и самой долгой пачки, сек
+    """
+
+    def __init__(self) -> None:
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.put_waits = 0
+        self.put_wait = 0.0
+        self.last_flush = 0.0
+        self.max_flush = 0.0
+        self.total_flush = 0.0
+
+    @property
+    def mean_flush(self) -> float:
+        return self.total_flush / self.batches if self.batches else 0.0
+
+    def __str__(self):
+        return (
+            f"принято: {self.enqueued}, записано: {self.written} ({self.batches} пачек), "
+            f"макс. очередь: {self.max_depth}, ожиданий места: {self.put_waits} "
+            f"({self.put_wait:.3f}s), запись пачки: последняя {self.last_flush:.3f}s, "
+            f"средняя {self.mean_flush:.3f}s, макс. {self.max_flush:.3f}s"
+        )
+
+
+class IngestQueue:
+    """
+    Ограниченная очередь отложенной записи (write-behind).
+    Поставщики кладут готовые к записи элементы (put) и продолжают работу,
+    задача-писатель забирает их пачками до batch_size и передает в write.
+    Если очередь заполнена (max_size), put ждет - так медленная БД
+    притормаживает поставщиков, а не расходует память без ограничения.
+
+    write - корутина записи пачки (например, запись в БД в пуле потоков).
+    Ошибка записи логируется, пачка считается обработанной.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list], Awaitable[Any]],
+        max_size: int = 1000,
+        batch_size: int = 100,
+    ) -> None:
+        if max_size <= 0 or batch_size <= 0:
+            raise ValueError(
+                f"max_size and batch_size must be positive: {max_size}, {batch_size}"
+            )
+
+        self._write = write
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_size = max_size
+        self._writer: Optional[asyncio.Task] = None
+        self.stats = IngestStats()
+
+    @property
+    def depth(self) -> int:
+        """
+        Текущая длина очереди
+        """
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def full(self) -> bool:
+        return self._queue is not None and self._queue.full()
+
+    def start(self):
+        """
+        Запуск писателя в работающем event loop
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_size)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._run_writer())
+
+    async def put(self, item):
+        if self._queue is None:
+            self.start()
+
+        if self._queue.full():
+            self.stats.put_waits += 1
+            start = time.monotonic()
+            await self._queue.put(item)
+            self.stats.put_wait += time.monotonic() - start
+        else:
+            self._queue.put_nowait(item)
+
+        self.stats.enqueued += 1
+        self.stats.max_depth = max(self.stats.max_depth, self._queue.qsize())
+
+    async def _run_writer(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            start = time.monotonic()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logging.error(
+                    f"[IngestQueue] Ошибка записи пачки из {len(batch)}: {e!r}"
+                )
+            finally:
+                elapsed = time.monotonic() - start
+                self.stats.batches += 1
+                self.stats.written += len(batch)
+                self.stats.last_flush = elapsed
+                self.stats.total_flush += elapsed
+                self.stats.max_flush = max(self.stats.max_flush, elapsed)
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def join(self):
+        """
+        Ожидание записи всего, что уже было в очереди
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        Дописать очередь (не дольше timeout секунд) и остановить писателя
+        """
+        if self._writer is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(
+                f"[IngestQueue] Не записано при остановке: {self.depth} элементов"
+            )
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
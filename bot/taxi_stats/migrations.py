@@ -0,0 +1,155 @@
+from .db_tables import (
+    RoutesTable,
+    ApiRequestsTable,
+    RequestScheduleTable,
+    FetchJobsTable,
+    UnavailableTripsStatisticsTable,
+    AvailableTripsStatisticsTable,
+)
+from contextlib import contextmanager
+import logging
+
+
+# Версионированные изменения схемы: (версия, описание, SQL).
+# Применяются по возрастанию версии, каждая ровно один раз.
+# Уже примененные версии не меняются - новое изменение добавляется
+# в конец списка со следующей версией.
+# SQL должен быть идемпотентным (IF NOT EXISTS): базы, где изменение
+# было сделано вручную, проходят его без ошибок.
+MIGRATIONS: list[tuple[int, str, str]] = [
+    (
+        1,
+        "индекс маршрутов клиента",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{RoutesTable.table_name}_client_id
+            ON {RoutesTable.table_name} (client_id);
+        """,
+    ),
+    (
+        2,
+        "индекс расписания по маршруту",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{RequestScheduleTable.table_name}_route_id
+            ON {RequestScheduleTable.table_name} (route_id);
+        """,
+    ),
+    (
+        3,
+        "индексы статистики и ответов api по маршруту и времени",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{AvailableTripsStatisticsTable.table_name}_route_id
+            ON {AvailableTripsStatisticsTable.table_name} (route_id, datetime);
+        CREATE INDEX IF NOT EXISTS idx_{UnavailableTripsStatisticsTable.table_name}_route_id
+            ON {UnavailableTripsStatisticsTable.table_name} (route_id, datetime);
+        CREATE INDEX IF NOT EXISTS idx_{ApiRequestsTable.table_name}_route_id
+            ON {ApiRequestsTable.table_name} (route_id, datetime);
+        """,
+    ),
+    (
+        4,
+        "индексы чистки журнала изменений расписания и заданий",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{RequestScheduleTable.changes_table_name}_created_at
+            ON {RequestScheduleTable.changes_table_name} (created_at);
+        CREATE INDEX IF NOT EXISTS idx_{FetchJobsTable.table_name}_finished_at
+            ON {FetchJobsTable.table_name} (finished_at)
+            WHERE status IN ('done', 'failed');
+        """,
+    ),
+]
+
+
+class SchemaMigrations:
+    """
+    Применение изменений схемы (MIGRATIONS) при запуске.
+    Примененные версии хранятся в таблице schema_version.
+    Несколько процессов, стартующих одновременно, применяют изменения
+    по очереди (advisory lock), каждое изменение - в своей транзакции.
+    Под той же блокировкой (locked) DataBase создает таблицы.
+
+    functions:
+        applied(self) -> list[int]
+        pending(self) -> list[tuple[int, str, str]]
+        apply(self) -> list[int]
+        locked(self)
+    """
+
+    table_name = "schema_version"
+    # Ключ pg_advisory_lock, общий для всех процессов
+    lock_key = 20240415
+
+    def __init__(self, connection, migrations=MIGRATIONS) -> None:
+        """
+        connection - соединение в режиме autocommit
+        """
+        self.connection = connection
+        self.migrations = sorted(migrations, key=lambda migration: migration[0])
+        with self.locked():
+            cursor = connection.cursor()
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    version INT PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT now()
+                );
+            """
+            )
+            cursor.close()
+
+    @contextmanager
+    def locked(self):
+        """
+        Блокировка изменений схемы (pg_advisory_lock) на время блока with.
+        Повторно входима в пределах соединения: apply внутри блока не ждет
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s);", (self.lock_key,))
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (self.lock_key,))
+            cursor.close()
+
+    def applied(self) -> list[int]:
+        """
+        return примененные версии по возрастанию
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT version FROM {self.table_name} ORDER BY version;")
+        versions = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return versions
+
+    def pending(self) -> list[tuple[int, str, str]]:
+        applied = set(self.applied())
+        return [migration for migration in self.migrations if migration[0] not in applied]
+
+    def apply(self) -> list[int]:
+        """
+        Применение еще не примененных изменений.
+        При ошибке изменение откатывается, следующие не применяются
+        return примененные версии
+        """
+        done = []
+        with self.locked():
+            cursor = self.connection.cursor()
+            # Список читается под блокировкой: другой процесс мог уже все применить
+            for version, description, sql in self.pending():
+                self.connection.autocommit = False
+                try:
+                    cursor.execute(sql)
+                    cursor.execute(
+                        f"INSERT INTO {self.table_name} (version, description) VALUES (%s, %s);",
+                        (version, description),
+                    )
+                    self.connection.commit()
+                except BaseException:
+                    self.connection.rollback()
+                    raise
+                finally:
+                    self.connection.autocommit = True
+                logging.info(f"[SchemaMigrations] Применено изменение {version}: {description}")
+                done.append(version)
+            cursor.close()
+        return done
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import time
+
+
+class TtlLruCache:
+    """
+    Кеш с ограниченным временем жизни записей (ttl, сек)
+    и вытеснением давно не использованных записей (LRU)
+    при превышении max_size.
+    Считает попадания (hits), промахи (misses) и вытеснения (evictions).
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10000) -> None:
+        if ttl <= 0 or max_size <= 0:
+            raise ValueError(f"ttl and max_size must be positive: {ttl}, {max_size}")
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        return значение или None, если записи нет или она устарела
+        """
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __str__(self):
+        return (
+            f"записей: {len(self)}, попаданий: {self.hits}, "
+            f"промахов: {self.misses}, вытеснено: {self.evictions}"
+        )
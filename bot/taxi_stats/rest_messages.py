@@ -1,7 +1,8 @@
 from .route import Route, GeographicCoordinate
 from .time_schedule import Week
 from .route import Route
-import requests, logging
+from typing import Iterator, Optional
+import requests, logging, json, csv
 
 
 class AddRouteMessage:
@@ -275,3 +276,54 @@ def send_delete_route_message(
         url=url + "/delete_route",
         json={"client_id": f"{client_id}", "route_id": f"{route_id}"},
     )
+
+
+def send_export_route_samples_message(
+    url,
+    client_id: int,
+    route_id: int,
+    format: str = "ndjson",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> Optional[Iterator[dict]]:
+    """
+    Выгрузка сырых замеров маршрута (start, end - время в ISO 8601).
+    Ответ читается потоком, замеры отдаются по одному в виде словарей
+    (для csv значения - строки).
+    return итератор замеров или None, если выгрузка недоступна
+    """
+    params = {"client_id": client_id, "route_id": route_id, "format": format}
+    if start is not None:
+        params["start"] = start
+    if end is not None:
+        params["end"] = end
+
+    try:
+        response = requests.get(
+            url=url + "/export_route_samples", params=params, stream=True
+        )
+    except Exception as e:
+        logging.debug(str(e))
+        return None
+
+    if response.status_code != 200:
+        logging.debug(
+            f"send_export_route_samples_message status code: {response.status_code}"
+        )
+        response.close()
+        return None
+
+    response.encoding = "utf-8"
+
+    def samples():
+        with response:
+            lines = (
+                line for line in response.iter_lines(decode_unicode=True) if line
+            )
+            if format == "csv":
+                yield from csv.DictReader(lines)
+            else:
+                for line in lines:
+                    yield json.loads(line)
+
+    return samples()
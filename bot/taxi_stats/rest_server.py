@@ -1,5 +1,6 @@
 from aiohttp import web
-import logging
+from datetime import datetime
+import asyncio, csv, io, json, logging
 from .db_interface import DataBase
 from .rest_messages import (
     AddRouteMessage,
@@ -39,12 +40,19 @@ def log_decorator(func):
 
 
 class ServerHandlers:
-    def __init__(self) -> None:
-        self.db = DataBase()
+    # Сколько выгрузок замеров идет одновременно (у каждой свое соединение с БД),
+    # остальные ждут очереди
+    max_exports = 4
+
+    def __init__(self, db_config_file: str = "configs/database.yml") -> None:
+        self.db = DataBase(db_config_file)
+        self._export_slots = asyncio.Semaphore(self.max_exports)
 
     @log_decorator
-    def _has_access(self, client_id: int, route_id: int) -> bool:
-        routes = self.db.routes_table.get_all_routes(client_id=client_id)
+    async def _has_access(self, client_id: int, route_id: int) -> bool:
+        routes = await self.db.run(
+            self.db.routes_table.get_all_routes, client_id=client_id
+        )
         return route_id in routes
 
     @log_decorator
@@ -55,8 +63,10 @@ class ServerHandlers:
         data = await request.json()
         try:
             route_message = AddRouteMessage.from_json(data=data)
-            route_id = self.db.routes_table.insert_data(
-                client_id=route_message.client_id, route=route_message.route
+            route_id = await self.db.run(
+                self.db.routes_table.insert_data,
+                client_id=route_message.client_id,
+                route=route_message.route,
             )
             return web.json_response(
                 status=200,
@@ -74,9 +84,11 @@ class ServerHandlers:
         data = await request.json()
         try:
             message = RouteScheduleMessage.from_json(data=data)
-            if self._has_access(message.client_id, message.route_id):
-                self.db.request_schedule_table.insert_data(
-                    route_id=message.route_id, schedule=message.schedule
+            if await self._has_access(message.client_id, message.route_id):
+                await self.db.run(
+                    self.db.request_schedule_table.insert_data,
+                    route_id=message.route_id,
+                    schedule=message.schedule,
                 )
                 return web.json_response(
                     status=200,
@@ -99,8 +111,12 @@ class ServerHandlers:
         try:
             client_id = int(data.get("client_id"))
             route_id = int(data.get("route_id"))
-            if self._has_access(client_id, route_id):
-                self.db.routes_table.delete_data(client_id=client_id, route_id=route_id)
+            if await self._has_access(client_id, route_id):
+                await self.db.run(
+                    self.db.routes_table.delete_data,
+                    client_id=client_id,
+                    route_id=route_id,
+                )
                 return web.json_response(
                     status=200,
                     data=SuccesfulRouteMessage(client_id, route_id).to_json(),
@@ -120,8 +136,10 @@ class ServerHandlers:
         try:
             client_id = int(data.get("client_id"))
             route_id = int(data.get("route_id"))
-            if self._has_access(client_id, route_id):
-                self.db.request_schedule_table.delete_data(route_id=route_id)
+            if await self._has_access(client_id, route_id):
+                await self.db.run(
+                    self.db.request_schedule_table.delete_data, route_id=route_id
+                )
                 return web.json_response(
                     status=200,
                     data=SuccesfulRouteMessage(client_id, route_id).to_json(),
@@ -140,7 +158,9 @@ class ServerHandlers:
         data = await request.json()
         try:
             client_id = int(data.get("client_id"))
-            routes = self.db.routes_table.get_all_routes(client_id=client_id)
+            routes = await self.db.run(
+                self.db.routes_table.get_all_routes, client_id=client_id
+            )
             if len(routes) == 0:
                 raise Exception("routes not found")
 
@@ -165,9 +185,10 @@ class ServerHandlers:
         try:
             client_id = int(data.get("client_id"))
             route_id = int(data.get("route_id"))
-            if self._has_access(client_id, route_id):
-                schedule = self.db.request_schedule_table.get_route_schedule(
-                    route_id=route_id
+            if await self._has_access(client_id, route_id):
+                schedule = await self.db.run(
+                    self.db.request_schedule_table.get_route_schedule,
+                    route_id=route_id,
                 )
                 message = RouteScheduleMessage(client_id, route_id, schedule)
                 return web.json_response(message.to_json())
@@ -177,6 +198,78 @@ class ServerHandlers:
         except Exception as e:
             return web.json_response(status=404, text=str(e))
 
+    def _format_samples(rows: list[tuple], format: str) -> bytes:
+        """
+        Пачка замеров в виде строк NDJSON или CSV (без заголовка)
+        """
+        if format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            return buffer.getvalue().encode()
+
+        lines = []
+        for row in rows:
+            sample = dict(zip(DataBase.sample_columns, row))
+            sample["datetime"] = sample["datetime"].isoformat()
+            lines.append(json.dumps(sample, ensure_ascii=False))
+        return ("\n".join(lines) + "\n").encode()
+
+    @log_decorator
+    async def export_route_samples(self, request):
+        """
+        Выгрузка сырых замеров маршрута потоком (chunked) в NDJSON или CSV.
+        Параметры запроса: client_id, route_id, format (ndjson | csv),
+        start, end (ISO 8601, необязательные)
+        """
+        try:
+            client_id = int(request.query.get("client_id"))
+            route_id = int(request.query.get("route_id"))
+            format = request.query.get("format", "ndjson")
+            if format not in ("ndjson", "csv"):
+                raise ValueError(f"unknown format: {format}")
+            start = request.query.get("start")
+            end = request.query.get("end")
+            start = None if start is None else datetime.fromisoformat(start)
+            end = None if end is None else datetime.fromisoformat(end)
+            if not await self._has_access(client_id, route_id):
+                return web.json_response(status=401, data={"message": "access denied"})
+
+        except Exception as e:
+            return web.json_response(status=400, text=str(e))
+
+        async with self._export_slots:
+            response = web.StreamResponse(
+                headers={
+                    "Content-Type": (
+                        "text/csv" if format == "csv" else "application/x-ndjson"
+                    )
+                    + "; charset=utf-8"
+                }
+            )
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            if format == "csv":
+                await response.write(
+                    ServerHandlers._format_samples([DataBase.sample_columns], format)
+                )
+
+            # Пачки читаются в пуле потоков БД по одной: следующая запрашивается
+            # только после отправки предыдущей, поэтому память не растет
+            # и медленный клиент притормаживает чтение из БД
+            batches = self.db.iter_route_samples(route_id, start, end)
+            try:
+                while True:
+                    rows = await self.db.run_blocking(next, batches, None)
+                    if rows is None:
+                        break
+                    await response.write(ServerHandlers._format_samples(rows, format))
+            finally:
+                # Освобождение серверного курсора и соединения (в том числе при обрыве связи)
+                await self.db.run_blocking(batches.close)
+
+            await response.write_eof()
+            return response
+
 
 class Server(ServerHandlers):
     def __init__(self) -> None:
@@ -188,6 +281,7 @@ class Server(ServerHandlers):
         app.router.add_post("/add_route_schedule", self.add_route_schedule)
         app.router.add_get("/get_all_routes", self.get_all_routes)
         app.router.add_get("/get_route_info", self.get_route_info)
+        app.router.add_get("/export_route_samples", self.export_route_samples)
         app.router.add_delete("/delete_route_schedule", self.delete_route_schedule)
         app.router.add_delete("/delete_route", self.delete_route)
         web.run_app(app=app, host=host, port=port)
@@ -1,37 +1,101 @@
+import weakref
+
+# Точность хранения координат, знаков после запятой (~0.1 м)
+COORDINATE_PRECISION = 6
+
+
 class GeographicCoordinate:
     """
     Представление географических координат
     Широта (latitude), Долгота (longitude)
+
+    Неизменяемый хешируемый объект. Координаты округляются
+    до COORDINATE_PRECISION знаков, одинаковые точки - один объект
+    (интернирование), поэтому маршруты с общими точками не дублируют их в памяти.
     """
 
-    def __init__(self, latitude: float, longitude: float):
-        # Широта
-        self.latitude = latitude
-        # Долгота
-        self.longitude = longitude
+    __slots__ = ("latitude", "longitude", "__weakref__")
+    _interned: "weakref.WeakValueDictionary[tuple[float, float], GeographicCoordinate]" = (
+        weakref.WeakValueDictionary()
+    )
+
+    def __new__(cls, latitude: float, longitude: float):
+        key = (
+            round(float(latitude), COORDINATE_PRECISION),
+            round(float(longitude), COORDINATE_PRECISION),
+        )
+        coordinate = cls._interned.get(key)
+        if coordinate is None:
+            coordinate = object.__new__(cls)
+            # Широта
+            object.__setattr__(coordinate, "latitude", key[0])
+            # Долгота
+            object.__setattr__(coordinate, "longitude", key[1])
+            cls._interned[key] = coordinate
+        return coordinate
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"GeographicCoordinate is immutable: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"GeographicCoordinate is immutable: {name}")
+
+    def __reduce__(self):
+        return (GeographicCoordinate, (self.latitude, self.longitude))
 
-    def __eq__(self, other: "GeographicCoordinate") -> bool:
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GeographicCoordinate):
+            return NotImplemented
         return self.latitude == other.latitude and self.longitude == other.longitude
 
+    def __hash__(self) -> int:
+        return hash((self.latitude, self.longitude))
+
+    def __repr__(self):
+        return f"GeographicCoordinate({self.latitude}, {self.longitude})"
+
 
 class Route:
     """
     Описание маршрута: откуда(from_coords), куда(dest_coords).
     comment - Описание маршрута (пользовательский комментарий)
+
+    Неизменяемый хешируемый объект. Равенство и хеш - только по координатам:
+    маршруты с одинаковыми точками дают одинаковый запрос к API
+    и могут быть ключом словаря (например, при группировке запросов).
     """
 
+    __slots__ = ("from_coords", "dest_coords", "comment")
+
     def __init__(
         self,
         from_coords: GeographicCoordinate,
         dest_coords: GeographicCoordinate,
         comment: str = "",
     ):
-        self.from_coords = from_coords
-        self.dest_coords = dest_coords
-        self.comment = comment
+        object.__setattr__(self, "from_coords", from_coords)
+        object.__setattr__(self, "dest_coords", dest_coords)
+        object.__setattr__(self, "comment", comment)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Route is immutable: {name}")
 
-    def __eq__(self, other: "Route") -> bool:
+    def __delattr__(self, name):
+        raise AttributeError(f"Route is immutable: {name}")
+
+    def __reduce__(self):
+        return (Route, (self.from_coords, self.dest_coords, self.comment))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Route):
+            return NotImplemented
         return (
             self.from_coords == other.from_coords
             and self.dest_coords == other.dest_coords
         )
+
+    def __hash__(self) -> int:
+        return hash((self.from_coords, self.dest_coords))
+
+    def __repr__(self):
+        return f"Route({self.from_coords!r}, {self.dest_coords!r}, comment={self.comment!r})"
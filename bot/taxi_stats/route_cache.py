@@ -0,0 +1,41 @@
+from .db_tables import RoutesTable
+from .route import Route
+import logging
+
+
+class RouteCache:
+    """
+    Кеш маршрутов route_id -> Route.
+    Загружается целиком одним запросом (RoutesTable.get_all_routes)
+    и перезагружается по сигналу об изменении таблицы routes
+    (канал RoutesTable.changes_channel), а не запросом на каждый маршрут.
+    reload - блокирующий запрос к БД, из асинхронного кода он выполняется
+    в пуле потоков БД (DataBase.run_blocking); новый словарь маршрутов
+    подменяет старый целиком, поэтому чтение во время загрузки безопасно.
+    """
+
+    def __init__(self, routes_table: RoutesTable) -> None:
+        self._routes_table = routes_table
+        self._routes: dict[int, Route] = {}
+        self.reloads = 0
+
+    def reload(self):
+        self._routes = self._routes_table.get_all_routes()
+        self.reloads += 1
+        logging.info(f"[RouteCache] Загружено маршрутов: {len(self._routes)}")
+
+    def get(self, route_id: int) -> Route:
+        """
+        Маршрут из кеша, KeyError - если маршрута нет
+        (удален или сигнал об изменении еще не обработан)
+        """
+        route = self._routes.get(route_id)
+        if route is None:
+            raise KeyError(f"route_id={route_id} not found")
+        return route
+
+    def __contains__(self, route_id: int) -> bool:
+        return route_id in self._routes
+
+    def __len__(self) -> int:
+        return len(self._routes)
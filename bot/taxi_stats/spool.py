@@ -0,0 +1,174 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+
+class Spool:
+    """
+    Локальный журнал (спул) записей, которые не удалось записать в БД.
+    Записи - JSON объекты, по одному в строке, дописываются в текущий файл
+    directory/current.jsonl. Каждая запись сразу передается ОС (flush)
+    и переживает падение процесса. fsync выполняется пачками: после fsync_batch
+    записей, а по времени - вызовом sync не реже fsync_interval секунд
+    (владелец спула вызывает его по таймеру).
+
+    replay запечатывает текущий файл в сегмент и передает записи сегментов
+    пачками в store. Сегмент удаляется только после записи целиком,
+    при ошибке воспроизведение прерывается и повторяется позже с начала сегмента,
+    поэтому store должен быть идемпотентным.
+    Поврежденные строки (например, недописанные при падении) пропускаются.
+
+    Потокобезопасен: запись и воспроизведение могут идти из разных потоков.
+    Каталог принадлежит одному процессу (flock на lock_name): у каждого
+    процесса должен быть свой каталог спула, иначе RuntimeError.
+    """
+
+    current_name = "current.jsonl"
+    lock_name = "spool.lock"
+
+    def __init__(
+        self, directory: str, fsync_batch: int = 100, fsync_interval: float = 1.0
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, self.lock_name), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError(f"spool directory is used by another process: {directory}")
+        self.directory = directory
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self.appended = 0
+        self.replayed = 0
+        self.skipped = 0
+
+    @property
+    def current_path(self) -> str:
+        return os.path.join(self.directory, self.current_name)
+
+    def append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.current_path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            self.appended += 1
+            if (
+                self._unsynced >= self.fsync_batch
+                or time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync()
+
+    def sync(self):
+        """
+        Сброс дописанных записей на диск
+        """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._unsynced > 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _seal(self):
+        """
+        Текущий файл становится сегментом для воспроизведения
+        """
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.current_path) and os.path.getsize(self.current_path) > 0:
+                os.rename(
+                    self.current_path,
+                    os.path.join(self.directory, f"segment-{time.time_ns()}.jsonl"),
+                )
+
+    def segments(self) -> list[str]:
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".jsonl")
+        )
+
+    def pending(self) -> bool:
+        """
+        Есть ли записи, ожидающие воспроизведения
+        """
+        with self._lock:
+            if self._file is not None:
+                return True
+        return len(self.segments()) > 0 or (
+            os.path.exists(self.current_path) and os.path.getsize(self.current_path) > 0
+        )
+
+    def _read_segment(self, path: str):
+        with open(path, "r", encoding="utf-8") as file:
+            for number, line in enumerate(file, start=1):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    self.skipped += 1
+                    logging.error(f"[Spool] Поврежденная строка {path}:{number}")
+
+    def replay(self, store: Callable[[list[dict]], None], batch_size: int = 500) -> int:
+        """
+        Воспроизведение всех записанных записей через store.
+        return сколько записей передано в store до первой ошибки
+        """
+        with self._replay_lock:
+            self._seal()
+            replayed = 0
+            for path in self.segments():
+                batch = []
+                try:
+                    for record in self._read_segment(path):
+                        batch.append(record)
+                        if len(batch) >= batch_size:
+                            store(batch)
+                            replayed += len(batch)
+                            batch = []
+                    if len(batch) > 0:
+                        store(batch)
+                        replayed += len(batch)
+                except Exception as e:
+                    logging.error(
+                        f"[Spool] Воспроизведение прервано на {path}: {e!r}"
+                    )
+                    break
+                os.remove(path)
+
+            self.replayed += replayed
+            return replayed
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if not self._lock_file.closed:
+                # Закрытие файла снимает flock
+                self._lock_file.close()
+
+    def __str__(self):
+        return (
+            f"записано: {self.appended}, воспроизведено: {self.replayed}, "
+            f"пропущено поврежденных: {self.skipped}"
+        )
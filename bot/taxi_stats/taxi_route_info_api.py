@@ -1,7 +1,52 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Optional
+import aiohttp
 import requests
+from .response_cache import TtlLruCache
 from .route import Route
 
 
+class ApiResponse:
+    """
+    Ответ API такси, полностью вычитанный из асинхронной сессии.
+    Повторяет используемую часть интерфейса requests.Response
+    и хранит параметры запроса, по которым он был получен.
+
+    fetched_at - когда ответ получен от API,
+    from_cache - ответ взят из кеша CachedTaxiRouteInfoApi, а не из API
+    Тело разбирается один раз при первом вызове json(), результат
+    общий для всех последующих вызовов (и для ответов из кеша) - его нельзя изменять.
+    """
+
+    _not_decoded = object()
+
+    def __init__(
+        self,
+        request_params: dict,
+        status_code: int,
+        content: bytes,
+        fetched_at: Optional[datetime] = None,
+        from_cache: bool = False,
+        data=_not_decoded,
+    ):
+        """
+        data - уже разобранное тело (например, у ответа из кеша)
+        """
+        self.request_params = request_params
+        self.status_code = status_code
+        self.content = content
+        self.fetched_at = fetched_at if fetched_at is not None else datetime.now()
+        self.from_cache = from_cache
+        self._data = data
+
+    def json(self):
+        if self._data is ApiResponse._not_decoded:
+            self._data = json.loads(self.content)
+        return self._data
+
+
 class TaxiRouteInfoApi:
     api_url = "https://taxi-routeinfo.taxi.yandex.net/taxi_info"
     headers = {"Accept": "application/json"}
@@ -9,16 +54,166 @@ class TaxiRouteInfoApi:
     def __init__(self, CLID: str, APIKEY: str):
         self.params = {"rll": "", "clid": CLID, "apikey": APIKEY, "class": ""}
 
+    def make_params(
+        self, route: Route, taxi_class: str = "econom,business,comfortplus"
+    ) -> dict:
+        """
+        Параметры запроса для маршрута (новый dict на каждый вызов)
+        """
+        return {
+            "rll": f"{route.from_coords.longitude},{route.from_coords.latitude}~{route.dest_coords.longitude},{route.dest_coords.latitude}",
+            "clid": self.params["clid"],
+            "apikey": self.params["apikey"],
+            "class": f"{taxi_class}",
+        }
+
     def request(
         self, route: Route, taxi_class: str = "econom,business,comfortplus"
     ) -> requests.Response:
-        self.params["rll"] = (
-            f"{route.from_coords.longitude},{route.from_coords.latitude}~{route.dest_coords.longitude},{route.dest_coords.latitude}"
-        )
-        self.params["class"] = f"{taxi_class}"
+        self.params = self.make_params(route, taxi_class)
 
         return requests.get(
             url=TaxiRouteInfoApi.api_url,
             params=self.params,
             headers=TaxiRouteInfoApi.headers,
         )
+
+
+class AsyncTaxiRouteInfoApi(TaxiRouteInfoApi):
+    """
+    Асинхронный клиент API такси.
+    Держит одну ClientSession с пулом keep-alive соединений
+    и кешем DNS, поэтому запросы по разным маршрутам
+    можно выполнять конкурентно в одном event loop.
+    """
+
+    def __init__(
+        self,
+        CLID: str,
+        APIKEY: str,
+        connections_limit: int = 100,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        request_timeout: float = 30,
+    ):
+        TaxiRouteInfoApi.__init__(self, CLID=CLID, APIKEY=APIKEY)
+        self._connections_limit = connections_limit
+        self._dns_cache_ttl = dns_cache_ttl
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Сессия создается лениво, т.к. должна принадлежать работающему event loop
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connections_limit,
+                use_dns_cache=True,
+                ttl_dns_cache=self._dns_cache_ttl,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=TaxiRouteInfoApi.headers,
+                timeout=self._timeout,
+            )
+        return self._session
+
+    async def request(
+        self, route: Route, taxi_class: str = "econom,business,comfortplus"
+    ) -> ApiResponse:
+        params = self.make_params(route, taxi_class)
+        async with self._get_session().get(
+            TaxiRouteInfoApi.api_url, params=params
+        ) as response:
+            content = await response.read()
+            return ApiResponse(params, response.status, content)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class CachedTaxiRouteInfoApi(AsyncTaxiRouteInfoApi):
+    """
+    Асинхронный клиент с кешем успешных ответов (TtlLruCache).
+    Ключ - нормализованные параметры rll и class, поэтому запросы
+    по одному маршруту в пределах cache_ttl секунд не уходят в API.
+    Одновременные запросы с одним ключом ждут один общий ответ (shared).
+    Ответ из кеша помечается from_cache и сохраняет исходный fetched_at.
+    """
+
+    def __init__(
+        self,
+        CLID: str,
+        APIKEY: str,
+        cache_ttl: float,
+        cache_size: int = 10000,
+        **kwargs,
+    ):
+        AsyncTaxiRouteInfoApi.__init__(self, CLID=CLID, APIKEY=APIKEY, **kwargs)
+        self.cache = TtlLruCache(ttl=cache_ttl, max_size=cache_size)
+        self.shared = 0
+        self._pending: dict[tuple[str, str], asyncio.Future] = {}
+
+    def cache_key(params: dict) -> tuple[str, str]:
+        """
+        Нормализованный ключ запроса:
+        координаты с фиксированной точностью, классы по алфавиту без повторов
+        """
+        points = [
+            ",".join(f"{float(value):.6f}" for value in point.split(","))
+            for point in params["rll"].split("~")
+        ]
+        classes = sorted({name.strip().lower() for name in params["class"].split(",")})
+        return "~".join(points), ",".join(name for name in classes if name)
+
+    def _from_cache(params: dict, cached: ApiResponse) -> ApiResponse:
+        return ApiResponse(
+            params,
+            cached.status_code,
+            cached.content,
+            fetched_at=cached.fetched_at,
+            from_cache=True,
+            data=cached._data,
+        )
+
+    async def request(
+        self, route: Route, taxi_class: str = "econom,business,comfortplus"
+    ) -> ApiResponse:
+        params = self.make_params(route, taxi_class)
+        key = CachedTaxiRouteInfoApi.cache_key(params)
+
+        while True:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return CachedTaxiRouteInfoApi._from_cache(params, cached)
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            shared = await asyncio.shield(pending)
+            if shared is not None:
+                self.shared += 1
+                return CachedTaxiRouteInfoApi._from_cache(params, shared)
+            # Запрос, который ждали, не удался - кеш и ожидающие запросы
+            # проверяются заново, запрос повторяет только один из ожидавших
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            response = await AsyncTaxiRouteInfoApi.request(self, route, taxi_class)
+            if response.status_code == 200:
+                self.cache.put(key, response)
+                future.set_result(response)
+            else:
+                future.set_result(None)
+            return response
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
@@ -1,16 +1,46 @@
+from array import array
+from bisect import bisect_right
+from collections import Counter
 from datetime import datetime, time, timedelta
-from typing import Optional
+from typing import Iterable, Optional
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def day_of_week(value: datetime) -> int:
+    """
+    Номер дня недели как в Week.days_names и PostgreSQL dow: воскресенье - 0
+    """
+    # datetime.weekday(): понедельник - 0
+    return (value.weekday() + 1) % 7
 
 
 class Day:
     """
     Расписание на день.
     dict[time, list[id]]
+
+    Изменять расписание следует методами Day (или присваиванием time_schedule целиком):
+    они увеличивают revision, по которой перестраиваются
+    отсортированные ключи и WeekTimeline.
     """
 
     def __init__(self, name) -> None:
         self.name = name
+        self.revision = 0
         self.time_schedule: dict[time, list[int]] = {}
+        self._sorted_times: list[time] = []
+        self._sorted_revision = -1
+
+    @property
+    def time_schedule(self) -> dict[time, list[int]]:
+        return self._time_schedule
+
+    @time_schedule.setter
+    def time_schedule(self, value: dict[time, list[int]]):
+        self._time_schedule = value
+        self.revision += 1
 
     def __eq__(self, other: "Day") -> bool:
         if self.name != other.name or len(self.time_schedule) != len(
@@ -36,6 +66,7 @@ class Day:
         Интерфейс заполнения расписания
         """
         self.time_schedule.setdefault(time_point, [])
+        self.revision += 1
 
     def add_to_schedule(self, id: int, times: list[time]):
         """
@@ -43,18 +74,49 @@ class Day:
         """
         for t in times:
             self.time_schedule.setdefault(t, []).append(id)
+        self.revision += 1
 
     def remove_from_schedule(self, id: int, times: list[time]):
         """
         Интерфейс удаления элементов
         """
-        for t in times:
-            if t in self.time_schedule:
-                if id in self.time_schedule[t]:
-                    self.time_schedule[t].remove(id)
+        self.remove_many({t: [id] for t in times})
 
-                if len(self.time_schedule[t]) == 0:
-                    del self.time_schedule[t]
+    def remove_many(self, removals: dict[time, list[int]]):
+        """
+        Пакетное удаление: по одному вхождению каждого id из списка для времени.
+        Каждый список расписания проходится один раз (подсчет удаляемых id),
+        опустевшие времена удаляются.
+        """
+        for t, ids in removals.items():
+            scheduled = self.time_schedule.get(t)
+            if scheduled is None:
+                continue
+
+            counts = Counter(ids)
+            kept = []
+            for id in scheduled:
+                if counts[id] > 0:
+                    counts[id] -= 1
+                else:
+                    kept.append(id)
+
+            if len(kept) == 0:
+                del self.time_schedule[t]
+            else:
+                self.time_schedule[t] = kept
+        self.revision += 1
+
+    def update(self, other_day: "Day"):
+        """
+        Добавить расписание other_day в этот день (без копирования этого дня)
+        """
+        if other_day.name != self.name:
+            raise Exception(f"cannot merge {self.name} with {other_day.name}")
+
+        for time, ids in other_day.time_schedule.items():
+            self.time_schedule.setdefault(time, []).extend(ids)
+        self.revision += 1
 
     def merge(self, other_day: "Day") -> "Day":
         """
@@ -84,17 +146,44 @@ class Day:
         if from_datetime is None:
             from_datetime = datetime.now()
 
-        from_time = from_datetime.time()
+        if self._sorted_revision != self.revision:
+            self._sorted_times = sorted(self.time_schedule)
+            self._sorted_revision = self.revision
+
+        index = bisect_right(self._sorted_times, from_datetime.time())
+        if index == len(self._sorted_times):
+            return None, []
+
+        next_time = self._sorted_times[index]
+        return next_time, self.time_schedule[next_time]
+
+
+class WeekTimeline:
+    """
+    Неизменяемая скомпилированная шкала расписания недели.
+    minutes - отсортированные минуты от начала недели (воскресенье 00:00),
+    values - кортежи id для каждой минуты.
+    Точность расписания - минута (секунды времени отбрасываются).
+    """
+
+    __slots__ = ("minutes", "values")
+
+    def __init__(self, days: dict[str, Day]) -> None:
+        points: dict[int, list[int]] = {}
+        for day_name, day in days.items():
+            if day_name not in Week.days_names:
+                continue
+            day_start = Week.days_names.index(day_name) * MINUTES_PER_DAY
+            for t, ids in day.time_schedule.items():
+                points.setdefault(day_start + t.hour * 60 + t.minute, []).extend(ids)
 
-        next_time = None
-        values = []
-        for schedule_time, schedule_values in sorted(self.time_schedule.items()):
-            if schedule_time > from_time:
-                next_time = schedule_time
-                values = schedule_values
-                break
+        self.minutes: tuple[int, ...] = tuple(sorted(points))
+        self.values: tuple[tuple[int, ...], ...] = tuple(
+            tuple(points[minute]) for minute in self.minutes
+        )
 
-        return next_time, values
+    def __len__(self) -> int:
+        return len(self.minutes)
 
 
 class Week:
@@ -115,6 +204,37 @@ class Week:
     def __init__(self) -> None:
         self.days: dict[str, Day] = {}
 
+    @property
+    def days(self) -> dict[str, Day]:
+        return self._days
+
+    @days.setter
+    def days(self, value: dict[str, Day]):
+        self._days = value
+        self._timeline: Optional[WeekTimeline] = None
+        self._timeline_days: list[tuple[Day, int]] = []
+        # Дни, созданные самой неделей: их можно менять на месте.
+        # Дни, переданные в add, копируются один раз при первом изменении
+        self._own_days: dict[str, Day] = {}
+
+    def timeline(self) -> WeekTimeline:
+        """
+        Скомпилированная шкала расписания.
+        Перестраивается только если дни недели изменились с прошлой компиляции.
+        """
+        if not self._timeline_is_fresh():
+            self._timeline = WeekTimeline(self.days)
+            self._timeline_days = [(day, day.revision) for day in self.days.values()]
+        return self._timeline
+
+    def _timeline_is_fresh(self) -> bool:
+        if self._timeline is None or len(self._timeline_days) != len(self.days):
+            return False
+        for day, revision in self._timeline_days:
+            if self.days.get(day.name) is not day or day.revision != revision:
+                return False
+        return True
+
     def __eq__(self, other: "Week") -> bool:
         if len(self.days) != len(other.days):
             return False
@@ -128,12 +248,102 @@ class Week:
 
         return True
 
+    def _own_day(self, day_name: str) -> Day:
+        """
+        День недели, который можно менять на месте (создается при отсутствии)
+        """
+        day = self.days.get(day_name)
+        if day is not None and self._own_days.get(day_name) is day:
+            return day
+
+        if day is None:
+            day = Day(day_name)
+        else:
+            day = Day(day_name).merge(day)
+        self.days[day_name] = self._own_days[day_name] = day
+        return day
+
     def add(self, day: Day):
         if day.name in self.days:
-            self.days[day.name] = self.days[day.name].merge(day)
+            self._own_day(day.name).update(day)
         else:
             self.days[day.name] = day
 
+    def from_rows(rows: Iterable[tuple[int, dict[str, list[str]]]]) -> "Week":
+        """
+        Построение недели за один проход по строкам (id, mapping)
+        (формат get_mapping), например прямо из курсора БД.
+        Одинаковые строки времени разбираются один раз.
+        """
+        week = Week()
+        times: dict[str, time] = {}
+        schedules: dict[str, dict[time, list[int]]] = {}
+        for id, mapping in rows:
+            for day_name, time_list in mapping.items():
+                if len(time_list) == 0:
+                    continue
+                schedule = schedules.get(day_name)
+                if schedule is None:
+                    schedule = schedules[day_name] = {}
+                for t in time_list:
+                    time_point = times.get(t)
+                    if time_point is None:
+                        time_point = times[t] = time.fromisoformat(t)
+                    ids = schedule.get(time_point)
+                    if ids is None:
+                        schedule[time_point] = [id]
+                    else:
+                        ids.append(id)
+
+        for day_name, schedule in schedules.items():
+            day = week._own_day(day_name)
+            day.time_schedule = schedule
+        return week
+
+    def add_mapping(self, id: int, mapping: dict[str, list[str]]):
+        """
+        Добавить id во все метки времени mapping (формат get_mapping)
+        """
+        self.add_mappings([(id, mapping)])
+
+    def add_mappings(self, items: Iterable[tuple[int, dict[str, list[str]]]]):
+        """
+        Пакетное добавление пар (id, mapping) с изменением дней на месте
+        """
+        for id, mapping in items:
+            for day_name, time_list in mapping.items():
+                if len(time_list) > 0:
+                    self._own_day(day_name).add_to_schedule(
+                        id, [time.fromisoformat(t) for t in time_list]
+                    )
+
+    def remove_mapping(self, id: int, mapping: dict[str, list[str]]):
+        """
+        Удалить id из всех меток времени mapping (формат get_mapping).
+        Опустевшие дни удаляются из недели.
+        """
+        self.remove_mappings([(id, mapping)])
+
+    def remove_mappings(self, items: Iterable[tuple[int, dict[str, list[str]]]]):
+        """
+        Пакетное удаление пар (id, mapping): удаляемые id собираются по дням
+        и времени, и каждый день обрабатывается одним проходом (Day.remove_many)
+        """
+        removals: dict[str, dict[time, list[int]]] = {}
+        for id, mapping in items:
+            for day_name, time_list in mapping.items():
+                if day_name not in self.days:
+                    continue
+                day_removals = removals.setdefault(day_name, {})
+                for t in time_list:
+                    day_removals.setdefault(time.fromisoformat(t), []).append(id)
+
+        for day_name, day_removals in removals.items():
+            day = self._own_day(day_name)
+            day.remove_many(day_removals)
+            if len(day.time_schedule) == 0:
+                del self.days[day_name]
+
     def get_mapping(self) -> dict[str, list[str]]:
         """
         Returns:
@@ -153,48 +363,40 @@ class Week:
 
     def next_time_point(
         self, from_datetime: Optional[datetime] = None
-    ) -> tuple[datetime, list[int]]:
+    ) -> tuple[Optional[datetime], tuple[int, ...]]:
         """
-        Ищет ближайшую точку в расписании (за ближайшие 7 дней чтоб не циклиться)
+        Ищет ближайшую точку в расписании (за ближайшие 7 дней чтоб не циклиться).
+        Поиск бинарный по скомпилированной шкале (см. timeline)
         Returns:
             datetime: следующая точка времени расписания. Если не найдено - None
-            list: значение из расписания для datetime
+            tuple: значение из расписания для datetime
         """
         if from_datetime is None:
             from_datetime = datetime.now()
 
-        next_point = None
-        values = []
-
-        days_counter = 0
-        while next_point is None and days_counter < 7:
-            day_name = from_datetime.strftime("%A")
-
-            if day_name in self.days:
-                next_time, values = self.days[day_name].next_time_point(from_datetime)
-                if next_time:
-                    next_point = datetime(
-                        year=from_datetime.year,
-                        month=from_datetime.month,
-                        day=from_datetime.day,
-                        hour=next_time.hour,
-                        minute=next_time.minute,
-                        second=next_time.second,
-                    )
-                    break
-
-            from_datetime += timedelta(days=1)
-            from_datetime = datetime(
-                year=from_datetime.year,
-                month=from_datetime.month,
-                day=from_datetime.day,
-                hour=0,
-                minute=0,
-                second=0,
-            )
-            days_counter += 1
+        timeline = self.timeline()
+        if len(timeline) == 0:
+            return None, ()
+
+        day_start = day_of_week(from_datetime) * MINUTES_PER_DAY
+        from_minute = day_start + from_datetime.hour * 60 + from_datetime.minute
 
-        return next_point, values
+        index = bisect_right(timeline.minutes, from_minute)
+        if index < len(timeline):
+            offset = timeline.minutes[index] - day_start
+        else:
+            # Переход на следующую неделю, но не дальше 7 дней от начала текущего дня
+            index = 0
+            offset = timeline.minutes[0] + MINUTES_PER_WEEK - day_start
+            if offset >= MINUTES_PER_WEEK:
+                return None, ()
+
+        next_point = datetime(
+            year=from_datetime.year,
+            month=from_datetime.month,
+            day=from_datetime.day,
+        ) + timedelta(minutes=offset)
+        return next_point, timeline.values[index]
 
     def from_json(data):
         week = Week()
@@ -204,3 +406,273 @@ class Week:
                 day.add_time(datetime.strptime(t, "%H:%M").time())
             week.add(day)
         return week
+
+
+class CompactWeek:
+    """
+    Компактное расписание недели для очень больших расписаний
+    (миллионы пар маршрут-время), с интерфейсом Week.
+
+    Хранится в виде CSR массивов по минутам недели (воскресенье 00:00 - 0):
+        offsets[m]..offsets[m + 1] - срез values с id минуты m,
+        minutes - отсортированные занятые минуты (в т.ч. без id, см. Day.add_time).
+    Кто запланирован на минуту m - O(1), на пару маршрут-время - 4 байта.
+
+    add_mapping/remove_mapping копятся и применяются одной перестройкой
+    массивов при следующем чтении. Точность расписания - минута.
+    """
+
+    _day_index = {name: index for index, name in enumerate(Week.days_names)}
+
+    def __init__(self) -> None:
+        self._offsets = array("I", bytes(4 * (MINUTES_PER_WEEK + 1)))
+        self._values = array("i")
+        self._minutes = array("H")
+        # (операция I/D, id или None - только время, mapping)
+        self._pending: list[tuple[str, Optional[int], dict[str, list[str]]]] = []
+
+    def from_points(points: Iterable[tuple[int, Optional[int]]]) -> "CompactWeek":
+        """
+        Построение из пар (минута недели, id) за один проход и сортировку подсчетом.
+        id None - занятая минута без id. Порядок id внутри минуты сохраняется.
+        """
+        point_minutes = array("H")
+        point_ids = array("i")
+        occupied = bytearray(MINUTES_PER_WEEK)
+        for minute, id in points:
+            occupied[minute] = 1
+            if id is not None:
+                point_minutes.append(minute)
+                point_ids.append(id)
+
+        week = CompactWeek()
+        week._build(point_minutes, point_ids, occupied)
+        return week
+
+    def from_mappings(items: Iterable[tuple[int, dict[str, list[str]]]]) -> "CompactWeek":
+        """
+        Построение из пар (id, mapping) в формате Week.get_mapping,
+        например из строк request_schedule
+        """
+        return CompactWeek.from_points(
+            point
+            for id, mapping in items
+            for point in CompactWeek._mapping_points(id, mapping)
+        )
+
+    def from_week(week: Week) -> "CompactWeek":
+        def points():
+            for day_name, day in week.days.items():
+                if day_name not in Week.days_names:
+                    continue
+                day_start = Week.days_names.index(day_name) * MINUTES_PER_DAY
+                for t, ids in day.time_schedule.items():
+                    minute = day_start + t.hour * 60 + t.minute
+                    if len(ids) == 0:
+                        yield minute, None
+                    for id in ids:
+                        yield minute, id
+
+        return CompactWeek.from_points(points())
+
+    def _mapping_points(id: int, mapping: dict[str, list[str]]):
+        for day_name, time_list in mapping.items():
+            if day_name not in CompactWeek._day_index:
+                continue
+            day_start = CompactWeek._day_index[day_name] * MINUTES_PER_DAY
+            for t in time_list:
+                yield day_start + int(t[0:2]) * 60 + int(t[3:5]), id
+
+    def _build(self, point_minutes: array, point_ids: array, occupied: bytearray):
+        offsets = array("I", bytes(4 * (MINUTES_PER_WEEK + 1)))
+        for minute in point_minutes:
+            offsets[minute + 1] += 1
+        for minute in range(MINUTES_PER_WEEK):
+            offsets[minute + 1] += offsets[minute]
+
+        values = array("i", bytes(4 * len(point_ids)))
+        position = array("I", offsets[:MINUTES_PER_WEEK])
+        for minute, id in zip(point_minutes, point_ids):
+            values[position[minute]] = id
+            position[minute] += 1
+
+        self._offsets = offsets
+        self._values = values
+        self._minutes = array(
+            "H", (minute for minute in range(MINUTES_PER_WEEK) if occupied[minute])
+        )
+
+    def _compact(self):
+        """
+        Применение накопленных add_mapping/remove_mapping одной перестройкой
+        """
+        if len(self._pending) == 0:
+            return
+
+        occupied = bytearray(MINUTES_PER_WEEK)
+        for minute in self._minutes:
+            occupied[minute] = 1
+        touched: dict[int, list[int]] = {}
+        for operation, id, mapping in self._pending:
+            for minute, _ in CompactWeek._mapping_points(id, mapping):
+                ids = touched.get(minute)
+                if ids is None:
+                    ids = touched[minute] = self._ids_slice(minute).tolist()
+                if operation == "I":
+                    if id is not None:
+                        ids.append(id)
+                    occupied[minute] = 1
+                elif occupied[minute]:
+                    if id in ids:
+                        ids.remove(id)
+                    if len(ids) == 0:
+                        occupied[minute] = 0
+        self._pending = []
+
+        point_minutes = array("H")
+        point_ids = array("i")
+        for minute in range(MINUTES_PER_WEEK):
+            ids = touched.get(minute)
+            if ids is None:
+                ids = self._ids_slice(minute)
+            point_minutes.extend([minute] * len(ids))
+            point_ids.extend(ids)
+        self._build(point_minutes, point_ids, occupied)
+
+    def _ids_slice(self, minute: int) -> array:
+        return self._values[self._offsets[minute] : self._offsets[minute + 1]]
+
+    def ids_at(self, minute: int) -> tuple[int, ...]:
+        """
+        id, запланированные на минуту недели minute (воскресенье 00:00 - 0)
+        """
+        self._compact()
+        return tuple(self._ids_slice(minute))
+
+    def add_mapping(self, id: int, mapping: dict[str, list[str]]):
+        """
+        Добавить id во все метки времени mapping (формат get_mapping)
+        """
+        self._pending.append(("I", id, mapping))
+
+    def remove_mapping(self, id: int, mapping: dict[str, list[str]]):
+        """
+        Удалить id из всех меток времени mapping (формат get_mapping).
+        Опустевшие минуты освобождаются.
+        """
+        self._pending.append(("D", id, mapping))
+
+    def add_mappings(self, items: Iterable[tuple[int, dict[str, list[str]]]]):
+        self._pending.extend(("I", id, mapping) for id, mapping in items)
+
+    def remove_mappings(self, items: Iterable[tuple[int, dict[str, list[str]]]]):
+        self._pending.extend(("D", id, mapping) for id, mapping in items)
+
+    def add(self, day: Day):
+        for t, ids in day.time_schedule.items():
+            mapping = {day.name: [t.strftime("%H:%M")]}
+            if len(ids) == 0:
+                self._pending.append(("I", None, mapping))
+            for id in ids:
+                self._pending.append(("I", id, mapping))
+
+    @property
+    def days(self) -> dict[str, Day]:
+        """
+        Расписание в виде Day (копия, изменения не влияют на CompactWeek)
+        """
+        self._compact()
+        days: dict[str, Day] = {}
+        for minute in self._minutes:
+            day_index, minute_of_day = divmod(minute, MINUTES_PER_DAY)
+            day_name = Week.days_names[day_index]
+            day = days.get(day_name)
+            if day is None:
+                day = days[day_name] = Day(day_name)
+            day.time_schedule[time(minute_of_day // 60, minute_of_day % 60)] = (
+                self._ids_slice(minute).tolist()
+            )
+        return days
+
+    def get_mapping(self) -> dict[str, list[str]]:
+        """
+        Returns:
+            dict[str, list[str]]: расписание в формате Week.get_mapping
+        """
+        self._compact()
+        mapping: dict[str, list[str]] = {}
+        for minute in self._minutes:
+            day_index, minute_of_day = divmod(minute, MINUTES_PER_DAY)
+            mapping.setdefault(Week.days_names[day_index], []).append(
+                f"{minute_of_day // 60:02}:{minute_of_day % 60:02}"
+            )
+        return mapping
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Week):
+            other = CompactWeek.from_week(other)
+        if not isinstance(other, CompactWeek):
+            return NotImplemented
+
+        self._compact()
+        other._compact()
+        if self._minutes != other._minutes:
+            return False
+        for minute in self._minutes:
+            if sorted(self._ids_slice(minute)) != sorted(other._ids_slice(minute)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        """
+        Число пар id-время в расписании
+        """
+        self._compact()
+        return len(self._values)
+
+    def nbytes(self) -> int:
+        """
+        Размер массивов расписания в байтах
+        """
+        self._compact()
+        return sum(
+            len(values) * values.itemsize
+            for values in (self._offsets, self._values, self._minutes)
+        )
+
+    def next_time_point(
+        self, from_datetime: Optional[datetime] = None
+    ) -> tuple[Optional[datetime], tuple[int, ...]]:
+        """
+        Ищет ближайшую точку в расписании, семантика как у Week.next_time_point
+        Returns:
+            datetime: следующая точка времени расписания. Если не найдено - None
+            tuple: значение из расписания для datetime
+        """
+        if from_datetime is None:
+            from_datetime = datetime.now()
+
+        self._compact()
+        if len(self._minutes) == 0:
+            return None, ()
+
+        day_start = day_of_week(from_datetime) * MINUTES_PER_DAY
+        from_minute = day_start + from_datetime.hour * 60 + from_datetime.minute
+
+        index = bisect_right(self._minutes, from_minute)
+        if index < len(self._minutes):
+            minute = self._minutes[index]
+            offset = minute - day_start
+        else:
+            # Переход на следующую неделю, но не дальше 7 дней от начала текущего дня
+            minute = self._minutes[0]
+            offset = minute + MINUTES_PER_WEEK - day_start
+            if offset >= MINUTES_PER_WEEK:
+                return None, ()
+
+        next_point = datetime(
+            year=from_datetime.year,
+            month=from_datetime.month,
+            day=from_datetime.day,
+        ) + timedelta(minutes=offset)
+        return next_point, tuple(self._ids_slice(minute))
@@ -1,4 +1,5 @@
-import requests
+from typing import Optional
+import sys
 
 
 def seconds_to_time(seconds):
@@ -11,17 +12,63 @@ def seconds_to_time(seconds):
 class TripInfo:
     """
     Сущность, содержащая данные о маршруте
+
+    Из вариантов поездки ответа API (options) берутся только записываемые
+    поля: класс, цена и время ожидания (его нет у недоступной поездки).
+    Неизменяемый хешируемый объект со слотами.
     """
 
+    __slots__ = (
+        "_distance",
+        "_time",
+        "_class_text",
+        "_class_level",
+        "_price",
+        "_waiting_time",
+    )
+
     def __init__(self, distance: float, time: float, options: dict):
-        self._distance: float = distance  # Длина маршрута, м
-        self._time: float = time  # Время поездки, сек
-        self._options = options
-        self._datetime = time
+        set_field = object.__setattr__
+        set_field(self, "_distance", distance)  # Длина маршрута, м
+        set_field(self, "_time", time)  # Время поездки, сек
+        class_text = options.get("class_text")
+        set_field(
+            self, "_class_text", None if class_text is None else sys.intern(class_text)
+        )
+        set_field(self, "_class_level", options.get("class_level"))
+        set_field(self, "_price", options.get("price"))
+        set_field(self, "_waiting_time", options.get("waiting_time"))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TripInfo is immutable: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"TripInfo is immutable: {name}")
+
+    def __reduce__(self):
+        return (TripInfo.from_json, (self.to_json(),))
+
+    def _key(self) -> tuple:
+        return (
+            self._distance,
+            self._time,
+            self._class_text,
+            self._class_level,
+            self._price,
+            self._waiting_time,
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TripInfo):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
 
     def is_available(self) -> bool:
         """Доступна ли поездка"""
-        return "waiting_time" in self._options
+        return self._waiting_time is not None
 
     def travel_distance(self) -> float:
         return self._distance
@@ -29,17 +76,42 @@ class TripInfo:
     def travel_time(self) -> float:
         return self._time
 
-    def class_level(self) -> int:
-        return self._options["class_level"]
+    def class_level(self) -> Optional[int]:
+        return self._class_level
 
     def class_text(self) -> str:
-        return self._options["class_text"]
+        return self._class_text
 
-    def price(self) -> float:
-        return self._options["price"]
+    def price(self) -> Optional[float]:
+        return self._price
 
     def waiting_time(self) -> float:
-        return self._options["waiting_time"] if "waiting_time" in self._options else 0
+        return self._waiting_time if self._waiting_time is not None else 0
+
+    def options(self) -> dict:
+        """
+        Записываемые поля варианта поездки в формате ответа API
+        """
+        options = {"class_text": self._class_text}
+        for name, value in [
+            ("class_level", self._class_level),
+            ("price", self._price),
+            ("waiting_time", self._waiting_time),
+        ]:
+            if value is not None:
+                options[name] = value
+        return options
+
+    def to_json(self) -> dict:
+        """
+        Сериализация (например, для локального спула ответов)
+        """
+        return {"distance": self._distance, "time": self._time, "options": self.options()}
+
+    def from_json(data: dict) -> "TripInfo":
+        return TripInfo(
+            distance=data["distance"], time=data["time"], options=data["options"]
+        )
 
     def __str__(self):
         ostr = {
@@ -59,11 +131,14 @@ class TripInfo:
     """
 
 
-def parse_response(response: requests.Response) -> list[TripInfo]:
+def parse_response(data) -> list[TripInfo]:
     """
-    Парсинг ответа API такси
+    Парсинг ответа API такси: из каждого варианта поездки
+    сохраняются только записываемые поля (см. TripInfo)
+    data - разобранное тело ответа (ответ с методом json() тоже принимается)
     """
-    data = response.json()
+    if hasattr(data, "json"):
+        data = data.json()
     return [
         TripInfo(distance=data["distance"], time=data["time"], options=options)
         for options in data["options"]
@@ -0,0 +1,70 @@
+from taxi_stats.analytics import (
+    RouteSamples,
+    availability_matrix,
+    dow_hour_matrix,
+    percentiles,
+    rolling_median,
+    surge_matrix,
+    surge_ratio,
+)
+from datetime import datetime, timedelta
+import numpy as np
+
+
+def make_samples() -> RouteSamples:
+    # Воскресенье 2024-04-14: Эконом в 7 и 8 часов, Бизнес недоступен
+    start = datetime(2024, 4, 14, 7, 0)
+    rows = []
+    for minute, price in enumerate([100, 200, 300, 400]):
+        at = start + timedelta(minutes=30 * minute)
+        rows.append((at, 1, "Эконом", True, float(price), 60.0 * (minute + 1), 600.0))
+        rows.append((at, 1, "Бизнес", False, None, None, None))
+    return RouteSamples.from_batches([rows[:3], rows[3:]])
+
+
+def test_from_batches():
+    samples = make_samples()
+    assert len(samples) == 8
+    assert samples.classes == ["Эконом", "Бизнес"]
+    assert samples.price.dtype == np.float64 and samples.price.flags["C_CONTIGUOUS"]
+    assert np.isnan(samples.price[samples.trip_class == 1]).all()
+    assert list(samples.day_of_week()[:2]) == [0, 0]
+    assert list(samples.hour()[::2]) == [7, 7, 8, 8]
+    assert len(samples.of_class("Эконом")) == 4
+    assert len(samples.of_class("Комфорт")) == 0
+    assert len(RouteSamples.from_batches([])) == 0
+
+
+def test_percentiles_and_rolling_median():
+    samples = make_samples()
+    assert list(percentiles(samples.price, [0, 50, 100])) == [100, 250, 400]
+    assert np.isnan(percentiles(np.array([np.nan]), [50])).all()
+
+    values = np.array([5, 1, 3, np.nan, 9, 7], dtype=np.float64)
+    expected = [np.nan, np.nan, 3, 2, 6, 8]
+    np.testing.assert_array_equal(rolling_median(values, 3), expected)
+    # Блоки окон дают тот же результат
+    np.testing.assert_array_equal(rolling_median(values, 3, chunk_size=1), expected)
+    assert np.isnan(rolling_median(values, 10)).all()
+
+
+def test_dow_hour_matrices():
+    samples = make_samples()
+    means, counts = dow_hour_matrix(samples)
+    assert means.shape == (7, 24) and counts.sum() == 4
+    assert (means[0, 7], means[0, 8]) == (150, 350)
+    assert np.isnan(means[1, 7])
+
+    availability = availability_matrix(samples)
+    assert availability[0, 7] == 0.5 and np.isnan(availability[3, 3])
+
+    ratio = surge_ratio(samples)
+    np.testing.assert_allclose(ratio[::2], [0.4, 0.8, 1.2, 1.6])
+    assert np.isnan(ratio[1::2]).all()
+    np.testing.assert_allclose(surge_matrix(samples)[0, 7:9], [0.6, 1.4])
+
+
+if __name__ == "__main__":
+    test_from_batches()
+    test_percentiles_and_rolling_median()
+    test_dow_hour_matrices()
@@ -1,6 +1,10 @@
 from taxi_stats.db_interface import DataBase
 from taxi_stats.db_tables import *
+from taxi_stats.migrations import MIGRATIONS, SchemaMigrations
+import multiprocessing
 import pytest
+import yaml
+from time import sleep
 
 
 def test_routes_table(routes_table: RoutesTable):
@@ -105,9 +109,412 @@ def test_request_schedule_table(request_schedule_table: RequestScheduleTable):
             assert len(ids) == 1
 
 
+def test_request_schedule_changes(request_schedule_table: RequestScheduleTable):
+    # существует route_id 2, 5
+    snapshot, week = request_schedule_table.get_schedule_snapshot()
+    assert week == request_schedule_table.get_all_schedule()
+
+    snapshot, changes = request_schedule_table.get_changes(snapshot)
+    assert len(changes) == 0
+
+    route_5_week = Week()
+    route_5_monday = Day(Week.days_names[1])
+    route_5_monday.add_to_schedule(5, [time(8, 0), time(19, 0)])
+    route_5_week.add(route_5_monday)
+    request_schedule_table.insert_data(route_id=5, schedule=route_5_week)
+    request_schedule_table.delete_data(route_id=2)
+
+    snapshot, changes = request_schedule_table.get_changes(snapshot)
+    assert [(change[0], change[2]) for change in changes] == [("I", 5), ("D", 2)]
+    for operation, _, route_id, mapping in changes:
+        if operation == "I":
+            week.add_mapping(route_id, mapping)
+        else:
+            week.remove_mapping(route_id, mapping)
+    assert week == request_schedule_table.get_all_schedule()
+
+    # Повторно изменения не возвращаются
+    snapshot, changes = request_schedule_table.get_changes(snapshot)
+    assert len(changes) == 0
+
+
+def test_unit_of_work(db: DataBase):
+    # существует route_id 2
+    def count(table_name):
+        cursor = db.routes_table.db_connection.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    trips = [
+        TripInfo(1000, 600, {"class_text": "Эконом", "price": 100, "waiting_time": 60}),
+        TripInfo(1000, 600, {"class_text": "Бизнес"}),
+    ]
+
+    with db.unit_of_work() as uow:
+        for _ in range(3):
+            uow.add_response("2024-04-15 07:00:00", 2, {}, 200, {}, trips)
+        assert uow.responses == 3
+
+    assert count(ApiRequestsTable.table_name) == 3
+    assert count(AvailableTripsStatisticsTable.table_name) == 3
+    assert count(UnavailableTripsStatisticsTable.table_name) == 3
+
+    # Ошибка внутри транзакции откатывает все записи
+    with pytest.raises(Exception):
+        with db.unit_of_work() as uow:
+            uow.add_response("2024-04-15 07:00:00", 2, {}, 200, {}, trips)
+            uow.add_response("2024-04-15 07:00:00", 33333333, {}, 200, {}, trips)
+
+    assert count(ApiRequestsTable.table_name) == 3
+    assert count(AvailableTripsStatisticsTable.table_name) == 3
+    assert count(UnavailableTripsStatisticsTable.table_name) == 3
+
+    # Исходное тело ответа записывается в JSONB без повторного кодирования
+    with db.unit_of_work() as uow:
+        request_id = uow.add_response(
+            "2024-04-15 07:00:00", 2, {}, 200, RawJson(b'{"price": "\xd0\x96 \'1\'"}'), []
+        )
+    cursor = db.routes_table.db_connection.cursor()
+    cursor.execute(
+        f"SELECT response_json FROM {ApiRequestsTable.table_name} WHERE id = %s;",
+        (request_id,),
+    )
+    assert cursor.fetchone()[0] == {"price": "Ж '1'"}
+    cursor.close()
+    assert count(ApiRequestsTable.table_name) == 4
+    assert count(AvailableTripsStatisticsTable.table_name) == 3
+
+    # Повторная запись замера с тем же sample_uid пропускается вместе со статистикой
+    for _ in range(2):
+        with db.unit_of_work() as uow:
+            uow.add_response(
+                "2024-04-15 07:00:00", 2, {}, 200, {}, trips, sample_uid="spool:2"
+            )
+    assert count(ApiRequestsTable.table_name) == 5
+    assert count(AvailableTripsStatisticsTable.table_name) == 4
+    assert count(UnavailableTripsStatisticsTable.table_name) == 4
+
+
+def test_request_schedule_slots(db: DataBase):
+    # существует route_id 2, 5
+    schedule_table = db.request_schedule_table
+    week = Week()
+    sunday = Day(Week.days_names[0])
+    sunday.add_to_schedule(2, [time(0, 0), time(23, 59)])
+    week.add(sunday)
+    saturday = Day(Week.days_names[6])
+    saturday.add_to_schedule(2, [time(23, 30)])
+    week.add(saturday)
+    schedule_table.insert_data(route_id=2, schedule=week)
+
+    # Перенос уже существующих JSONB расписаний при создании таблицы слотов
+    schedule_table.execute(
+        f"""
+        DROP TABLE {schedule_table.slots_table_name};
+        DROP TRIGGER {schedule_table.table_name}_slots ON {schedule_table.table_name};
+    """
+    )
+    schedule_table = RequestScheduleTable(db._connection_pool)
+
+    week = schedule_table.get_all_schedule()
+    # 2024-04-14 - воскресенье
+    for from_datetime in [
+        datetime(2024, 4, 14, 0, 0),
+        datetime(2024, 4, 14, 23, 59, 30),
+        datetime(2024, 4, 15, 8, 0),
+        datetime(2024, 4, 15, 12, 0),
+        datetime(2024, 4, 20, 23, 45),
+    ]:
+        assert schedule_table.get_next_time_point(from_datetime) == week.next_time_point(
+            from_datetime
+        )
+
+    assert schedule_table.get_next_time_point(
+        datetime(2024, 4, 15, 8, 0), partition=(0, 2)
+    ) == (datetime(2024, 4, 20, 23, 30), (2,))
+    assert schedule_table.get_next_time_point(
+        datetime(2024, 4, 15, 8, 0), partition=(1, 2)
+    ) == (datetime(2024, 4, 15, 19, 0), (5,))
+
+    # Окно через конец недели
+    due = schedule_table.get_due_routes(
+        datetime(2024, 4, 20, 23, 29, 30), datetime(2024, 4, 21, 0, 1)
+    )
+    assert due == [
+        (datetime(2024, 4, 20, 23, 30), 2),
+        (datetime(2024, 4, 21, 0, 0), 2),
+    ]
+    assert schedule_table.get_due_routes(
+        datetime(2024, 4, 21, 0, 0, 1), datetime(2024, 4, 21, 0, 1)
+    ) == []
+
+
+def test_statistics_rollup(db: DataBase):
+    # существует route_id 2
+    rollup = db.statistics_rollup_table
+    with db.unit_of_work() as uow:
+        for price, wait in [(100, 60), (200, 120), (300, 180)]:
+            trips = [
+                TripInfo(1000, 600, {"class_text": "Эконом", "price": price, "waiting_time": wait}),
+                TripInfo(1000, 600, {"class_text": "Бизнес"}),
+            ]
+            uow.add_response("2024-04-20 10:30:00", 2, {}, 200, {}, trips)
+
+    economy, business = sorted(
+        rollup.get_route_statistics(2, "Saturday"), key=lambda row: row["trip_class"] == "Бизнес"
+    )
+    assert (economy["day_of_week"], economy["hour"]) == (6, 10)
+    assert (economy["samples"], economy["available"], economy["availability"]) == (3, 3, 1.0)
+    assert (economy["price_min"], economy["price_max"], economy["price_mean"]) == (100, 300, 200)
+    assert abs(float(economy["price_std"]) - (20000 / 3) ** 0.5) < 1e-6
+    assert (economy["wait_min"], economy["wait_max"], economy["wait_mean"]) == (60, 180, 120)
+    assert (business["samples"], business["available"], business["price_mean"]) == (3, 0, None)
+    assert business["price_std"] is None and business["wait_std"] is None
+
+    # Свертка корзин совпадает с сырыми замерами
+    cursor = db.routes_table.db_connection.cursor()
+    cursor.execute(
+        f"""
+        SELECT count(*), avg(price) FROM {AvailableTripsStatisticsTable.table_name}
+        WHERE route_id = 2 AND trip_class = 'Эконом';
+    """
+    )
+    samples, price_mean = cursor.fetchone()
+    cursor.close()
+    (total,) = rollup.get_route_statistics(2, trip_class="Эконом", group_by=[])
+    assert (total["samples"], total["price_mean"]) == (samples, price_mean)
+
+    with pytest.raises(ValueError):
+        rollup.get_route_statistics(2, group_by=["price"])
+
+
+def test_iter_route_samples(db: DataBase):
+    # существует route_id 2 с замерами (test_unit_of_work, test_statistics_rollup)
+    def count(table_name):
+        cursor = db.routes_table.db_connection.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE route_id = 2;")
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    batches = list(db.iter_route_samples(2, batch_size=4))
+    samples = [dict(zip(DataBase.sample_columns, row)) for batch in batches for row in batch]
+    assert all(len(batch) <= 4 for batch in batches) and len(batches) > 1
+    assert len(samples) == count(AvailableTripsStatisticsTable.table_name) + count(
+        UnavailableTripsStatisticsTable.table_name
+    )
+    assert [sample["datetime"] for sample in samples] == sorted(
+        sample["datetime"] for sample in samples
+    )
+    available = [sample for sample in samples if sample["available"]]
+    assert all(sample["wait_time"] is not None for sample in available)
+
+    # Отбор по времени
+    samples = [
+        row
+        for batch in db.iter_route_samples(2, start=datetime(2024, 4, 20), end=datetime(2024, 4, 21))
+        for row in batch
+    ]
+    assert len(samples) == 6
+    assert {row[4] for row in samples} == {100.0, 200.0, 300.0, None}
+
+    # Выгрузка идет на своем соединении, брошенная выгрузка его закрывает
+    def exports():
+        cursor = db.routes_table.db_connection.cursor()
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM pg_stat_activity
+            WHERE datname = current_database() AND pid <> pg_backend_pid()
+                AND query LIKE '%route_samples_2%';
+        """
+        )
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    def wait_exports(count):
+        # Отключение соединения видно в pg_stat_activity с задержкой
+        for _ in range(100):
+            if exports() == count:
+                break
+            sleep(0.02)
+        return exports()
+
+    assert wait_exports(0) == 0
+    batches = db.iter_route_samples(2, batch_size=1)
+    assert len(next(batches)) == 1 and len(next(batches)) == 1
+    assert exports() == 1
+    batches.close()
+    assert wait_exports(0) == 0
+
+
+def test_partitions(db: DataBase):
+    # существует route_id 2
+    def count(table_name):
+        cursor = db.routes_table.db_connection.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    trips = [
+        TripInfo(1000, 600, {"class_text": "Эконом", "price": 100, "waiting_time": 60}),
+        TripInfo(1000, 600, {"class_text": "Бизнес"}),
+    ]
+    tables = db.partitioned_tables()
+    for table in tables:
+        table.create_partitions(date(2023, 1, 1), date(2023, 2, 1))
+
+    before = {table.table_name: count(table.table_name) for table in tables}
+    with db.unit_of_work() as uow:
+        uow.add_response("2023-01-15 07:00:00", 2, {}, 200, {}, trips)
+        uow.add_response("2023-02-15 07:00:00", 2, {}, 200, {}, trips)
+    assert all(count(name) == value + 2 for name, value in before.items())
+    assert count(db.requests_table.partition_name(date(2023, 1, 1))) == 1
+    assert count(db.available_trips_statistics_table.partition_name(date(2023, 2, 1))) == 1
+
+    # Январь удаляется целиком, февраль остается
+    dropped = []
+    for table in tables:
+        dropped += table.drop_partitions(date(2023, 2, 1))
+    assert dropped == [table.partition_name(date(2023, 1, 1)) for table in tables]
+    assert all(count(name) == value + 1 for name, value in before.items())
+
+    # Отсоединенная секция остается отдельной таблицей
+    name = db.requests_table.drop_partitions(date(2023, 3, 1), detach=True)[0]
+    assert count(ApiRequestsTable.table_name) == before[ApiRequestsTable.table_name]
+    assert count(name) == 1
+    assert all(month >= date(2023, 3, 1) for _, month in db.requests_table.partitions())
+
+    # Секции на ближайшие месяцы создаются при обслуживании
+    current = PartitionedTable.month_start(date.today())
+    db.maintain_partitions(months_ahead=3)
+    months = [month for _, month in db.requests_table.partitions()]
+    assert months[-4:] == [PartitionedTable.add_months(current, i) for i in range(4)]
+
+
+def test_schema_migrations(db: DataBase):
+    def indexes(table_name):
+        cursor = db.routes_table.db_connection.cursor()
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s;", (table_name,))
+        names = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return names
+
+    # Все изменения применены при создании DataBase
+    with db.connection() as connection:
+        migrations = SchemaMigrations(connection)
+        assert migrations.applied() == [migration[0] for migration in MIGRATIONS]
+        assert migrations.apply() == []
+
+    assert "idx_routes_client_id" in indexes(RoutesTable.table_name)
+    assert "idx_request_schedule_route_id" in indexes(RequestScheduleTable.table_name)
+    # Индекс секционированной таблицы есть и в ее секциях
+    partition = db.available_trips_statistics_table.partitions()[0][0]
+    assert any("route_id" in name for name in indexes(partition))
+
+    # Ошибочное изменение откатывается целиком и не отмечается примененным
+    broken = MIGRATIONS + [
+        (100, "ok", "CREATE INDEX IF NOT EXISTS idx_test_ok ON routes (client_comment);"),
+        (101, "broken", "CREATE INDEX idx_test_broken ON routes (client_id); SELECT 1/0;"),
+        (102, "next", "CREATE INDEX IF NOT EXISTS idx_test_next ON routes (route_id);"),
+    ]
+    with db.connection() as connection:
+        migrations = SchemaMigrations(connection, broken)
+        with pytest.raises(Exception):
+            migrations.apply()
+        assert migrations.applied()[-1] == 100
+        assert [migration[0] for migration in migrations.pending()] == [101, 102]
+    assert "idx_test_ok" in indexes(RoutesTable.table_name)
+    assert "idx_test_broken" not in indexes(RoutesTable.table_name)
+
+
+def test_fetch_jobs(db: DataBase):
+    # существует route_id 2, 5
+    jobs_table = db.fetch_jobs_table
+    due_at = datetime(2024, 4, 15, 7, 0)
+    lease = timedelta(minutes=1)
+
+    assert jobs_table.enqueue([(2, due_at), (5, due_at)]) == 2
+    # Повтор той же точки другим планировщиком
+    assert jobs_table.enqueue([(2, due_at), (5, due_at + lease)]) == 1
+
+    # Строки, заблокированные незавершенной транзакцией, пропускаются
+    with db.unit_of_work() as uow:
+        first = jobs_table.claim("w1", 1, lease, connection=uow.connection)
+        assert [job[1:] for job in first] == [(2, due_at)]
+        other = jobs_table.claim("w2", 10, lease)
+        assert [job[1:] for job in other] == [(5, due_at), (5, due_at + lease)]
+
+    assert jobs_table.claim("w3", 10, lease) == []
+
+    # Завершить можно только свои задания
+    assert jobs_table.complete([first[0][0]], "w2") == 0
+    assert jobs_table.complete([first[0][0]], "w1") == 1
+
+    # Неудачное задание возвращается в очередь
+    assert jobs_table.release([other[0][0]], "w2") == 1
+    retry = jobs_table.claim("w3", 10, timedelta(0))
+    assert [job[0] for job in retry] == [other[0][0]]
+
+    # Аренда истекла - задание забирает другой воркер
+    retry = jobs_table.claim("w1", 10, lease)
+    assert [job[0] for job in retry] == [other[0][0]]
+    assert jobs_table.complete([other[0][0]], "w3") == 0
+    assert jobs_table.complete([other[0][0]], "w1") == 1
+
+    # Продлевается только своя незавершенная аренда
+    assert jobs_table.extend([other[0][0], other[1][0]], "w2", lease) == 1
+    assert jobs_table.extend([other[1][0]], "w1", lease) == 0
+    assert jobs_table.claim("w1", 10, lease) == []
+    assert jobs_table.extend([other[1][0]], "w2", timedelta(0)) == 1
+    assert [job[0] for job in jobs_table.claim("w1", 10, lease)] == [other[1][0]]
+
+
+def bootstrap(config_file: str):
+    DataBase(config_file).close()
+
+
+def test_concurrent_bootstrap(config_file: str):
+    # Воркеры супервизора создают таблицы одновременно в уже созданной БД
+    DataBase._drop_db(config_file)
+    with open(config_file, "r") as file:
+        postgres = yaml.safe_load(file)["postgres"]
+    DataBase._create_database_if_not_exist(
+        **{key: postgres[key] for key in ["dbname", "user", "password", "host", "port"]}
+    )
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=bootstrap, args=(config_file,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+
+    # Триггеры уведомлений созданы по одному разу
+    db = DataBase(config_file)
+    cursor = db.routes_table.db_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname LIKE '%%_notify';")
+    assert cursor.fetchone()[0] == 2
+    cursor.close()
+    db.close()
+
+
 if __name__ == "__main__":
     config_file = "configs/test_db.yml"
+    test_concurrent_bootstrap(config_file)
     DataBase._drop_db(config_file)
     db = DataBase(config_file)
     test_routes_table(db.routes_table)
     test_request_schedule_table(db.request_schedule_table)
+    test_request_schedule_changes(db.request_schedule_table)
+    test_unit_of_work(db)
+    test_statistics_rollup(db)
+    test_iter_route_samples(db)
+    test_partitions(db)
+    test_schema_migrations(db)
+    test_request_schedule_slots(db)
+    test_fetch_jobs(db)
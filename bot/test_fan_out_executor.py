@@ -0,0 +1,66 @@
+from taxi_stats.fan_out_executor import FanOutExecutor, TokenBucket
+import asyncio
+import time
+import pytest
+
+
+def test_concurrency_ceiling():
+    executor = FanOutExecutor(max_concurrency=3)
+    peak = 0
+
+    async def task(item):
+        nonlocal peak
+        peak = max(peak, executor.in_flight)
+        await asyncio.sleep(0.01)
+        return item * 2
+
+    results, stats = asyncio.run(executor.run(task, list(range(10))))
+    assert results == [item * 2 for item in range(10)]
+    assert peak == 3
+    assert stats.tasks == 10
+    assert stats.failed == 0
+    assert stats.max_queue_depth == 7
+    assert len(stats.admission_waits) == 10
+    assert executor.queue_depth == 0
+    assert executor.in_flight == 0
+
+
+def test_errors_are_returned():
+    executor = FanOutExecutor(max_concurrency=2)
+
+    async def task(item):
+        if item == 1:
+            raise ValueError("bad item")
+        return item
+
+    results, stats = asyncio.run(executor.run(task, [0, 1, 2]))
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], ValueError)
+    assert stats.failed == 1
+
+
+def test_rate_limit():
+    # ведро на 5 токенов, далее 50 запусков в секунду
+    executor = FanOutExecutor(max_concurrency=100, rate_limit=50, burst=5)
+
+    async def task(item):
+        return time.monotonic()
+
+    results, stats = asyncio.run(executor.run(task, list(range(15))))
+    # 5 запусков сразу, остальные 10 не быстрее 50/s
+    assert max(results) - min(results) >= 10 / 50 * 0.9
+    assert stats.max_admission_wait() >= 10 / 50 * 0.9
+
+
+def test_token_bucket_validation():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        FanOutExecutor(max_concurrency=0)
+
+
+if __name__ == "__main__":
+    test_concurrency_ceiling()
+    test_errors_are_returned()
+    test_rate_limit()
+    test_token_bucket_validation()
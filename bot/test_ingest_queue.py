@@ -0,0 +1,73 @@
+from taxi_stats.ingest_queue import IngestQueue
+import asyncio
+import pytest
+
+
+def test_batches_and_backpressure():
+    batches = []
+
+    async def scenario():
+        db_free = asyncio.Event()
+
+        async def write(batch):
+            await db_free.wait()
+            batches.append(batch)
+
+        queue = IngestQueue(write, max_size=3, batch_size=2)
+        queue.start()
+        for item in range(3):
+            await queue.put(item)
+        await asyncio.sleep(0)
+        # Писатель держит пачку [0, 1], в очереди 1 элемент из 3
+        assert queue.depth == 1
+
+        await queue.put(3)
+        await queue.put(4)
+        putter = asyncio.create_task(queue.put(5))
+        await asyncio.sleep(0.01)
+        # Очередь полна - поставщик ждет, пока БД не освободится
+        assert not putter.done()
+
+        db_free.set()
+        await putter
+        await queue.close()
+        return queue.stats
+
+    stats = asyncio.run(scenario())
+    assert [item for batch in batches for item in batch] == list(range(6))
+    assert all(len(batch) <= 2 for batch in batches)
+    assert batches[0] == [0, 1]
+    assert stats.enqueued == stats.written == 6
+    assert stats.put_waits == 1
+    assert stats.max_depth == 3
+
+
+def test_write_errors_do_not_stop_writer():
+    written = []
+
+    async def write(batch):
+        if 0 in batch:
+            raise RuntimeError("db is down")
+        written.extend(batch)
+
+    async def scenario():
+        queue = IngestQueue(write, max_size=10, batch_size=1)
+        for item in range(3):
+            await queue.put(item)
+        await queue.close()
+        return queue.stats
+
+    stats = asyncio.run(scenario())
+    assert written == [1, 2]
+    assert stats.batches == 3
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        IngestQueue(lambda batch: None, max_size=0)
+
+
+if __name__ == "__main__":
+    test_batches_and_backpressure()
+    test_write_errors_do_not_stop_writer()
+    test_invalid_sizes()
@@ -0,0 +1,174 @@
+from taxi_stats.core import QueryCore
+from taxi_stats.db_interface import DataBase
+from taxi_stats.route import Route, GeographicCoordinate
+from taxi_stats.taxi_route_info_api import ApiResponse
+from datetime import datetime
+import asyncio
+import json
+import threading
+
+config_file = "configs/test_db.yml"
+client_id = 321
+
+
+class FakeTaxiApi:
+    """
+    API такси без сети: запоминает запросы и отвечает одной поездкой
+    """
+
+    body = json.dumps(
+        {
+            "distance": 1000,
+            "time": 600,
+            "options": [
+                {
+                    "class_name": "econom",
+                    "class_text": "Эконом",
+                    "class_level": 50,
+                    "price": 100.0,
+                    "waiting_time": 60.0,
+                }
+            ],
+        }
+    ).encode()
+
+    def __init__(self) -> None:
+        self.requests: list[Route] = []
+
+    async def request(self, route: Route, taxi_class: str = "econom") -> ApiResponse:
+        self.requests.append(route)
+        await asyncio.sleep(0.01)
+        return ApiResponse({"class": taxi_class}, 200, self.body)
+
+    async def close(self):
+        pass
+
+
+def add_route(db: DataBase, latitude: float = 55.1) -> int:
+    return db.routes_table.insert_data(
+        Route(GeographicCoordinate(latitude, 37.1), GeographicCoordinate(55.2, 37.2)),
+        client_id,
+    )
+
+
+def make_core(**kwargs) -> QueryCore:
+    return QueryCore(
+        CLID="clid",
+        APIKEY="key",
+        ingest_queue_size=0,
+        db_config_file=config_file,
+        **kwargs,
+    )
+
+
+async def close_core(core: QueryCore):
+    if core._watched_connection is not None:
+        asyncio.get_running_loop().remove_reader(core._watched_fd)
+    core._listener.close()
+    await core.taxi_api.close()
+    core.db.close()
+
+
+def test_route_cache_notifications(db: DataBase):
+    async def run():
+        core = make_core()
+        threads = []
+        reload = core.route_cache.reload
+
+        def tracked_reload():
+            threads.append(threading.current_thread().name)
+            reload()
+
+        core.route_cache.reload = tracked_reload
+        try:
+            await core._request_routes_reload()
+            core._watch_listener()
+            route_id = add_route(db)
+            # Кеш перезагружается по NOTIFY, без обращения к маршруту
+            for _ in range(100):
+                if route_id in core.route_cache:
+                    break
+                await asyncio.sleep(0.05)
+            assert route_id in core.route_cache
+            assert len(threads) == 2
+            # Запрос к БД выполняется в пуле потоков, а не в event loop
+            assert all(name.startswith("db") for name in threads)
+
+            db.routes_table.delete_data(client_id, route_id)
+            for _ in range(100):
+                if route_id not in core.route_cache:
+                    break
+                await asyncio.sleep(0.05)
+            assert route_id not in core.route_cache
+        finally:
+            await close_core(core)
+
+    asyncio.run(run())
+
+
+def test_missing_route_jobs_released(db: DataBase):
+    async def run():
+        core = make_core(job_queue=True)
+        core.taxi_api = FakeTaxiApi()
+        try:
+            route_id = add_route(db, latitude=55.3)
+            due_at = datetime(2024, 4, 15, 9, 0)
+            db.fetch_jobs_table.enqueue([(route_id, due_at)])
+            claimed = db.fetch_jobs_table.claim(core.worker_id, 10, core.job_lease)
+            jobs = {route_id: job_id for job_id, route_id, _ in claimed}
+
+            # Маршрута нет в кеше (например, загрузка кеша не удалась)
+            core.route_cache.reload = lambda: None
+            core._routes_changed = False
+            await core._execute_requests(tuple(jobs), due_at, jobs)
+            assert core.taxi_api.requests == []
+
+            # Задание сразу возвращено в очередь, а не ждет истечения аренды
+            cursor = db.routes_table.db_connection.cursor()
+            cursor.execute(
+                "SELECT status, worker FROM fetch_jobs WHERE id = %s;", (jobs[route_id],)
+            )
+            assert cursor.fetchone() == ("pending", None)
+            cursor.close()
+        finally:
+            await close_core(core)
+
+    asyncio.run(run())
+
+
+def test_identical_routes_share_request(db: DataBase):
+    async def run():
+        core = make_core()
+        core.taxi_api = FakeTaxiApi()
+        try:
+            same = [add_route(db, latitude=55.4) for _ in range(3)]
+            other = add_route(db, latitude=55.5)
+            await core._request_routes_reload()
+            await core._execute_requests((*same, other), datetime.now())
+            # Один запрос на одинаковые маршруты и один на отличающийся
+            assert len(core.taxi_api.requests) == 2
+
+            # Ответ записан отдельным замером для каждого маршрута
+            cursor = db.routes_table.db_connection.cursor()
+            for table_name in ["api_requests", "statistics_available"]:
+                cursor.execute(
+                    f"""
+                    SELECT route_id, COUNT(*) FROM {table_name}
+                    WHERE route_id = ANY(%s) GROUP BY route_id;
+                """,
+                    ([*same, other],),
+                )
+                assert dict(cursor.fetchall()) == {id: 1 for id in [*same, other]}
+            cursor.close()
+        finally:
+            await close_core(core)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    DataBase._drop_db(config_file)
+    db = DataBase(config_file)
+    test_route_cache_notifications(db)
+    test_missing_route_jobs_released(db)
+    test_identical_routes_share_request(db)
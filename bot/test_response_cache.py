@@ -0,0 +1,109 @@
+from taxi_stats.response_cache import TtlLruCache
+from taxi_stats.route import Route, GeographicCoordinate
+from taxi_stats.taxi_route_info_api import (
+    ApiResponse,
+    AsyncTaxiRouteInfoApi,
+    CachedTaxiRouteInfoApi,
+)
+import asyncio
+import time
+import pytest
+
+
+def test_ttl_lru_cache():
+    cache = TtlLruCache(ttl=60, max_size=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # "b" давно не использовался и вытесняется
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 2, 1)
+
+
+def test_ttl_expiration():
+    cache = TtlLruCache(ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        TtlLruCache(ttl=0)
+
+
+def test_cache_key_normalization():
+    key = CachedTaxiRouteInfoApi.cache_key(
+        {"rll": "37.5,55.7~37.6,55.8", "class": "econom,business,Econom"}
+    )
+    assert key == (
+        "37.500000,55.700000~37.600000,55.800000",
+        "business,econom",
+    )
+    assert key == CachedTaxiRouteInfoApi.cache_key(
+        {"rll": "37.50,55.70~37.600,55.8", "class": "business, econom"}
+    )
+
+
+def test_api_response_decoded_once():
+    response = ApiResponse({}, 200, b'{"distance": 1000, "options": []}')
+    data = response.json()
+    assert data == {"distance": 1000, "options": []}
+    assert response.json() is data
+
+    # Ответ из кеша получает уже разобранное тело
+    cached = ApiResponse({}, 200, response.content, from_cache=True, data=data)
+    assert cached.json() is data
+
+
+def test_shared_request_failure():
+    route = Route(GeographicCoordinate(55.75, 37.61), GeographicCoordinate(55.8, 37.5))
+    calls = []
+
+    async def fake_request(self, route, taxi_class="econom,business,comfortplus"):
+        calls.append(route)
+        await asyncio.sleep(0.01)
+        if len(calls) in failing:
+            raise ConnectionError("api is down")
+        return ApiResponse(self.make_params(route, taxi_class), 200, b"{}")
+
+    async def run(count: int):
+        api = CachedTaxiRouteInfoApi(CLID="clid", APIKEY="key", cache_ttl=60)
+        results = await asyncio.gather(
+            *(api.request(route) for _ in range(count)), return_exceptions=True
+        )
+        assert api._pending == {}
+        return results
+
+    original = AsyncTaxiRouteInfoApi.request
+    AsyncTaxiRouteInfoApi.request = fake_request
+    try:
+        # Первый запрос не удался - повторяет только один из ожидавших
+        failing = {1}
+        results = asyncio.run(run(4))
+        assert isinstance(results[0], ConnectionError)
+        assert len(calls) == 2
+        assert [result.status_code for result in results[1:]] == [200, 200, 200]
+        assert [result.from_cache for result in results[1:]] == [False, True, True]
+
+        # Все запросы неудачны - каждый получает свою ошибку, а не KeyError
+        calls.clear()
+        failing = {1, 2, 3}
+        results = asyncio.run(run(3))
+        assert len(calls) == 3
+        assert all(isinstance(result, ConnectionError) for result in results)
+    finally:
+        AsyncTaxiRouteInfoApi.request = original
+
+
+if __name__ == "__main__":
+    test_ttl_lru_cache()
+    test_ttl_expiration()
+    test_cache_key_normalization()
+    test_api_response_decoded_once()
+    test_shared_request_failure()
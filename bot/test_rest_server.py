@@ -0,0 +1,87 @@
+from taxi_stats.db_interface import DataBase
+from taxi_stats.rest_server import ServerHandlers
+from taxi_stats.route import Route, GeographicCoordinate
+import asyncio
+import json
+import threading
+import time
+
+config_file = "configs/test_db.yml"
+client_id = 555
+
+
+class FakeRequest:
+    """
+    Запрос aiohttp с телом JSON (используемая обработчиками часть интерфейса)
+    """
+
+    def __init__(self, data: dict) -> None:
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+
+def test_handlers_do_not_block_loop(db: DataBase):
+    handlers = ServerHandlers(db_config_file=config_file)
+    route = Route(GeographicCoordinate(55.5, 37.5), GeographicCoordinate(55.6, 37.6))
+    route_id = db.routes_table.insert_data(route, client_id)
+
+    # Медленный запрос к БД: 0.1 с в потоке, считаем одновременные вызовы
+    get_all_routes = handlers.db.routes_table.get_all_routes
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def slow_get_all_routes(*args, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            time.sleep(0.1)
+            return get_all_routes(*args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    handlers.db.routes_table.get_all_routes = slow_get_all_routes
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        request = FakeRequest({"client_id": client_id})
+        responses = await asyncio.gather(
+            *(handlers.get_all_routes(request) for _ in range(24))
+        )
+        elapsed = time.monotonic() - start
+        task.cancel()
+        return responses, elapsed, ticks
+
+    try:
+        responses, elapsed, ticks = asyncio.run(run())
+        assert all(response.status == 200 for response in responses)
+        routes = json.loads(responses[0].text)["routes"]
+        assert [int(message["route_id"]) for message in routes] == [route_id]
+        # Не больше async_workers запросов одновременно, но параллельно
+        assert peak[0] == 8
+        assert elapsed < 24 * 0.1 / 2
+        # Пока запросы ждут БД, event loop продолжает работать
+        assert ticks >= elapsed / 0.01 / 2
+    finally:
+        handlers.db.routes_table.get_all_routes = get_all_routes
+        db.routes_table.delete_data(client_id, route_id)
+        handlers.db.close()
+
+
+if __name__ == "__main__":
+    DataBase._drop_db(config_file)
+    db = DataBase(config_file)
+    test_handlers_do_not_block_loop(db)
@@ -0,0 +1,65 @@
+from taxi_stats.route import Route, GeographicCoordinate
+from taxi_stats.trip_info import TripInfo
+import pickle
+import pytest
+
+
+def test_coordinates_interned():
+    first = GeographicCoordinate(55.7558260001, "37.6173")
+    second = GeographicCoordinate(55.755826, 37.6173)
+    assert first is second
+    assert (first.latitude, first.longitude) == (55.755826, 37.6173)
+    assert GeographicCoordinate(55.7558, 37.6173) != first
+    with pytest.raises(AttributeError):
+        first.latitude = 0
+    assert pickle.loads(pickle.dumps(first)) is first
+
+
+def test_route_hashable():
+    a = GeographicCoordinate(55.75, 37.61)
+    b = GeographicCoordinate(55.80, 37.50)
+    route = Route(a, b, comment="дом - работа")
+    # Комментарий не влияет на равенство: запрос к API тот же
+    same = Route(GeographicCoordinate(55.75, 37.61), b, comment="другой")
+    assert route == same and hash(route) == hash(same)
+    assert route != Route(b, a)
+    assert len({route, same, Route(b, a)}) == 2
+    assert {route: 1}[same] == 1
+    with pytest.raises(AttributeError):
+        route.comment = ""
+    restored = pickle.loads(pickle.dumps(route))
+    assert restored == route and restored.comment == route.comment
+
+
+def test_trip_info_stores_used_fields():
+    options = {
+        "class_name": "econom",
+        "class_text": "Эконом",
+        "class_level": 50,
+        "price": 120.5,
+        "price_text": "120 руб.",
+        "waiting_time": 203.6,
+    }
+    trip = TripInfo(1000, 600, options)
+    assert trip.is_available() and trip.price() == 120.5 and trip.waiting_time() == 203.6
+    assert trip.to_json()["options"] == {
+        "class_text": "Эконом",
+        "class_level": 50,
+        "price": 120.5,
+        "waiting_time": 203.6,
+    }
+    assert TripInfo.from_json(trip.to_json()) == trip
+    assert pickle.loads(pickle.dumps(trip)) == trip
+    with pytest.raises(AttributeError):
+        trip._price = 0
+
+    unavailable = TripInfo(1000, 600, {"class_text": "Бизнес"})
+    assert not unavailable.is_available() and unavailable.waiting_time() == 0
+    assert unavailable.to_json()["options"] == {"class_text": "Бизнес"}
+    assert len({trip, TripInfo.from_json(trip.to_json()), unavailable}) == 2
+
+
+if __name__ == "__main__":
+    test_coordinates_interned()
+    test_route_hashable()
+    test_trip_info_stores_used_fields()
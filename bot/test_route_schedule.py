@@ -1,4 +1,6 @@
 from taxi_stats.time_schedule import *
+from taxi_stats.core import QueryCore
+from datetime import timedelta
 import pytest
 import json
 
@@ -164,6 +166,21 @@ def test_week_serialization():
     assert other_week == Week.from_json(mapping)
 
 
+def test_week_mapping_changes():
+    week = Week()
+    week.add_mapping(123, {"Sunday": ["07:00", "12:10"], "Monday": []})
+    week.add_mapping(234, {"Sunday": ["07:00"], "Monday": ["09:00"]})
+    assert week.get_mapping() == {"Sunday": ["07:00", "12:10"], "Monday": ["09:00"]}
+    assert sorted(week.days["Sunday"].time_schedule[time(7, 0)]) == [123, 234]
+
+    week.remove_mapping(234, {"Sunday": ["07:00"], "Monday": ["09:00"]})
+    assert week.get_mapping() == {"Sunday": ["07:00", "12:10"]}
+    assert week.days["Sunday"].time_schedule[time(7, 0)] == [123]
+
+    week.remove_mapping(123, {"Sunday": ["07:00", "12:10"], "Friday": ["10:00"]})
+    assert len(week.days) == 0
+
+
 def test_week_time_search():
     week = Week()
     sunday = Day(Week.days_names[0])
@@ -210,6 +227,137 @@ def test_week_time_search():
     assert len(ids) == 0
 
 
+def test_week_timeline():
+    week = Week()
+    sunday = Day(Week.days_names[0])
+    sunday.add_to_schedule(123, [time(0, 0), time(12, 10)])
+    week.add(sunday)
+
+    timeline = week.timeline()
+    assert timeline.minutes == (0, 12 * 60 + 10)
+    assert timeline.values == ((123,), (123,))
+    # без изменений шкала не перестраивается
+    assert week.timeline() is timeline
+
+    # Сб 23:59:30 -> Вс 00:00 (полночь следующего дня)
+    t, ids = week.next_time_point(
+        datetime(year=2024, month=4, day=20, hour=23, minute=59, second=30)
+    )
+    assert t == datetime(year=2024, month=4, day=21, hour=0, minute=0)
+    assert ids == (123,)
+
+    # Изменение дня после компиляции перестраивает шкалу
+    week.days[Week.days_names[0]].add_to_schedule(234, [time(12, 10)])
+    assert week.timeline() is not timeline
+    t, ids = week.next_time_point(datetime(year=2024, month=4, day=21, hour=1))
+    assert t == datetime(year=2024, month=4, day=21, hour=12, minute=10)
+    assert sorted(ids) == [123, 234]
+
+    # Добавление дня тоже
+    monday = Day(Week.days_names[1])
+    monday.add_to_schedule(345, [time(7, 0)])
+    week.add(monday)
+    t, ids = week.next_time_point(datetime(year=2024, month=4, day=21, hour=13))
+    assert t == datetime(year=2024, month=4, day=22, hour=7, minute=0)
+    assert ids == (345,)
+
+    # Время 12:10 уже наступило, следующее в пределах недели - Пн 07:00
+    t, ids = week.next_time_point(
+        datetime(year=2024, month=4, day=21, hour=12, minute=10, second=1)
+    )
+    assert t == datetime(year=2024, month=4, day=22, hour=7, minute=0)
+
+
+def test_search_after_last_week_point():
+    week = Week()
+    monday = Day(Week.days_names[1])
+    monday.add_to_schedule(123, [time(9, 0), time(18, 0)])
+    week.add(monday)
+    lateness = timedelta(minutes=5)
+
+    # Пн 18:00 - последняя точка недели, от нее поиск ничего не находит
+    last_dispatch = datetime(2024, 4, 15, 18, 0)
+    assert week.next_time_point(last_dispatch) == (None, ())
+    now = datetime(2024, 4, 16, 10, 0)
+    start = QueryCore._search_start(last_dispatch, now, lateness)
+    assert start == now - lateness
+    assert week.next_time_point(start) == (datetime(2024, 4, 22, 9, 0), (123,))
+
+    # Недавние точки не теряются: поиск не уходит дальше now - lateness
+    now = datetime(2024, 4, 15, 18, 3)
+    assert QueryCore._search_start(last_dispatch, now, lateness) == last_dispatch
+
+
+
+def test_compact_week():
+    week = Week()
+    sunday = Day(Week.days_names[0])
+    sunday.add_to_schedule(123, [time(0, 0), time(12, 10)])
+    sunday.add_to_schedule(234, [time(12, 10)])
+    week.add(sunday)
+    saturday = Day(Week.days_names[6])
+    saturday.add_to_schedule(345, [time(23, 59)])
+    week.add(saturday)
+
+    compact = CompactWeek.from_week(week)
+    assert compact == week
+    assert week == compact
+    assert compact.get_mapping() == week.get_mapping()
+    assert compact.ids_at(12 * 60 + 10) == (123, 234)
+    assert len(compact) == 4
+
+    # 2024-04-14 - воскресенье
+    for from_datetime in [
+        datetime(2024, 4, 14, 0, 0),
+        datetime(2024, 4, 14, 12, 10),
+        datetime(2024, 4, 16, 11, 50),
+        datetime(2024, 4, 20, 23, 59, 30),
+    ]:
+        assert compact.next_time_point(from_datetime) == week.next_time_point(
+            from_datetime
+        )
+
+    mapping = {"Monday": ["07:00"], "Sunday": ["12:10"]}
+    compact.add_mapping(456, mapping)
+    week.add_mapping(456, mapping)
+    assert compact == week
+    compact.remove_mapping(345, {"Saturday": ["23:59"]})
+    week.remove_mapping(345, {"Saturday": ["23:59"]})
+    assert compact == week
+    assert compact.get_mapping() == week.get_mapping()
+
+    assert CompactWeek.from_mappings([(456, mapping)]).ids_at(12 * 60 + 10) == (456,)
+    assert CompactWeek().next_time_point(datetime(2024, 4, 14)) == (None, ())
+
+
+def test_week_bulk_build():
+    rows = [
+        (1, {"Monday": ["07:00", "08:00"], "Sunday": []}),
+        (2, {"Monday": ["07:00"]}),
+        (1, {"Monday": ["07:00"]}),
+    ]
+    week = Week.from_rows(rows)
+    expected = Week()
+    for id, mapping in rows:
+        expected.add_mapping(id, mapping)
+    assert week == expected
+    assert week.get_mapping() == {"Monday": ["07:00", "08:00"]}
+
+    # Удаляется одно вхождение id на каждое удаление
+    week.remove_mappings([(1, {"Monday": ["07:00"]}), (2, {"Monday": ["07:00"]})])
+    assert week.days["Monday"].time_schedule[time(7, 0)] == [1]
+    week.remove_mappings([(1, {"Monday": ["07:00", "08:00"]})])
+    assert week.get_mapping() == {}
+
+    # Переданный в add день не меняется неделей
+    monday = Day("Monday")
+    monday.add_to_schedule(3, [time(9, 0)])
+    week.add(monday)
+    week.add_mapping(4, {"Monday": ["09:00"]})
+    assert monday.time_schedule == {time(9, 0): [3]}
+    assert week.days["Monday"].time_schedule == {time(9, 0): [3, 4]}
+
+
 if __name__ == "__main__":
     test_day_add_methods()
     test_day_remove_methods()
@@ -217,4 +365,9 @@ if __name__ == "__main__":
     test_day_time_search()
     test_week_add()
     test_week_serialization()
+    test_week_mapping_changes()
     test_week_time_search()
+    test_week_timeline()
+    test_search_after_last_week_point()
+    test_compact_week()
+    test_week_bulk_build()
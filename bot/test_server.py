@@ -5,6 +5,7 @@ from taxi_stats.rest_messages import (
     send_get_route_info_message,
     send_delete_route_schedule_message,
     send_delete_route_message,
+    send_export_route_samples_message,
 )
 from taxi_stats.route import Route, GeographicCoordinate
 from taxi_stats.time_schedule import Day, Week, time
@@ -73,6 +74,13 @@ if __name__ == "__main__":
         assert response is not None
         assert response.schedule == week
 
+        # Замеров у нового маршрута еще нет, чужому клиенту выгрузка недоступна
+        samples = send_export_route_samples_message(url, client_id, id)
+        assert samples is not None and list(samples) == []
+        samples = send_export_route_samples_message(url, client_id, id, format="csv")
+        assert samples is not None and list(samples) == []
+        assert send_export_route_samples_message(url, 123, id) is None
+
         # Удаляю расписание маршрута, т.к. без этого не удалить маршрут
         response = send_delete_route_schedule_message(url, client_id, id)
         assert response.client_id == client_id and response.route_id == id
@@ -0,0 +1,125 @@
+from taxi_stats.spool import Spool
+import json
+import multiprocessing
+import os
+import pytest
+import sys
+
+
+def test_append_and_replay(tmp_path):
+    spool = Spool(str(tmp_path), fsync_batch=2)
+    for uid in range(5):
+        spool.append({"uid": uid})
+    assert spool.pending()
+
+    stored = []
+    assert spool.replay(stored.extend, batch_size=2) == 5
+    assert [record["uid"] for record in stored] == list(range(5))
+    assert not spool.pending()
+    # Записанное не воспроизводится повторно
+    assert spool.replay(stored.extend) == 0
+
+
+def test_replay_resumes_after_failure(tmp_path):
+    spool = Spool(str(tmp_path))
+    for uid in range(3):
+        spool.append({"uid": uid})
+
+    def failing_store(batch):
+        raise ConnectionError("db is down")
+
+    assert spool.replay(failing_store) == 0
+    assert spool.pending()
+
+    # Записи, пришедшие во время простоя, воспроизводятся после старых
+    spool.append({"uid": 3})
+    stored = []
+    assert spool.replay(stored.extend) == 4
+    assert [record["uid"] for record in stored] == [0, 1, 2, 3]
+
+
+def test_corrupted_line_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append({"uid": 0})
+    spool.close()
+    with open(os.path.join(str(tmp_path), Spool.current_name), "a") as file:
+        file.write('{"uid": 1, "trun')
+
+    # Спул после перезапуска процесса
+    spool = Spool(str(tmp_path))
+    stored = []
+    assert spool.replay(stored.extend) == 1
+    assert stored == [{"uid": 0}]
+    assert spool.skipped == 1
+
+
+def test_append_is_flushed(tmp_path):
+    spool = Spool(str(tmp_path), fsync_interval=3600)
+    spool.append({"uid": 0})
+    # Запись видна в файле до fsync и закрытия спула
+    with open(os.path.join(str(tmp_path), Spool.current_name)) as file:
+        assert json.loads(file.read()) == {"uid": 0}
+    spool.sync()
+    spool.close()
+
+
+def append_records(directory: str, worker: int, count: int):
+    spool = Spool(directory, fsync_batch=50)
+    for uid in range(count):
+        spool.append({"uid": f"{worker}:{uid}"})
+    spool.close()
+
+
+def open_spool(directory: str):
+    try:
+        Spool(directory).close()
+    except RuntimeError:
+        sys.exit(1)
+
+
+def test_spool_per_process(tmp_path):
+    # Каталог спула занят - второй спул (в том числе в другом процессе) не открывается
+    spool = Spool(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        Spool(str(tmp_path))
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=open_spool, args=(str(tmp_path),))
+    process.start()
+    process.join()
+    assert process.exitcode != 0
+    spool.close()
+
+    # Воркеры пишут каждый в свой каталог, записи не теряются и не дублируются
+    directories = [os.path.join(str(tmp_path), f"worker-{index}") for index in range(2)]
+    processes = [
+        context.Process(target=append_records, args=(directory, index, 1000))
+        for index, directory in enumerate(directories)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    stored = []
+    for directory in directories:
+        spool = Spool(directory)
+        assert spool.replay(stored.extend) == 1000
+        spool.close()
+    assert sorted(record["uid"] for record in stored) == sorted(
+        f"{worker}:{uid}" for worker in range(2) for uid in range(1000)
+    )
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+
+    for test in [
+        test_append_and_replay,
+        test_replay_resumes_after_failure,
+        test_corrupted_line_is_skipped,
+        test_append_is_flushed,
+        test_spool_per_process,
+    ]:
+        with tempfile.TemporaryDirectory() as directory:
+            test(pathlib.Path(directory))
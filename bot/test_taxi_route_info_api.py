@@ -0,0 +1,57 @@
+from aiohttp import web
+from taxi_stats.route import Route, GeographicCoordinate
+from taxi_stats.taxi_route_info_api import AsyncTaxiRouteInfoApi, TaxiRouteInfoApi
+import asyncio
+
+
+def test_async_client_session():
+    route = Route(GeographicCoordinate(55.75, 37.61), GeographicCoordinate(55.8, 37.5))
+    # Порты клиента, с которых пришли запросы (одно keep-alive соединение - один порт)
+    client_ports = []
+
+    async def handler(request: web.Request):
+        client_ports.append(request.transport.get_extra_info("peername")[1])
+        return web.json_response({"distance": 1000, "options": []})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/taxi_info", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        api_url = TaxiRouteInfoApi.api_url
+        TaxiRouteInfoApi.api_url = f"http://127.0.0.1:{port}/taxi_info"
+        api = AsyncTaxiRouteInfoApi(CLID="clid", APIKEY="key")
+        try:
+            first = await api.request(route)
+            session = api._session
+            second = await api.request(route, "econom")
+            # Одна сессия и одно соединение на все запросы
+            assert api._session is session
+            assert len(set(client_ports)) == 1
+            assert first.status_code == 200 and first.json()["distance"] == 1000
+            assert first.request_params["clid"] == "clid"
+            assert second.request_params["class"] == "econom"
+
+            responses = await asyncio.gather(*(api.request(route) for _ in range(5)))
+            assert all(response.status_code == 200 for response in responses)
+            assert api._session is session
+
+            await api.close()
+            assert session.closed and api._session is None
+            # После close сессия создается заново
+            assert (await api.request(route)).status_code == 200
+            assert api._session is not session
+        finally:
+            TaxiRouteInfoApi.api_url = api_url
+            await api.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_async_client_session()